@@ -0,0 +1,293 @@
+from concurrent.futures import ThreadPoolExecutor
+from models import AudioChunk
+from tracing import span
+from typing import Callable, NamedTuple, Optional
+
+import ffmpeg
+import math
+import numpy as np
+import wave
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+READ_BLOCK_SIZE = SAMPLE_RATE * SAMPLE_WIDTH
+ENERGY_FRAME_SIZE = SAMPLE_RATE // 50
+ENERGY_SMOOTHING_FRAMES = 10
+VAD_FRAME_SIZE = SAMPLE_RATE * 30 // 1000
+VAD_FLOOR_PERCENTILE = 10
+VAD_FLOOR_MARGIN_DB = 10
+VAD_MAX_FLOOR_DB = -45
+FULL_SCALE_DB = 20 * math.log10(32768)
+
+
+class ChunkCodec(NamedTuple):
+    extension: str
+    encoder: Optional[str]
+    bitrate: Optional[str]
+    options: dict = {}
+
+
+# wav chunks are written as raw PCM; the others are encoded by ffmpeg at speech bitrates, which makes a 5 minute chunk
+# of speech about 3 MB (flac), 0.9 MB (opus) or 1.2 MB (mp3) instead of 9.6 MB. Opus runs at compression level 5,
+# which halves its encoding time against the default for almost the same size.
+CHUNK_CODECS = {
+    "wav": ChunkCodec("wav", None, None),
+    "flac": ChunkCodec("flac", "flac", None),
+    "opus": ChunkCodec("opus", "libopus", "24k", {"compression_level": 5}),
+    "mp3": ChunkCodec("mp3", "libmp3lame", "32k"),
+}
+
+
+class VoiceActivity(NamedTuple):
+    threshold_db: float
+    min_silence: float
+    padding: float
+
+
+def get_chunk_codec(name: str) -> ChunkCodec:
+    if name not in CHUNK_CODECS:
+        raise ValueError(f"Unknown audio chunk codec: {name}")
+    return CHUNK_CODECS[name]
+
+
+def plan_chunk_duration(duration: float, target: int) -> int:
+    """Spread duration evenly over the chunks it needs, so the last chunk is not a short remainder."""
+    count = max(1, math.ceil(duration / target))
+    return math.ceil(duration / count)
+
+
+def open_pcm_stream(file_path: str, start_ms: int = 0):
+    return (
+        ffmpeg
+        .input(file_path, **({"ss": start_ms / 1000} if start_ms else {}))
+        .output("pipe:", format="s16le", acodec="pcm_s16le", ac=CHANNELS, ar=SAMPLE_RATE, vn=None)
+        .global_args("-nostdin", "-loglevel", "error")
+        .run_async(pipe_stdout=True)
+    )
+
+
+def open_chunk_writer(chunk_path: str):
+    writer = wave.open(chunk_path, "wb")
+    writer.setnchannels(CHANNELS)
+    writer.setsampwidth(SAMPLE_WIDTH)
+    writer.setframerate(SAMPLE_RATE)
+    return writer
+
+
+def find_silence_cut(samples: np.ndarray, target: int, window: int) -> int:
+    """Return the sample index of the quietest point within window samples of target.
+
+    Energy is computed per 20 ms frame over the whole search region at once and smoothed, so a short gap inside a
+    word does not win over a real pause. Among equally quiet frames the one closest to target is picked.
+    """
+    start = max(target - window, 0)
+    region = samples[start : target + window].astype(np.float32)
+    frame_count = len(region) // ENERGY_FRAME_SIZE
+    if frame_count == 0:
+        return target
+
+    frames = region[: frame_count * ENERGY_FRAME_SIZE].reshape(frame_count, ENERGY_FRAME_SIZE)
+    energy = np.mean(frames * frames, axis=1)
+    if frame_count >= ENERGY_SMOOTHING_FRAMES:
+        kernel = np.ones(ENERGY_SMOOTHING_FRAMES, dtype=np.float32) / ENERGY_SMOOTHING_FRAMES
+        energy = np.convolve(energy, kernel, mode="same")
+
+    centers = start + np.arange(frame_count) * ENERGY_FRAME_SIZE + ENERGY_FRAME_SIZE // 2
+    candidates = np.flatnonzero(energy <= energy.min() * 1.05 + 1e-6)
+    best = candidates[np.argmin(np.abs(centers[candidates] - target))]
+    return int(centers[best])
+
+
+def detect_speech(samples: np.ndarray, vad: VoiceActivity) -> np.ndarray:
+    """Return the [start, end) sample spans of samples that hold speech, as an (n, 2) array.
+
+    A 30 ms frame is speech when its level is above both vad.threshold_db (dBFS) and the noise floor of the chunk
+    plus VAD_FLOOR_MARGIN_DB, so steady background noise is cut as well as digital silence. The floor is capped at
+    VAD_MAX_FLOOR_DB: a loud bed such as music is not noise, and speech over it must not be measured against it.
+    If the relative rule leaves no speech in a chunk that is not silent, the whole chunk is kept, so only chunks
+    below vad.threshold_db throughout are ever dropped. Speech frames are padded by vad.padding seconds on each
+    side, and gaps shorter than vad.min_silence seconds are kept, so pauses between sentences stay in and only long
+    breaks are removed. Every step works on whole frame arrays.
+    """
+    frame_count = len(samples) // VAD_FRAME_SIZE
+    if frame_count == 0:
+        return np.array([[0, len(samples)]]) if len(samples) else np.empty((0, 2), dtype=np.int64)
+
+    frames = samples[: frame_count * VAD_FRAME_SIZE].astype(np.float32).reshape(frame_count, VAD_FRAME_SIZE)
+    level = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-9) - FULL_SCALE_DB
+    floor = min(np.percentile(level, VAD_FLOOR_PERCENTILE), VAD_MAX_FLOOR_DB)
+    speech = level > max(vad.threshold_db, floor + VAD_FLOOR_MARGIN_DB)
+    if not speech.any():
+        if (level > vad.threshold_db).any():
+            return np.array([[0, len(samples)]])
+        return np.empty((0, 2), dtype=np.int64)
+
+    padding = round(vad.padding * SAMPLE_RATE / VAD_FRAME_SIZE)
+    if padding:
+        speech = np.convolve(speech, np.ones(2 * padding + 1), mode="same") > 0
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], speech.astype(np.int8), [0]])))
+    starts, ends = edges[0::2], edges[1::2]
+
+    long_gaps = starts[1:] - ends[:-1] >= vad.min_silence * SAMPLE_RATE / VAD_FRAME_SIZE
+    spans = np.stack([starts[np.r_[True, long_gaps]], ends[np.r_[long_gaps, True]]], axis=1) * VAD_FRAME_SIZE
+    if spans[-1, 1] == frame_count * VAD_FRAME_SIZE:
+        spans[-1, 1] = len(samples)
+    return spans
+
+
+def trim_silence(samples: np.ndarray, vad: VoiceActivity) -> tuple[np.ndarray, list[tuple[int, int]]]:
+    """Cut the non-speech spans out of samples.
+
+    Returns the remaining samples and their offset map: one (trimmed_ms, source_ms) pair per kept span, giving
+    where the span starts in the trimmed audio and in samples. The map is empty when nothing was cut.
+    """
+    spans = detect_speech(samples, vad)
+    if not len(spans):
+        return samples[:0], []
+    if len(spans) == 1 and spans[0, 0] == 0 and spans[0, 1] == len(samples):
+        return samples, []
+
+    trimmed_starts = np.concatenate([[0], np.cumsum(spans[:, 1] - spans[:, 0])[:-1]])
+    offset_map = np.stack([trimmed_starts, spans[:, 0]], axis=1) * 1000 // SAMPLE_RATE
+    trimmed = np.concatenate([samples[start:end] for start, end in spans.tolist()])
+    return trimmed, [(trimmed_ms, source_ms) for trimmed_ms, source_ms in offset_map.tolist()]
+
+
+def write_chunk(samples: np.ndarray, chunk_path: str, codec: ChunkCodec = CHUNK_CODECS["wav"], bitrate: str = None):
+    if codec.encoder is None:
+        writer = open_chunk_writer(chunk_path)
+        try:
+            writer.writeframes(samples.tobytes())
+        finally:
+            writer.close()
+        return
+
+    options = dict(codec.options, acodec=codec.encoder)
+    if bitrate or codec.bitrate:
+        options["audio_bitrate"] = bitrate or codec.bitrate
+    (
+        ffmpeg
+        .input("pipe:", format="s16le", ac=CHANNELS, ar=SAMPLE_RATE)
+        .output(chunk_path, **options)
+        .global_args("-loglevel", "error")
+        .overwrite_output()
+        .run(input=samples.tobytes(), quiet=True)
+    )
+
+
+def stream_chunks(
+    file_path: str,
+    id: str,
+    output_dir: str = "/tmp",
+    segment_duration: int = 300,
+    silence_window: int = 0,
+    codec: str = "wav",
+    bitrate: str = None,
+    vad: Optional[VoiceActivity] = None,
+    start_ms: int = 0,
+    first_number: int = 1,
+    on_chunk: Optional[Callable[[AudioChunk], None]] = None,
+) -> list[AudioChunk]:
+    """Decode the audio track of file_path once and write it as 16 kHz mono chunks of about segment_duration.
+
+    The decoded PCM is read from the ffmpeg pipe block by block and at most segment_duration + silence_window
+    seconds are buffered, so memory use does not depend on the input length. With a silence_window, each cut is
+    moved to the quietest point within that many seconds of the target length. The window is capped at half the
+    segment duration so a cut never lands next to the previous one. Chunks in a compressed codec are encoded on a
+    background thread while the next one is being decoded.
+
+    With vad, the non-speech spans of each chunk are cut out before it is written (see trim_silence), and a chunk
+    that is silent throughout is not written at all. Chunk start and duration stay in stream time; the offset map
+    of a chunk maps times in its trimmed audio back to it.
+
+    To resume an interrupted extraction, start_ms and first_number give the stream time and number of the first
+    chunk to write. on_chunk is called with each chunk, in order, once its file is complete.
+    """
+    chunk_codec = get_chunk_codec(codec)
+    target = segment_duration * SAMPLE_RATE
+    window = min(silence_window * SAMPLE_RATE, target // 2)
+    chunks = []
+    buffer = np.empty(0, dtype=np.int16)
+    pending = []
+    pending_size = 0
+    position = start_ms * SAMPLE_RATE // 1000
+    trimmed_samples = 0
+
+    encoder = ThreadPoolExecutor(max_workers=1)
+    writes = []
+
+    def emit(samples: np.ndarray):
+        nonlocal position, trimmed_samples
+        chunk_start_ms = position * 1000 // SAMPLE_RATE
+        chunk_duration_ms = len(samples) * 1000 // SAMPLE_RATE
+        position += len(samples)
+
+        offset_map = []
+        if vad is not None:
+            speech, offset_map = trim_silence(samples, vad)
+            trimmed_samples += len(samples) - len(speech)
+            if not len(speech):
+                return
+            samples = speech
+
+        chunk = AudioChunk(
+            file_name=f"{id}_{first_number + len(chunks)}.{chunk_codec.extension}",
+            start_ms=chunk_start_ms,
+            duration_ms=chunk_duration_ms,
+            offset_map=offset_map,
+        )
+        if writes:
+            # At most one chunk waits for the encoder, so memory stays bounded when encoding is slower than decoding.
+            writes[-1].result()
+        writes.append(encoder.submit(write, samples, chunk))
+        chunks.append(chunk)
+
+    def write(samples: np.ndarray, chunk: AudioChunk):
+        write_chunk(samples, f"{output_dir}/{chunk.file_name}", chunk_codec, bitrate)
+        if on_chunk is not None:
+            on_chunk(chunk)
+
+    with span("ffmpeg.stream_chunks", segment_duration=segment_duration, codec=codec) as current:
+        process = open_pcm_stream(file_path, start_ms)
+        try:
+            while True:
+                block = process.stdout.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+
+                pending.append(np.frombuffer(block, dtype="<i2"))
+                pending_size += len(block) // SAMPLE_WIDTH
+                if len(buffer) + pending_size < target + window:
+                    continue
+
+                buffer = np.concatenate([buffer, *pending])
+                pending = []
+                pending_size = 0
+
+                while len(buffer) >= target + window:
+                    cut = find_silence_cut(buffer, target, window) if window else target
+                    emit(buffer[:cut])
+                    buffer = buffer[cut:]
+
+            buffer = np.concatenate([buffer, *pending])
+            if len(buffer):
+                emit(buffer)
+        finally:
+            process.stdout.close()
+            return_code = process.wait()
+            encoder.shutdown(wait=True)
+
+        for queued_write in writes:
+            queued_write.result()
+
+        if return_code != 0:
+            raise Exception(f"ffmpeg exited with code {return_code} while extracting audio from {file_path}")
+        current.set(chunks=len(chunks), trimmed_ms=trimmed_samples * 1000 // SAMPLE_RATE)
+
+    if vad is not None:
+        trimmed_seconds = trimmed_samples / SAMPLE_RATE
+        print(f"trimmed {trimmed_seconds:.1f}s of {position / SAMPLE_RATE:.1f}s without speech: {file_path}")
+    print(f"audio successfully extracted in {len(chunks)} chunks: {file_path}")
+    return chunks
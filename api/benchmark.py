@@ -0,0 +1,400 @@
+import os
+import tempfile
+
+# The benchmark is offline: transcription goes to the fake backend and nothing is cached between runs.
+os.environ["TRANSCRIPTION_BACKEND"] = "fake"
+os.environ["TRANSCRIPTION_CACHE"] = "none"
+os.environ["OBJECT_CACHE_ENABLED"] = "false"
+os.environ["ASR_LIMITER"] = "memory"
+os.environ.setdefault("CALLBACK_OUTBOX_DIR", os.path.join(tempfile.gettempdir(), "benchmark-outbox"))
+
+from config import Config
+from datetime import datetime, timezone
+from s3_client import S3Client
+from typing import Callable
+
+import argparse
+import extract_sound_task
+import ffmpeg
+import generate_subtitles_task
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import sys
+import time
+import transform_subtitle_task
+import transform_video_task
+import video_metadata
+
+SUBTITLE_OPTIONS = {
+    "subtitle_font": "Arial",
+    "subtitle_size": 16,
+    "subtitle_color": "#FFFFFF",
+    "subtitle_bold": True,
+    "subtitle_italic": False,
+    "subtitle_underline": False,
+    "subtitle_outline_color": "#000000",
+    "subtitle_outline_thickness": 2,
+    "subtitle_shadow": 0,
+    "subtitle_shadow_color": "#000000",
+    "y_axis_alignment": 0.2,
+}
+
+COMPARED_METRICS = ("wall_seconds", "cpu_seconds", "peak_rss_mb")
+
+
+class LocalS3Client(S3Client):
+    """S3 stand-in storing objects under a local directory and counting the bytes moved in and out of it."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.bucket_name = "benchmark"
+        self.max_concurrency = Config.S3_MAX_CONCURRENCY
+        self.transfer_config = None
+        self.object_cache = None
+        self.client = None
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def path(self, object_name: str) -> str:
+        return os.path.join(self.directory, object_name)
+
+    def upload_file(self, file_path, object_name):
+        os.makedirs(os.path.dirname(self.path(object_name)), exist_ok=True)
+        shutil.copyfile(file_path, self.path(object_name))
+        self.bytes_uploaded += os.path.getsize(file_path)
+        return True
+
+    def _download(self, object_name, file_path) -> bool:
+        if not os.path.exists(self.path(object_name)):
+            print(f"error downloading s3 file {file_path} (no such key {object_name})")
+            return False
+        shutil.copyfile(self.path(object_name), file_path)
+        self.bytes_downloaded += os.path.getsize(file_path)
+        return True
+
+    def head_file(self, object_name) -> dict:
+        stat = os.stat(self.path(object_name))
+        return {"etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}", "size": stat.st_size}
+
+    def get_presigned_url(self, object_name: str, expires_in: int = 3600) -> str:
+        return self.path(object_name)
+
+    def upload_json(self, data, object_name) -> bool:
+        body = json.dumps(data).encode("utf-8")
+        os.makedirs(os.path.dirname(self.path(object_name)), exist_ok=True)
+        with open(self.path(object_name), "wb") as file:
+            file.write(body)
+        self.bytes_uploaded += len(body)
+        return True
+
+    def download_json(self, object_name, strict: bool = False):
+        try:
+            with open(self.path(object_name), "rb") as file:
+                body = file.read()
+        except FileNotFoundError:
+            return None
+        self.bytes_downloaded += len(body)
+        return json.loads(body)
+
+    def delete_file(self, object_name) -> bool:
+        try:
+            os.remove(self.path(object_name))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class RecordingCallbackClient:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, path: str, response) -> str:
+        self.sent.append((path, response.dict()))
+        return path
+
+
+def synthesize_video(video_path: str, duration: int, resolution: str):
+    """Write a test pattern video with a tone over pink noise, muted for 2 seconds out of every 7 so the audio has
+    pauses for the silence-aware chunker to find."""
+    width, height = resolution.split("x")
+    video = ffmpeg.input(f"testsrc2=size={width}x{height}:rate=30:duration={duration}", f="lavfi")
+    tone = ffmpeg.input(f"sine=frequency=220:sample_rate=44100:duration={duration}", f="lavfi")
+    noise = ffmpeg.input(f"anoisesrc=color=pink:amplitude=0.1:sample_rate=44100:duration={duration}", f="lavfi")
+    audio = (
+        ffmpeg
+        .filter([tone, noise], "amix", inputs=2)
+        .filter("volume", volume="if(lt(mod(t,7),5),1,0.01)", eval="frame")
+    )
+
+    (
+        ffmpeg
+        .output(
+            video,
+            audio,
+            video_path,
+            vcodec="libx264",
+            preset="ultrafast",
+            pix_fmt="yuv420p",
+            g=60,
+            acodec="aac",
+            movflags="+faststart",
+        )
+        .global_args("-nostdin", "-loglevel", "error")
+        .overwrite_output()
+        .run()
+    )
+
+
+def prepare_stream(store: LocalS3Client, media_dir: str, stream_id: str, duration: int, resolution: str) -> dict:
+    """Put the synthetic source video and its metadata sidecar in the store, as get_video_task would."""
+    video_path = os.path.join(media_dir, f"benchmark_{duration}s_{resolution}.mp4")
+    if not os.path.exists(video_path):
+        print(f"synthesizing {duration}s {resolution} video: {video_path}")
+        synthesize_video(video_path, duration, resolution)
+
+    file_name = f"{stream_id}.mp4"
+    store.upload_file(video_path, f"{stream_id}/{file_name}")
+    metadata = video_metadata.build_video_metadata({}, video_path)
+    store.upload_json(metadata.model_dump(), f"{stream_id}/{video_metadata.get_metadata_file_name(file_name)}")
+
+    return {
+        "stream_id": stream_id,
+        "file_name": file_name,
+        "size": os.path.getsize(video_path),
+    }
+
+
+def run_extract_sound_legacy(state: dict, store: LocalS3Client) -> dict:
+    Config.AUDIO_CHUNK_STREAMING = False
+    extract_sound_task.extract_sound_task.run(state["stream_id"], state["file_name"])
+    return {}
+
+
+def run_extract_sound(state: dict, store: LocalS3Client) -> dict:
+    Config.AUDIO_CHUNK_STREAMING = True
+    extract_sound_task.extract_sound_task.run(state["stream_id"], state["file_name"])
+    return {}
+
+
+def run_generate_subtitles(state: dict, store: LocalS3Client) -> dict:
+    generate_subtitles_task.generate_subtitles_task.run(state["stream_id"], state["audio_files"])
+    return {}
+
+
+def run_merge_subtitles(state: dict, store: LocalS3Client) -> dict:
+    stream_id = state["stream_id"]
+    workdir = tempfile.mkdtemp(prefix="benchmark-merge-")
+    try:
+        srt_files = state["subtitle_srt_files"]
+        if not store.download_many(
+            [(f"{stream_id}/subtitles/{srt_file}", f"{workdir}/{srt_file}") for srt_file in srt_files]
+        ).success:
+            raise Exception("Failed to download chunk subtitles")
+
+        offsets = generate_subtitles_task.get_chunk_offsets(
+            store.download_json(f"{stream_id}/audios/manifest.json"), state["audio_files"]
+        )
+        generate_subtitles_task.merge_chunk_subtitles(
+            [f"{workdir}/{srt_file}" for srt_file in srt_files],
+            [offsets[srt_file] for srt_file in srt_files],
+            f"{workdir}/{stream_id}.srt",
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {}
+
+
+def run_transform_subtitle(state: dict, store: LocalS3Client) -> dict:
+    transform_subtitle_task.transform_subtitle_task.run(state["stream_id"], state["subtitle_srt_file"], SUBTITLE_OPTIONS)
+    return {}
+
+
+def run_transform_video(state: dict, store: LocalS3Client) -> dict:
+    transform_video_task.transform_video_task.run(
+        state["stream_id"], state["file_name"], {"video_format": "zoomed_916", "video_parts": 1}
+    )
+    return {}
+
+
+def run_transform_video_burned(state: dict, store: LocalS3Client) -> dict:
+    transform_video_task.transform_video_task.run(
+        state["stream_id"], state["file_name"], {"video_format": "zoomed_916", "video_parts": 1}, state["subtitle_ass_file"]
+    )
+    return {}
+
+
+STAGES: dict[str, Callable[[dict, LocalS3Client], dict]] = {
+    "extract_sound_legacy": run_extract_sound_legacy,
+    "extract_sound": run_extract_sound,
+    "generate_subtitles": run_generate_subtitles,
+    "merge_subtitles": run_merge_subtitles,
+    "transform_subtitle": run_transform_subtitle,
+    "transform_video": run_transform_video,
+    "transform_video_burned": run_transform_video_burned,
+}
+
+
+def install_stand_ins(store: LocalS3Client, callbacks: RecordingCallbackClient):
+    for module in (extract_sound_task, generate_subtitles_task, transform_subtitle_task, transform_video_task):
+        module.s3_client = store
+        module.callback_client = callbacks
+
+
+def measure_stage(name: str, state: dict, store_dir: str, results):
+    """Run one stage in this (forked) process, so peak RSS is the stage's own, and report its resource usage."""
+    store = LocalS3Client(store_dir)
+    callbacks = RecordingCallbackClient()
+    install_stand_ins(store, callbacks)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+
+    error = None
+    try:
+        STAGES[name](state, store)
+    except Exception as e:
+        error = repr(e)
+
+    wall_seconds = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    failures = [path for path, _ in callbacks.sent if path.endswith("-failure")]
+    if failures and error is None:
+        error = f"failure callback {failures[0]}"
+
+    results.put({
+        "success": error is None,
+        "error": error,
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_seconds": round(
+            usage.ru_utime - usage_before.ru_utime + usage.ru_stime - usage_before.ru_stime
+            + children.ru_utime - children_before.ru_utime + children.ru_stime - children_before.ru_stime,
+            3,
+        ),
+        "peak_rss_mb": round(max(usage.ru_maxrss, children.ru_maxrss) / 1024, 1),
+        "worker_peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "bytes_uploaded": store.bytes_uploaded,
+        "bytes_downloaded": store.bytes_downloaded,
+        "callbacks": [payload for path, payload in callbacks.sent if not path.endswith("-failure")],
+    })
+
+
+def run_stage(name: str, state: dict, store_dir: str) -> dict:
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=measure_stage, args=(name, state, store_dir, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def run_benchmark(duration: int, resolution: str, stages: list[str], media_dir: str) -> dict:
+    store_dir = tempfile.mkdtemp(prefix="benchmark-store-")
+    try:
+        store = LocalS3Client(store_dir)
+        state = prepare_stream(store, media_dir, f"benchmark{duration}", duration, resolution)
+        report = {"duration": duration, "resolution": resolution, "input_bytes": state["size"], "stages": {}}
+
+        for name in stages:
+            print(f"running {name} on {duration}s of {resolution}")
+            result = run_stage(name, state, store_dir)
+
+            for payload in result.pop("callbacks"):
+                state.update({key: value for key, value in payload.items() if key != "stream_id"})
+
+            report["stages"][name] = result
+            print(f"{name}: {json.dumps(result)}")
+
+        return report
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+def compare_reports(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return the stage metrics of report that are more than threshold (relative) worse than in baseline."""
+    baseline_runs = {(run["duration"], run["resolution"]): run for run in baseline.get("runs", [])}
+    regressions = []
+
+    for run in report["runs"]:
+        baseline_run = baseline_runs.get((run["duration"], run["resolution"]))
+        if baseline_run is None:
+            continue
+
+        for name, result in run["stages"].items():
+            baseline_result = baseline_run["stages"].get(name)
+            if baseline_result is None or not baseline_result["success"] or not result["success"]:
+                continue
+
+            for metric in COMPARED_METRICS:
+                before, after = baseline_result[metric], result[metric]
+                change = (after - before) / before if before else 0.0
+                print(f"{run['duration']}s {name} {metric}: {before} -> {after} ({change:+.1%})")
+                if change > threshold:
+                    regressions.append(f"{run['duration']}s {name} {metric} {change:+.1%}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic media.")
+    parser.add_argument("--durations", default="60,600", help="comma separated input lengths in seconds")
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages, run in pipeline order")
+    parser.add_argument("--media-dir", default=os.path.join(tempfile.gettempdir(), "benchmark-media"))
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    stages = [name for name in STAGES if name in args.stages.split(",")]
+    os.makedirs(args.media_dir, exist_ok=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "audio_chunk_duration": Config.AUDIO_CHUNK_DURATION,
+            "audio_chunk_silence_window": Config.AUDIO_CHUNK_SILENCE_WINDOW,
+            "audio_chunk_codec": Config.AUDIO_CHUNK_CODEC,
+            "transform_video_segments": Config.TRANSFORM_VIDEO_SEGMENTS,
+            "transcription_fake_latency": Config.TRANSCRIPTION_FAKE_LATENCY,
+        },
+        "runs": [
+            run_benchmark(int(duration), args.resolution, stages, args.media_dir)
+            for duration in args.durations.split(",")
+        ],
+    }
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"benchmark report written to {args.output}")
+
+    failed = [
+        f"{run['duration']}s {name}" for run in report["runs"] for name, result in run["stages"].items()
+        if not result["success"]
+    ]
+    if failed:
+        print(f"failed stages: {', '.join(failed)}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare_reports(report, json.load(file), args.threshold)
+        if regressions:
+            print(f"regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
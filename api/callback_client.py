@@ -0,0 +1,241 @@
+from celery.signals import worker_process_init
+from config import Config
+from metrics import phase, record_callback, record_stage_failure
+from job_store import record_callback as record_callback_job
+from tracing import mark_task_failed, span
+from requests.adapters import HTTPAdapter
+
+import fcntl
+import json
+import os
+import random
+import requests
+import threading
+import time
+import uuid
+
+DELIVERED = "delivered"
+REJECTED = "rejected"
+RETRY = "retry"
+
+
+class CallbackClient:
+    """Delivers task results to the Substream API through a durable on-disk outbox.
+
+    send() only writes the callback to the outbox directory and wakes a background flusher thread, so a task returns
+    as soon as its work is done. The flusher posts entries oldest first over a pooled session with a timeout, and
+    reschedules failures with jittered exponential backoff. Entries of a stream that is waiting on a retry are held
+    back so callbacks of one stream are always delivered in order. Since the outbox lives on disk, callbacks queued
+    while the API is down survive worker restarts and are sent by the next flusher that runs on the node.
+    """
+
+    _shared = None
+
+    def __init__(self, config):
+        self.base_url = config.SUBSTREAM_API_URL
+        self.token = config.PROCESSOR_TOKEN
+        self.timeout = config.CALLBACK_TIMEOUT
+        self.pool_size = config.CALLBACK_POOL_SIZE
+        self.retry_base_delay = config.CALLBACK_RETRY_BASE_DELAY
+        self.retry_max_delay = config.CALLBACK_RETRY_MAX_DELAY
+        self.flush_interval = config.CALLBACK_FLUSH_INTERVAL
+        self.outbox_dir = config.CALLBACK_OUTBOX_DIR
+        self.rejected_dir = os.path.join(self.outbox_dir, "rejected")
+        self.outbox_created = False
+
+        self.session = None
+        self.flusher = None
+        self.flusher_pid = None
+        self.wakeup = threading.Event()
+        self.start_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, config) -> "CallbackClient":
+        """Return the process-wide client, so every module reuses the same session and flusher."""
+        if cls._shared is None:
+            cls._shared = cls(config)
+        return cls._shared
+
+    def send(self, path: str, response) -> str:
+        """Queue response for path in the outbox and return the entry name without waiting for delivery."""
+        if path.endswith("-failure"):
+            record_stage_failure(path)
+            mark_task_failed(path)
+        try:
+            record_callback_job(path, response)
+        except Exception as e:
+            # The job store is only a status view: the callback is queued even when its record cannot be updated.
+            print(f"error recording callback {path} of {response.stream_id} in the job store ({e})")
+
+        self.create_outbox()
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        with phase("callback"), span("callback.queue", stream_id=response.stream_id, path=path) as current:
+            write_entry(os.path.join(self.outbox_dir, name), {
+                "path": path,
+                "payload": response.dict(),
+                "stream_id": response.stream_id,
+                "attempts": 0,
+                "next_attempt": 0,
+                "traceparent": current.traceparent,
+            })
+        print(f"queued {path} callback for {response.stream_id} ({name})")
+
+        self.start()
+        self.wakeup.set()
+        return name
+
+    def start(self):
+        """Start the flusher thread of this process. Threads do not survive a fork, so each child starts its own."""
+        with self.start_lock:
+            if self.flusher_pid == os.getpid() and self.flusher.is_alive():
+                return
+
+            self.create_outbox()
+            self.session = self.create_session()
+            self.wakeup = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="callback-flusher", daemon=True)
+            self.flusher_pid = os.getpid()
+            self.flusher.start()
+
+    def create_outbox(self):
+        """Create the outbox directories on first use rather than when the shared client is built, so modules that
+        build it at import time can be imported where the outbox directory is not writable."""
+        if not self.outbox_created:
+            os.makedirs(self.rejected_dir, exist_ok=True)
+            self.outbox_created = True
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": self.token,
+        })
+        return session
+
+    def run(self):
+        while True:
+            try:
+                delay = self.flush()
+            except Exception as e:
+                print(f"error flushing callback outbox ({e})")
+                delay = self.flush_interval
+
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    def flush(self) -> float:
+        """Try every due entry once and return the seconds until the next one is due.
+
+        Worker processes of a node share the outbox; an flock makes sure only one of them drains it at a time.
+        """
+        with open(os.path.join(self.outbox_dir, ".lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return self.flush_interval
+
+            try:
+                return self.flush_entries()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def flush_entries(self) -> float:
+        next_due = self.flush_interval
+        held_streams = set()
+
+        for name in sorted(os.listdir(self.outbox_dir)):
+            entry_path = os.path.join(self.outbox_dir, name)
+            if not name.endswith(".json"):
+                continue
+
+            try:
+                entry = read_entry(entry_path)
+            except (FileNotFoundError, ValueError) as e:
+                print(f"skipping unreadable callback {name} ({e})")
+                continue
+
+            if entry["stream_id"] in held_streams:
+                continue
+
+            wait = entry["next_attempt"] - time.time()
+            if wait > 0:
+                held_streams.add(entry["stream_id"])
+                next_due = min(next_due, wait)
+                continue
+
+            with span(
+                "callback.post",
+                parent=entry.get("traceparent"),
+                stream_id=entry["stream_id"],
+                path=entry["path"],
+                attempt=entry["attempts"] + 1,
+            ) as current:
+                status = self.post(entry["path"], entry["payload"])
+                current.set(status=status)
+                if status != DELIVERED:
+                    current.fail(status)
+            record_callback(status)
+            if status == DELIVERED:
+                os.remove(entry_path)
+            elif status == REJECTED:
+                os.replace(entry_path, os.path.join(self.rejected_dir, name))
+            else:
+                entry["attempts"] += 1
+                delay = self.backoff(entry["attempts"])
+                entry["next_attempt"] = time.time() + delay
+                write_entry(entry_path, entry)
+                print(f"callback {name} failed {entry['attempts']} times, retrying in {delay:.1f}s")
+
+                # The API is unreachable or failing: stop this pass instead of timing out on every queued entry.
+                return min(next_due, delay)
+
+        return next_due
+
+    def post(self, path: str, payload: dict) -> str:
+        print(f"sending {path} callback for {payload.get('stream_id')}")
+        try:
+            response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"error sending {path} callback ({e})")
+            return RETRY
+
+        if response.ok:
+            return DELIVERED
+
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            print(f"{path} callback rejected with status {response.status_code}: {response.text[:200]}")
+            return REJECTED
+
+        print(f"{path} callback failed with status {response.status_code}")
+        return RETRY
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def pending(self) -> int:
+        self.create_outbox()
+        return sum(1 for name in os.listdir(self.outbox_dir) if name.endswith(".json"))
+
+
+def write_entry(entry_path: str, entry: dict):
+    tmp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(entry, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, entry_path)
+
+
+def read_entry(entry_path: str) -> dict:
+    with open(entry_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+@worker_process_init.connect
+def start_callback_flusher(**kwargs):
+    """Drain callbacks left in the outbox by a previous worker as soon as a worker process starts."""
+    CallbackClient.shared(Config).start()
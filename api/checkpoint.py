@@ -0,0 +1,75 @@
+from config import Config
+from models import StageProgress
+from s3_client import S3Client
+from typing import Optional
+
+import hashlib
+import json
+
+# A stage records its progress in {stream_id}/checkpoints/{stage}.json: the outputs it has finished so far and,
+# once it succeeded, its result. The manifest is keyed by a fingerprint of the stage inputs and the settings that
+# change its outputs, so a task re-submitted with other inputs starts over instead of reusing stale work. Deleting
+# the manifest forces a stage to run again from scratch.
+
+
+def fingerprint(inputs: dict) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    def __init__(self, s3_client: S3Client, stream_id: str, stage: str, inputs: dict):
+        self.s3_client = s3_client
+        self.progress = StageProgress(stream_id=stream_id, stage=stage, fingerprint=fingerprint(inputs))
+
+    @classmethod
+    def load(cls, s3_client: S3Client, stream_id: str, stage: str, inputs: dict) -> "Checkpoint":
+        """Return the checkpoint of stage for stream_id, resumed from S3 when a manifest for the same inputs exists."""
+        checkpoint = cls(s3_client, stream_id, stage, inputs)
+        if not Config.CHECKPOINTS_ENABLED:
+            return checkpoint
+
+        saved = s3_client.download_json(checkpoint.object_name)
+        if saved is None:
+            return checkpoint
+
+        progress = StageProgress(**saved)
+        if progress.fingerprint != checkpoint.progress.fingerprint:
+            print(f"ignoring {stage} checkpoint of {stream_id}, it was written for other inputs")
+            return checkpoint
+
+        checkpoint.progress = progress
+        print(f"resuming {stage} of {stream_id} with {len(progress.outputs)} finished outputs")
+        return checkpoint
+
+    @property
+    def object_name(self) -> str:
+        return f"{self.progress.stream_id}/checkpoints/{self.progress.stage}.json"
+
+    @property
+    def completed(self) -> bool:
+        return self.progress.completed
+
+    @property
+    def result(self) -> dict:
+        return self.progress.result
+
+    def done(self, name: str) -> bool:
+        return name in self.progress.outputs
+
+    def output(self, name: str) -> Optional[dict]:
+        return self.progress.outputs.get(name)
+
+    def mark_done(self, name: str, output: dict):
+        self.progress.outputs[name] = output
+        self.save()
+
+    def complete(self, result: dict):
+        self.progress.completed = True
+        self.progress.result = result
+        self.save()
+
+    def save(self) -> bool:
+        """Write the manifest to S3. Checkpoints are best effort: a failed write only costs redone work on a retry."""
+        if not Config.CHECKPOINTS_ENABLED:
+            return False
+        return self.s3_client.upload_json(self.progress.model_dump(), self.object_name)
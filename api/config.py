@@ -12,4 +12,67 @@ class Config:
     S3_ENDPOINT: str = os.getenv("S3_ENDPOINT")
     S3_BUCKET_NAME: str = os.getenv("S3_BUCKET_NAME")
     S3_REGION: str = os.getenv("S3_REGION")
-    RABBITMQ_URL: str = os.getenv("RABBITMQ_URL")
\ No newline at end of file
+    S3_MAX_CONCURRENCY: int = int(os.getenv("S3_MAX_CONCURRENCY", "8"))
+    S3_MULTIPART_CONCURRENCY: int = int(os.getenv("S3_MULTIPART_CONCURRENCY", "8"))
+    S3_MULTIPART_THRESHOLD_MB: int = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16"))
+    S3_MULTIPART_CHUNKSIZE_MB: int = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "16"))
+    OBJECT_CACHE_ENABLED: bool = os.getenv("OBJECT_CACHE_ENABLED", "false").lower() == "true"
+    OBJECT_CACHE_DIR: str = os.getenv("OBJECT_CACHE_DIR", "/tmp/object-cache")
+    OBJECT_CACHE_MAX_BYTES: int = int(os.getenv("OBJECT_CACHE_MAX_BYTES", str(20 * 1024 * 1024 * 1024)))
+    RABBITMQ_URL: str = os.getenv("RABBITMQ_URL")
+    AUDIO_CHUNK_STREAMING: bool = os.getenv("AUDIO_CHUNK_STREAMING", "true").lower() == "true"
+    AUDIO_CHUNK_DURATION: int = int(os.getenv("AUDIO_CHUNK_DURATION", "300"))
+    AUDIO_CHUNK_SILENCE_WINDOW: int = int(os.getenv("AUDIO_CHUNK_SILENCE_WINDOW", "20"))
+    AUDIO_CHUNK_CODEC: str = os.getenv("AUDIO_CHUNK_CODEC", "wav")
+    AUDIO_CHUNK_BITRATE: str = os.getenv("AUDIO_CHUNK_BITRATE", "")
+    AUDIO_VAD: bool = os.getenv("AUDIO_VAD", "false").lower() == "true"
+    AUDIO_VAD_THRESHOLD_DB: float = float(os.getenv("AUDIO_VAD_THRESHOLD_DB", "-45"))
+    AUDIO_VAD_MIN_SILENCE: float = float(os.getenv("AUDIO_VAD_MIN_SILENCE", "2"))
+    AUDIO_VAD_PADDING: float = float(os.getenv("AUDIO_VAD_PADDING", "0.3"))
+    TRANSCRIPTION_BACKEND: str = os.getenv("TRANSCRIPTION_BACKEND", "assemblyai")
+    TRANSCRIPTION_POLL_INTERVAL: float = float(os.getenv("TRANSCRIPTION_POLL_INTERVAL", "3"))
+    TRANSCRIPTION_SUBMIT_CONCURRENCY: int = int(os.getenv("TRANSCRIPTION_SUBMIT_CONCURRENCY", "8"))
+    TRANSCRIPTION_FAKE_LATENCY: float = float(os.getenv("TRANSCRIPTION_FAKE_LATENCY", "0"))
+    TRANSCRIPTION_CACHE: str = os.getenv("TRANSCRIPTION_CACHE", "s3")
+    TRANSCRIPTION_CACHE_DIR: str = os.getenv("TRANSCRIPTION_CACHE_DIR", "/tmp/transcription-cache")
+    TRANSCRIPTION_CACHE_PREFIX: str = os.getenv("TRANSCRIPTION_CACHE_PREFIX", "cache/transcripts")
+    TRANSCRIPTION_CACHE_MAX_BYTES: int = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    TRANSCRIPTION_CACHE_EVICT_INTERVAL: float = float(os.getenv("TRANSCRIPTION_CACHE_EVICT_INTERVAL", "3600"))
+    ASR_LIMITER: str = os.getenv("ASR_LIMITER", "broker")
+    ASR_LIMITER_FILE: str = os.getenv("ASR_LIMITER_FILE", "/srv/limiter/asr.json")
+    ASR_LIMITER_QUEUE: str = os.getenv("ASR_LIMITER_QUEUE", "asr_limiter_state")
+    ASR_MAX_IN_FLIGHT: int = int(os.getenv("ASR_MAX_IN_FLIGHT", "32"))
+    ASR_RATE: float = float(os.getenv("ASR_RATE", "5"))
+    ASR_BURST: int = int(os.getenv("ASR_BURST", "10"))
+    ASR_LEASE_TTL: float = float(os.getenv("ASR_LEASE_TTL", "120"))
+    FUSED_PIPELINE_SCRATCH_DIR: str = os.getenv("FUSED_PIPELINE_SCRATCH_DIR", "/tmp/fused")
+    CHECKPOINTS_ENABLED: bool = os.getenv("CHECKPOINTS_ENABLED", "true").lower() == "true"
+    SCHEDULING_LANES: bool = os.getenv("SCHEDULING_LANES", "true").lower() == "true"
+    SCHEDULING_LONG_JOB_SECONDS: float = float(os.getenv("SCHEDULING_LONG_JOB_SECONDS", "1800"))
+    SCHEDULING_BYTES_PER_SECOND: int = int(os.getenv("SCHEDULING_BYTES_PER_SECOND", "1000000"))
+    SCHEDULING_DEFER_DELAY: float = float(os.getenv("SCHEDULING_DEFER_DELAY", "30"))
+    SCHEDULING_SLOTS_DIR: str = os.getenv("SCHEDULING_SLOTS_DIR", "/tmp/lanes")
+    JOB_STORE_ENABLED: bool = os.getenv("JOB_STORE_ENABLED", "true").lower() == "true"
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "500"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "16"))
+    TRANSFORM_VIDEO_SEGMENTS: int = int(os.getenv("TRANSFORM_VIDEO_SEGMENTS", str(os.cpu_count() or 1)))
+    TRANSFORM_VIDEO_MIN_SEGMENT_DURATION: int = int(os.getenv("TRANSFORM_VIDEO_MIN_SEGMENT_DURATION", "60"))
+    GET_VIDEO_FRAGMENT_CONCURRENCY: int = int(os.getenv("GET_VIDEO_FRAGMENT_CONCURRENCY", "8"))
+    GET_VIDEO_MAX_RETRIES: int = int(os.getenv("GET_VIDEO_MAX_RETRIES", "3"))
+    GET_VIDEO_RETRY_DELAY: int = int(os.getenv("GET_VIDEO_RETRY_DELAY", "30"))
+    GET_VIDEO_STREAMING: bool = os.getenv("GET_VIDEO_STREAMING", "false").lower() == "true"
+    GET_VIDEO_STREAM_BUFFER_PARTS: int = int(os.getenv("GET_VIDEO_STREAM_BUFFER_PARTS", "4"))
+    CALLBACK_OUTBOX_DIR: str = os.getenv("CALLBACK_OUTBOX_DIR", "/srv/outbox")
+    CALLBACK_TIMEOUT: float = float(os.getenv("CALLBACK_TIMEOUT", "10"))
+    CALLBACK_POOL_SIZE: int = int(os.getenv("CALLBACK_POOL_SIZE", "4"))
+    CALLBACK_RETRY_BASE_DELAY: float = float(os.getenv("CALLBACK_RETRY_BASE_DELAY", "1"))
+    CALLBACK_RETRY_MAX_DELAY: float = float(os.getenv("CALLBACK_RETRY_MAX_DELAY", "300"))
+    CALLBACK_FLUSH_INTERVAL: float = float(os.getenv("CALLBACK_FLUSH_INTERVAL", "5"))
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "9010"))
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "none")
+    TRACING_FILE: str = os.getenv("TRACING_FILE", "/srv/traces/spans.jsonl")
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "substream-processor")
+    TRACING_BATCH_SIZE: int = int(os.getenv("TRACING_BATCH_SIZE", "256"))
+    TRACING_EXPORT_INTERVAL: float = float(os.getenv("TRACING_EXPORT_INTERVAL", "5"))
+    SUBTITLES_PROGRESSIVE: bool = os.getenv("SUBTITLES_PROGRESSIVE", "false").lower() == "true"
\ No newline at end of file
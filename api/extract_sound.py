@@ -7,28 +7,44 @@ from pydantic import BaseModel
 from config import Config
 from s3_client import S3Client
 from file_client import FileClient
-from extract_sound_task import extract_sound_task
-from models import ExtractSoundRequest
+from scheduling import StageJob, estimate_stream_seconds, send_stage_batch, send_stage_task
+from models import ExtractSoundBatchRequest, ExtractSoundRequest
 from auth import verify_token
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
 import requests
-import yt_dlp
 import os
 import uuid
 import subprocess
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
 file_client = FileClient()
 
 router = APIRouter(prefix="/api", tags=["sound"])
 
+def extract_sound_job(request: ExtractSoundRequest) -> StageJob:
+    media_seconds = estimate_stream_seconds(
+        s3_client, request.stream_id, request.file_name, request.duration, request.size
+    )
+    return StageJob("extract_sound_task", request.stream_id, [request.stream_id, request.file_name], media_seconds)
+
 @router.post("/extract-sound")
 def extract_sound(request: ExtractSoundRequest, authenticated: bool = Depends(verify_token)):
     print(f"Starting extract sound for stream_id: {request.stream_id}")
 
-    extract_sound_task.delay(request.stream_id, request.stream_file_name)
+    send_stage_task(extract_sound_job(request))
 
     return {
         "stream_id": request.stream_id,
+    }
+
+@router.post("/extract-sound/batch")
+async def extract_sound_batch(batch: ExtractSoundBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting extract sound for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, extract_sound_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
     }
\ No newline at end of file
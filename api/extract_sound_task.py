@@ -1,77 +1,43 @@
-from celery import Celery
 from config import Config
-from kombu import Queue
+from worker import celery, longest_time_limit, task_options
 from s3_client import S3Client
+from callback_client import CallbackClient
 from file_client import FileClient
-from pydub import AudioSegment
-from models import GetVideoResponse, GetVideoFailureResponse, ExtractSoundResponse, ExtractSoundFailureResponse
-
+from checkpoint import Checkpoint
+from video_metadata import get_video_metadata
+from lazy_import import lazy_import
+from metrics import phase, record_ffmpeg
+from tracing import span
+from typing import Callable, Optional
+from models import GetVideoResponse, GetVideoFailureResponse, ExtractSoundResponse, ExtractSoundFailureResponse, AudioChunk, AudioChunkManifest, VideoMetadata
+
+import numpy as np
 import re
-import requests
-import yt_dlp
 import os
-import uuid
-import ffmpeg
-
-celery = Celery(
-    "tasks",
-    broker=Config.RABBITMQ_URL,
-)
-
-celery.conf.update(
-    {
-        "task_serializer": "json",
-        "accept_content": ["json"],
-        "broker_connection_retry_on_startup": True,
-        "task_routes": {
-            "tasks.extract_sound_task": {"queue": "extract_sound_task"},
-        },
-        "task_queues": [
-            Queue(
-                "extract_sound_task", routing_key="extract_sound_task"
-            )
-        ],
-    }
-)
+import time
+
+audio_chunker = lazy_import("audio_chunker")
+ffmpeg = lazy_import("ffmpeg")
+pydub = lazy_import("pydub")
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
 file_client = FileClient()
 
-@celery.task(name="tasks.extract_sound_task", queue='extract_sound_task')
+@celery.task(name="tasks.extract_sound_task", **task_options("extract_sound_task"))
 def extract_sound_task(stream_id: str, stream_file_name: str):
     try:
         print(f"Processing extract sound for {stream_id}")
 
-        s3_key = f"{stream_id}/{stream_file_name}"
-        output_path = f"/tmp/{stream_file_name}"
-
-        if not s3_client.download_file(s3_key, output_path):
-            raise Exception("Failed to download video from S3")
-        
-        audio_file_path = output_path.replace(".mp4", ".mp3")
-
-        if not extract_sound(output_path, audio_file_path):
-            raise Exception("Failed to extract audio")
-
-        wav_file_path = convert_to_wav(audio_file_path)
-        chunk_filenames = chunk_wav(wav_file_path, stream_id)
-
-        for chunk_filename in chunk_filenames:
-            if not s3_client.upload_file(f"/tmp/{chunk_filename}", f"{stream_id}/audios/{chunk_filename}"):
-                raise Exception("Failed to upload chunk to S3")
-
-            if not file_client.delete_file(f"/tmp/{chunk_filename}"):
-                raise Exception("Failed to delete chunk file")
-        
-        if not file_client.delete_file(audio_file_path):
-            raise Exception("Failed to delete audio file")
-        
-        if not file_client.delete_file(wav_file_path):
-            raise Exception("Failed to delete wav file")
-        
-        if not file_client.delete_file(output_path):
-            raise Exception("Failed to delete video file")
+        inputs = get_extract_sound_inputs(stream_id, stream_file_name)
+        checkpoint = Checkpoint.load(s3_client, stream_id, "extract_sound", inputs)
+        if checkpoint.completed:
+            print(f"audio of {stream_id} was already extracted, sending the previous result")
+            chunks = [AudioChunk(**chunk) for chunk in checkpoint.result["chunks"]]
+        else:
+            chunks = extract_and_upload_chunks(stream_id, stream_file_name, checkpoint)
 
+        chunk_filenames = [chunk.file_name for chunk in chunks]
         results_sorted = sorted(chunk_filenames, key=extract_chunk_number)
 
         response = ExtractSoundResponse(
@@ -82,31 +48,147 @@ def extract_sound_task(stream_id: str, stream_file_name: str):
         print(f"Sending extract sound success response to processor for {stream_id}")
         print(response.dict())
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/extract-sound",
-            json=response.dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
+        callback_client.send("/processor/extract-sound", response)
     except Exception as e:
         print(f"Sending extract sound failure response to processor for {stream_id}")
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/extract-sound-failure",
-            json=ExtractSoundFailureResponse(
-                stream_id=stream_id,
-            ).dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
+        callback_client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(
+            stream_id=stream_id,
+        ))
+
+def extract_and_upload_chunks(stream_id: str, stream_file_name: str, checkpoint: Checkpoint) -> list[AudioChunk]:
+    """Extract the audio chunks of the video and upload each one as soon as it is written, recording it in
+    checkpoint. Chunks a previous attempt already uploaded are not extracted again.
+
+    When the streaming chunker resumes after uploaded chunks, it reads the video through a presigned URL and seeks
+    to where it stopped, so only the rest of the video is transferred instead of all of it.
+    """
+    s3_key = f"{stream_id}/{stream_file_name}"
+    output_path = f"/tmp/{stream_file_name}"
+
+    uploaded = sorted(
+        (AudioChunk(**output) for output in checkpoint.progress.outputs.values()), key=lambda chunk: chunk.start_ms
+    )
+    resume_remotely = Config.AUDIO_CHUNK_STREAMING and bool(uploaded)
+    if resume_remotely:
+        video_path = s3_client.get_presigned_url(s3_key, expires_in=longest_time_limit("extract_sound_task"))
+    else:
+        video_path = output_path
+        with phase("download"):
+            if not s3_client.download_file(s3_key, output_path, cached=True):
+                raise Exception("Failed to download video from S3")
+
+    metadata = get_video_metadata(s3_client, stream_id, stream_file_name, video_path)
+
+    def upload_chunk(chunk: AudioChunk):
+        chunk_path = f"/tmp/{chunk.file_name}"
+        if not s3_client.upload_file(chunk_path, f"{stream_id}/audios/{chunk.file_name}"):
+            raise Exception("Failed to upload chunk to S3")
+        if not file_client.delete_file(chunk_path):
+            raise Exception("Failed to delete chunk file")
+        checkpoint.mark_done(chunk.file_name, chunk.model_dump())
+
+    started = time.monotonic()
+    with phase("ffmpeg"):
+        chunks = extract_audio_chunks(
+            video_path, stream_id, metadata=metadata, uploaded=uploaded, on_chunk=upload_chunk
         )
+    record_ffmpeg("extract_audio", metadata.duration, time.monotonic() - started)
+
+    manifest = AudioChunkManifest(stream_id=stream_id, chunks=chunks, codec=Config.AUDIO_CHUNK_CODEC)
+    if not s3_client.upload_json(manifest.model_dump(), f"{stream_id}/audios/manifest.json"):
+        raise Exception("Failed to upload chunk manifest to S3")
+
+    if not resume_remotely and not file_client.delete_file(output_path):
+        raise Exception("Failed to delete video file")
+
+    checkpoint.complete({"chunks": [chunk.model_dump() for chunk in chunks]})
+    return chunks
+
+def get_extract_sound_inputs(stream_id: str, stream_file_name: str) -> dict:
+    """Inputs and settings that determine the chunks extract_sound writes. The ETag and size of the source object
+    are part of them, so a video uploaded again under the same name does not resume from the chunks of the old one."""
+    source = s3_client.head_file(f"{stream_id}/{stream_file_name}")
+    return {
+        "stream_file_name": stream_file_name,
+        "source_etag": source["etag"],
+        "source_size": source["size"],
+        "streaming": Config.AUDIO_CHUNK_STREAMING,
+        "duration": Config.AUDIO_CHUNK_DURATION,
+        "silence_window": Config.AUDIO_CHUNK_SILENCE_WINDOW,
+        "codec": Config.AUDIO_CHUNK_CODEC,
+        "bitrate": Config.AUDIO_CHUNK_BITRATE,
+        "vad": get_voice_activity(),
+    }
+
+def extract_audio_chunks(
+    video_path: str,
+    stream_id: str,
+    output_dir: str = "/tmp",
+    metadata: Optional[VideoMetadata] = None,
+    uploaded: Optional[list[AudioChunk]] = None,
+    on_chunk: Optional[Callable[[AudioChunk], None]] = None,
+) -> list[AudioChunk]:
+    """Write the audio of video_path as chunks in output_dir and return all of them, calling on_chunk as each one is
+    complete. The streaming chunker continues after the uploaded chunks of an interrupted attempt; the legacy path
+    always starts over."""
+    uploaded = uploaded or []
+    segment_duration = Config.AUDIO_CHUNK_DURATION
+    if metadata is not None:
+        if metadata.audio_codec is None:
+            print(f"no audio track in {video_path}, nothing to extract")
+            return []
+        if metadata.duration:
+            segment_duration = audio_chunker.plan_chunk_duration(metadata.duration, Config.AUDIO_CHUNK_DURATION)
+            print(f"planned {segment_duration}s chunks for {metadata.duration}s of audio")
+
+    if Config.AUDIO_CHUNK_STREAMING:
+        resume_ms = uploaded[-1].start_ms + uploaded[-1].duration_ms if uploaded else 0
+        if uploaded:
+            print(f"resuming audio extraction at {resume_ms / 1000}s after {len(uploaded)} uploaded chunks")
+        return uploaded + audio_chunker.stream_chunks(
+            video_path,
+            stream_id,
+            output_dir=output_dir,
+            segment_duration=segment_duration,
+            silence_window=Config.AUDIO_CHUNK_SILENCE_WINDOW,
+            codec=Config.AUDIO_CHUNK_CODEC,
+            bitrate=Config.AUDIO_CHUNK_BITRATE or None,
+            vad=get_voice_activity(),
+            start_ms=resume_ms,
+            first_number=extract_chunk_number(uploaded[-1].file_name) + 1 if uploaded else 1,
+            on_chunk=on_chunk,
+        )
+
+    audio_file_path = video_path.replace(".mp4", ".mp3")
+
+    if not extract_sound(video_path, audio_file_path):
+        raise Exception("Failed to extract audio")
+
+    wav_file_path = convert_to_wav(audio_file_path)
+    chunks = chunk_wav(wav_file_path, stream_id, output_dir, segment_duration, on_chunk)
+
+    if not file_client.delete_file(audio_file_path):
+        raise Exception("Failed to delete audio file")
+
+    if not file_client.delete_file(wav_file_path):
+        raise Exception("Failed to delete wav file")
+
+    return chunks
+
+def get_voice_activity():
+    if not Config.AUDIO_VAD:
+        return None
+    return audio_chunker.VoiceActivity(
+        threshold_db=Config.AUDIO_VAD_THRESHOLD_DB,
+        min_silence=Config.AUDIO_VAD_MIN_SILENCE,
+        padding=Config.AUDIO_VAD_PADDING,
+    )
 
 def extract_sound(file_path: str, audio_file_path: str) -> bool:
     try:
-        ffmpeg.input(file_path).output(f"{audio_file_path}").run()
+        with span("ffmpeg.extract_sound"):
+            ffmpeg.input(file_path).output(f"{audio_file_path}").run()
         print(f"audio successfully extracted: {audio_file_path}")
         return True
     except Exception as e:
@@ -115,24 +197,51 @@ def extract_sound(file_path: str, audio_file_path: str) -> bool:
 
 def convert_to_wav(audio_file_path: str) -> str:
     wav_path = audio_file_path.replace(".mp3", ".wav")
-    ffmpeg.input(audio_file_path).output(wav_path, ac=1, ar=16000, y=None).run(quiet=True)
+    with span("ffmpeg.convert_to_wav"):
+        ffmpeg.input(audio_file_path).output(wav_path, ac=1, ar=16000, y=None).run(quiet=True)
     return wav_path
 
 
-def chunk_wav(audio_file_path: str, id: str) -> list[str]:
-    audio = AudioSegment.from_mp3(audio_file_path)
-    segment_duration = 5 * 60 * 1000
-    chunk_filenames = []
-
-    chunks = [
-        audio[i : i + segment_duration] for i in range(0, len(audio), segment_duration)
-    ]
-    for idx, chunk in enumerate(chunks):
-        chunk.export(f"/tmp/{id}_{idx+1}.wav", format="wav")
-        chunk_filenames.append(f"{id}_{idx+1}.wav")
+def chunk_wav(
+    audio_file_path: str,
+    id: str,
+    output_dir: str = "/tmp",
+    segment_duration: int = Config.AUDIO_CHUNK_DURATION,
+    on_chunk: Optional[Callable[[AudioChunk], None]] = None,
+) -> list[AudioChunk]:
+    audio = pydub.AudioSegment.from_mp3(audio_file_path)
+    segment_duration = segment_duration * 1000
+    codec = audio_chunker.get_chunk_codec(Config.AUDIO_CHUNK_CODEC)
+    vad = get_voice_activity()
+    chunk_list = []
+
+    for start in range(0, len(audio), segment_duration):
+        chunk = audio[start : start + segment_duration]
+        duration_ms = len(chunk)
+        offset_map = []
+        if vad is not None:
+            samples = np.array(chunk.get_array_of_samples(), dtype=np.int16)
+            samples, offset_map = audio_chunker.trim_silence(samples, vad)
+            if not len(samples):
+                continue
+            chunk = chunk._spawn(samples.tobytes())
+
+        chunk_filename = f"{id}_{len(chunk_list)+1}.{codec.extension}"
+        chunk.export(
+            f"{output_dir}/{chunk_filename}",
+            format=codec.extension,
+            codec=codec.encoder,
+            bitrate=Config.AUDIO_CHUNK_BITRATE or codec.bitrate,
+            parameters=[arg for name, value in codec.options.items() for arg in (f"-{name}", str(value))],
+        )
+        chunk_list.append(
+            AudioChunk(file_name=chunk_filename, start_ms=start, duration_ms=duration_ms, offset_map=offset_map)
+        )
+        if on_chunk is not None:
+            on_chunk(chunk_list[-1])
 
-    return chunk_filenames
+    return chunk_list
 
 def extract_chunk_number(item):
-    match = re.search(r"_(\d+)\.wav$", item[0])
+    match = re.search(r"_(\d+)\.\w+$", item)
     return int(match.group(1)) if match else float("inf")
\ No newline at end of file
@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+from scheduling import StageJob, send_stage_batch, send_stage_task
+from models import FusedPipelineBatchRequest, FusedPipelineRequest
+from auth import verify_token
+from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
+
+router = APIRouter(prefix="/api", tags=["pipeline"])
+
+def fused_pipeline_job(request: FusedPipelineRequest) -> StageJob:
+    return StageJob("fused_pipeline_task", request.stream_id, [
+        request.url,
+        request.stream_id,
+        request.subtitle_options.model_dump(),
+        request.video_options.model_dump(),
+        request.burn_subtitles,
+    ])
+
+@router.post("/pipeline/fused")
+def fused_pipeline(request: FusedPipelineRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting fused pipeline for stream_id: {request.stream_id}")
+
+    send_stage_task(fused_pipeline_job(request))
+
+    return {
+        "stream_id": request.stream_id,
+    }
+
+@router.post("/pipeline/fused/batch")
+async def fused_pipeline_batch(batch: FusedPipelineBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting fused pipeline for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, fused_pipeline_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
+    }
\ No newline at end of file
@@ -0,0 +1,170 @@
+from config import Config
+from worker import celery, task_options
+from s3_client import S3Client
+from callback_client import CallbackClient
+from get_video_task import fetch_video, get_file_size
+from extract_sound_task import extract_audio_chunks
+from generate_subtitles_task import transcribe_chunks, generate_chunk_subtitles, merge_chunk_subtitles
+from transform_subtitle_task import convert_srt_to_ass
+from transform_video_task import transform_video
+from video_metadata import build_video_metadata, get_metadata_file_name
+from metrics import phase, record_ffmpeg
+from models import (
+    GetVideoResponse,
+    GetVideoFailureResponse,
+    ExtractSoundResponse,
+    ExtractSoundFailureResponse,
+    GenerateSubtitlesResponse,
+    GenerateSubtitlesFailureResponse,
+    TransformSubtitleOptionsRequest,
+    TransformSubtitleResponse,
+    TransformSubtitleFailureResponse,
+    TransformVideoOptionsRequest,
+    TransformVideoResponse,
+    TransformVideoFailureResponse,
+)
+
+import os
+import shutil
+import time
+
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
+
+FAILURE_CALLBACKS = {
+    "get_video": ("/processor/get-video-url-failure", GetVideoFailureResponse),
+    "extract_sound": ("/processor/extract-sound-failure", ExtractSoundFailureResponse),
+    "generate_subtitles": ("/processor/generate-subtitles-failure", GenerateSubtitlesFailureResponse),
+    "transform_subtitle": ("/processor/transform-subtitle-failure", TransformSubtitleFailureResponse),
+    "transform_video": ("/processor/transform-video-failure", TransformVideoFailureResponse),
+}
+
+# Fused pipeline task
+#
+# Runs every stage for one stream on local scratch storage. Intermediate files (audio chunks, chunk subtitles) never
+# leave the worker; only the source video, the merged srt, the ass file and the transformed video are uploaded, and
+# the same callbacks as the per-stage tasks are sent as each stage completes. Since the chunks are not in the
+# bucket, the extract-sound callback has an empty audio_files list and the generate-subtitles callback an empty
+# subtitle_srt_files list: a fused stream has nothing for a per-stage task to pick up.
+
+@celery.task(name="tasks.fused_pipeline_task", **task_options("fused_pipeline_task"))
+def fused_pipeline_task(
+    url: str, stream_id: str, subtitle_options: dict, video_options: dict, burn_subtitles: bool = False
+):
+    print(f"Processing fused pipeline for {stream_id}")
+    subtitle_options = TransformSubtitleOptionsRequest(**subtitle_options)
+    video_options = TransformVideoOptionsRequest(**video_options)
+
+    workdir = os.path.join(Config.FUSED_PIPELINE_SCRATCH_DIR, stream_id)
+    audio_dir = f"{workdir}/audios"
+    subtitles_dir = f"{workdir}/subtitles"
+    os.makedirs(audio_dir, exist_ok=True)
+    os.makedirs(subtitles_dir, exist_ok=True)
+
+    stage = "get_video"
+    try:
+        video_file_name = f"{stream_id}.mp4"
+        video_path = f"{workdir}/{video_file_name}"
+
+        with phase("download"):
+            video_info = fetch_video(url, video_path)
+
+        with phase("upload"):
+            if not s3_client.upload_file(video_path, f"{stream_id}/{video_file_name}"):
+                raise Exception("Failed to upload video to S3")
+
+        metadata = build_video_metadata(video_info, video_path)
+        if not s3_client.upload_json(metadata.model_dump(), f"{stream_id}/{get_metadata_file_name(video_file_name)}"):
+            raise Exception("Failed to upload video metadata to S3")
+
+        send_callback("/processor/get-video-url", GetVideoResponse(
+            file_name=video_file_name,
+            original_file_name=video_info.get("title") + ".mp4",
+            mime_type="video/mp4",
+            size=get_file_size(video_path),
+            stream_id=stream_id,
+        ))
+
+        stage = "extract_sound"
+        started = time.monotonic()
+        with phase("ffmpeg"):
+            chunks = extract_audio_chunks(video_path, stream_id, audio_dir, metadata)
+        record_ffmpeg("extract_audio", metadata.duration, time.monotonic() - started)
+
+        send_callback("/processor/extract-sound", ExtractSoundResponse(
+            audio_files=[],
+            stream_id=stream_id,
+        ))
+
+        stage = "generate_subtitles"
+        srt_files = {}
+        chunks_by_name = {chunk.file_name: chunk for chunk in chunks}
+        with phase("asr"):
+            for audio_path, words in transcribe_chunks([f"{audio_dir}/{chunk.file_name}" for chunk in chunks], stream_id):
+                chunk = chunks_by_name[os.path.basename(audio_path)]
+                srt_files[chunk.file_name] = generate_chunk_subtitles(audio_path, words, subtitles_dir, chunk.offset_map)
+
+        srt_file_name = f"{stream_id}.srt"
+        srt_path = f"{workdir}/{srt_file_name}"
+        merge_chunk_subtitles(
+            [f"{subtitles_dir}/{srt_files[chunk.file_name]}" for chunk in chunks],
+            [chunk.start_ms for chunk in chunks],
+            srt_path,
+        )
+
+        if not s3_client.upload_file(srt_path, f"{stream_id}/{srt_file_name}"):
+            raise Exception("Failed to upload subtitles to S3")
+
+        send_callback("/processor/generate-subtitles", GenerateSubtitlesResponse(
+            subtitle_srt_file=srt_file_name,
+            subtitle_srt_files=[],
+            stream_id=stream_id,
+        ))
+
+        stage = "transform_subtitle"
+        ass_file_name = srt_file_name.replace('.srt', '.ass')
+        ass_path = f"{workdir}/{ass_file_name}"
+        convert_srt_to_ass(srt_path, ass_path, subtitle_options)
+
+        if not s3_client.upload_file(ass_path, f"{stream_id}/{ass_file_name}"):
+            raise Exception("Failed to upload subtitles to S3")
+
+        send_callback("/processor/transform-subtitle", TransformSubtitleResponse(
+            subtitle_ass_file=ass_file_name,
+            stream_id=stream_id,
+        ))
+
+        stage = "transform_video"
+        file_name_transformed = video_file_name.replace('.mp4', '.transformed.mp4')
+        path_transformed = f"{workdir}/{file_name_transformed}"
+
+        started = time.monotonic()
+        with phase("ffmpeg"):
+            outputs = transform_video(
+                video_path, path_transformed, video_options, ass_path if burn_subtitles else None, metadata
+            )
+        if not outputs:
+            raise Exception("Failed to transform video")
+        record_ffmpeg(video_options.video_format, metadata.duration, time.monotonic() - started, metadata.fps)
+
+        with phase("upload"):
+            if not s3_client.upload_many([(path, f"{stream_id}/{os.path.basename(path)}") for path in outputs]).success:
+                raise Exception("Failed to upload transformed video to S3")
+
+        send_callback("/processor/transform-video", TransformVideoResponse(
+            file_name_transformed=file_name_transformed,
+            file_names_transformed_parts=[os.path.basename(path) for path in outputs[1:]],
+            stream_id=stream_id,
+        ))
+    except Exception as e:
+        print(f"Fused pipeline failed during {stage} for {stream_id} ({e})")
+        path, failure_response = FAILURE_CALLBACKS[stage]
+        send_callback(path, failure_response(stream_id=stream_id))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def send_callback(path: str, response):
+    print(f"Sending {path} response to processor for {response.stream_id}")
+    print(response.dict())
+
+    callback_client.send(path, response)
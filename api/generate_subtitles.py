@@ -7,28 +7,55 @@ from pydantic import BaseModel
 from config import Config
 from s3_client import S3Client
 from file_client import FileClient
-from generate_subtitles_task import generate_subtitles_task
-from models import GenerateSubtitlesRequest
+from scheduling import StageJob, send_stage_batch, send_stage_task
+from models import GenerateSubtitlesBatchRequest, GenerateSubtitlesRequest
 from auth import verify_token
+from rate_limiter import get_asr_limiter
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
 import requests
-import yt_dlp
 import os
 import uuid
 import subprocess
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
 file_client = FileClient()
 
 router = APIRouter(prefix="/api", tags=["subtitles"])
 
+def generate_subtitles_job(request: GenerateSubtitlesRequest) -> StageJob:
+    return StageJob(
+        "generate_subtitles_task",
+        request.stream_id,
+        [request.stream_id, request.audio_files],
+        len(request.audio_files) * Config.AUDIO_CHUNK_DURATION,
+    )
+
 @router.post("/generate-subtitles")
 def generate_subtitles(request: GenerateSubtitlesRequest, authenticated: bool = Depends(verify_token)):
     print(f"Starting generate subtitles for stream_id: {request.stream_id}")
 
-    generate_subtitles_task.delay(request.stream_id, request.audio_files)
+    send_stage_task(generate_subtitles_job(request))
 
     return {
         "stream_id": request.stream_id,
-    }
\ No newline at end of file
+    }
+
+@router.post("/generate-subtitles/batch")
+async def generate_subtitles_batch(batch: GenerateSubtitlesBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting generate subtitles for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, generate_subtitles_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
+    }
+
+@router.get("/generate-subtitles/utilization")
+def generate_subtitles_utilization(authenticated: bool = Depends(verify_token)):
+    # The memory store only holds the state of this process, which never transcribes anything.
+    if Config.ASR_LIMITER == "memory":
+        raise HTTPException(status_code=409, detail="ASR limiter state is not shared with the API (ASR_LIMITER=memory)")
+
+    return get_asr_limiter().stats()
\ No newline at end of file
@@ -1,208 +1,261 @@
-from celery import Celery
 from config import Config
-from kombu import Queue
+from worker import celery, task_options
 from s3_client import S3Client
+from callback_client import CallbackClient
 from file_client import FileClient
-from models import GenerateSubtitlesResponse, GenerateSubtitlesFailureResponse
-from functools import partial
-from concurrent.futures import ThreadPoolExecutor
-from datetime import timedelta
-
-import assemblyai as aai
+from checkpoint import Checkpoint
+from models import GenerateSubtitlesResponse, GenerateSubtitlesFailureResponse, GenerateSubtitlesProgressResponse, AudioChunkManifest
+from typing import Iterator, Optional
+from transcription_client import Word, get_transcription_backend
+from transcription_cache import get_transcription_cache
+from metrics import phase
+
+import os
 import re
-import requests
-
-celery = Celery(
-    "tasks",
-    broker=Config.RABBITMQ_URL,
-)
-
-celery.conf.update(
-    {
-        "task_serializer": "json",
-        "accept_content": ["json"],
-        "broker_connection_retry_on_startup": True,
-        "task_routes": {
-            "tasks.generate_subtitles_task": {"queue": "generate_subtitles_task"},
-        },
-        "task_queues": [
-            Queue(
-                "generate_subtitles_task", routing_key="generate_subtitles_task"
-            )
-        ],
-    }
-)
+import subtitles
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
 file_client = FileClient()
 
-@celery.task(name="tasks.generate_subtitles_task", queue='generate_subtitles_task')
+@celery.task(name="tasks.generate_subtitles_task", **task_options("generate_subtitles_task"))
 def generate_subtitles_task(stream_id: str, audio_files: list[str]):
     try:
         print(f"Processing generate subtitles for {stream_id}")
 
-        partialMultiprocess = partial(multiprocess, stream_id=stream_id)
+        manifest_key = f"{stream_id}/audios/manifest.json"
+        manifest = s3_client.download_json(manifest_key, strict=True)
+        if manifest is None:
+            print(f"no chunk manifest {manifest_key}, assuming chunks of {Config.AUDIO_CHUNK_DURATION}s without trimming")
+        checkpoint = Checkpoint.load(
+            s3_client, stream_id, "generate_subtitles", get_generate_subtitles_inputs(audio_files, manifest)
+        )
+        if checkpoint.completed:
+            print(f"subtitles of {stream_id} were already generated, sending the previous result")
+            send_subtitles_response(stream_id, checkpoint.result["subtitle_srt_files"])
+            return
+
+        merge = ProgressiveMerge(
+            [get_chunk_subtitle_name(audio_file) for audio_file in audio_files],
+            get_chunk_offsets(manifest, audio_files),
+            get_chunk_durations(manifest, audio_files),
+        )
+        offset_maps = get_chunk_offset_maps(manifest)
+
+        pending_files = [
+            audio_file for audio_file in audio_files if not checkpoint.done(get_chunk_subtitle_name(audio_file))
+        ]
+        with phase("download"):
+            for name in [name for name in merge.names if checkpoint.done(name)]:
+                merge.add(name, download_chunk_subtitles(checkpoint.output(name)["key"], name))
+            downloads = s3_client.download_many(
+                [(f"{stream_id}/audios/{audio_file}", f"/tmp/{audio_file}") for audio_file in pending_files]
+            )
+        if not downloads.success:
+            raise Exception()
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(partialMultiprocess, audio_files))
-        
-        results_sorted = sorted(results, key=extract_chunk_number)
-        
-        current_offset = 0
-        subtitle_index = 1
-        merged_subtitles = []
-        for file in results_sorted:
-            output_path = f"/tmp/{file}"
-            parse_subtitles = parse_srt(output_path)
-            for _, timestamps, text in parse_subtitles:
-                new_timestamps = shift_timestamps(timestamps, current_offset)
-                merged_subtitles.append(f"{subtitle_index}\n{new_timestamps}\n{text}\n\n")
-                subtitle_index += 1
+        audio_paths = [result.file_path for result in downloads.results]
+        if len(pending_files) < len(audio_files):
+            print(f"{len(audio_files) - len(pending_files)} chunks of {stream_id} already transcribed, skipping them")
+
+        with phase("asr"):
+            for audio_path, words in transcribe_chunks(audio_paths, stream_id):
+                track = subtitles.remap(subtitles.from_words(words), offset_maps.get(os.path.basename(audio_path)))
+                chunk_name = upload_chunk_subtitles(audio_path, track, stream_id)
+                checkpoint.mark_done(chunk_name, {"key": f"{stream_id}/subtitles/{chunk_name}"})
+                if merge.add(chunk_name, track) and Config.SUBTITLES_PROGRESSIVE and not merge.complete:
+                    send_subtitles_progress(stream_id, merge)
 
-            current_offset += 300
-            file_client.delete_file(output_path)
+        results_sorted = merge.names
 
         s3_srt_key = f"{stream_id}/{stream_id}.srt"
         output_srt_path = f"/tmp/{stream_id}.srt"
 
-        with open(output_srt_path, "w", encoding="utf-8") as f:
-            f.writelines(merged_subtitles)
+        subtitles.write_srt(merge.track(), output_srt_path)
 
-        if not s3_client.upload_file(output_srt_path, s3_srt_key):
-            raise Exception()
+        for file in results_sorted:
+            file_client.delete_file(f"/tmp/{file}")
+
+        with phase("upload"):
+            if not s3_client.upload_file(output_srt_path, s3_srt_key):
+                raise Exception()
         
         if not file_client.delete_file(output_srt_path):
             raise Exception()
 
-        response = GenerateSubtitlesResponse(
-            subtitle_srt_file=f"{stream_id}.srt",
-            subtitle_srt_files=results_sorted,
-            stream_id=stream_id,
-        )
-
-        print(f"Sending generate subtitles success response to processor for {stream_id}")
-        print(response.dict())
+        if Config.SUBTITLES_PROGRESSIVE:
+            s3_client.delete_file(f"{stream_id}/{get_partial_file_name(stream_id)}")
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/generate-subtitles",
-            json=response.dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
+        checkpoint.complete({"subtitle_srt_files": results_sorted})
+        send_subtitles_response(stream_id, results_sorted)
     except Exception as e:
         print(f"Sending generate subtitles failure response to processor for {stream_id}")
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/generate-subtitles-failure",
-            json=GenerateSubtitlesFailureResponse(
-                stream_id=stream_id,
-            ).dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
+        callback_client.send("/processor/generate-subtitles-failure", GenerateSubtitlesFailureResponse(
+            stream_id=stream_id,
+        ))
+
+def get_generate_subtitles_inputs(audio_files: list[str], manifest: Optional[dict]) -> dict:
+    """Inputs that determine the subtitles: the chunks, and how extract_sound cut, trimmed and encoded them.
+
+    Chunk names are the same whatever the extraction settings, so the manifest entries of the chunks are part of
+    the inputs: re-extracting with another duration, voice activity detection or codec starts the subtitles over.
+    """
+    chunks = {chunk["file_name"]: chunk for chunk in manifest["chunks"]} if manifest else {}
+    return {
+        "audio_files": audio_files,
+        "chunks": [chunks.get(audio_file) for audio_file in audio_files],
+        "codec": manifest.get("codec") if manifest else None,
+    }
 
-def multiprocess(chunk: str, stream_id: str):
-    s3_key = f"{stream_id}/audios/{chunk}"
-    output_path = f"/tmp/{chunk}"
+def send_subtitles_response(stream_id: str, subtitle_srt_files: list[str]):
+    response = GenerateSubtitlesResponse(
+        subtitle_srt_file=f"{stream_id}.srt",
+        subtitle_srt_files=subtitle_srt_files,
+        stream_id=stream_id,
+    )
 
-    chunk_name = chunk.replace('.wav', '.srt')
-    srt_output_path = f"/tmp/{chunk_name}"
+    print(f"Sending generate subtitles success response to processor for {stream_id}")
+    print(response.dict())
 
-    if not s3_client.download_file(s3_key, output_path):
-        raise Exception()
+    callback_client.send("/processor/generate-subtitles", response)
 
-    if not generate_subtitle_assemblyAI(output_path, srt_output_path):
-        raise Exception()
+def download_chunk_subtitles(s3_key: str, chunk_name: str) -> subtitles.SubtitleTrack:
+    srt_path = f"/tmp/{chunk_name}"
+    if not s3_client.download_file(s3_key, srt_path):
+        raise Exception(f"Failed to download chunk subtitles {s3_key}")
+
+    return subtitles.read_srt(srt_path)
+
+def transcribe_chunks(audio_paths: list[str], stream_id: str) -> Iterator[tuple[str, list[Word]]]:
+    backend = get_transcription_backend()
+    cache = get_transcription_cache(s3_client)
+
+    if cache is None:
+        yield from backend.iter_transcriptions(audio_paths)
+        return
+
+    yield from cache.iter_transcriptions(backend, audio_paths)
+    print(f"transcription cache stats for {stream_id}: {cache.stats()}")
+
+def generate_chunk_subtitles(
+    audio_path: str, words: list[Word], output_dir: str = "/tmp", offset_map: Optional[list[tuple[int, int]]] = None
+) -> str:
+    return write_chunk_subtitles(audio_path, subtitles.remap(subtitles.from_words(words), offset_map), output_dir)
+
+def write_chunk_subtitles(audio_path: str, track: subtitles.SubtitleTrack, output_dir: str = "/tmp") -> str:
+    chunk_name = get_chunk_subtitle_name(os.path.basename(audio_path))
+    subtitles.write_srt(track, f"{output_dir}/{chunk_name}")
+    return chunk_name
+
+def merge_chunk_subtitles(srt_paths: list[str], offsets: list[int], output_srt_path: str):
+    subtitles.write_srt(subtitles.concat([subtitles.read_srt(path) for path in srt_paths], offsets), output_srt_path)
+
+def upload_chunk_subtitles(audio_path: str, track: subtitles.SubtitleTrack, stream_id: str) -> str:
+    chunk_name = write_chunk_subtitles(audio_path, track)
+    srt_output_path = f"/tmp/{chunk_name}"
 
     if not s3_client.upload_file(srt_output_path, f"{stream_id}/subtitles/{chunk_name}"):
         raise Exception()
 
+    file_client.delete_file(audio_path)
+
     return chunk_name
 
+class ProgressiveMerge:
+    """Collects chunk subtitles as their transcriptions complete, in any order.
+
+    The chunks from the start of the stream up to the first one still missing form the covered prefix; track()
+    merges that prefix, so a partial file never has gaps.
+    """
+
+    def __init__(self, names: list[str], offsets: dict[str, int], durations: dict[str, int]):
+        self.names = sorted(names, key=lambda name: offsets[name])
+        self.offsets = offsets
+        self.durations = durations
+        self.tracks = {}
+        self.ready = 0
+
+    def add(self, name: str, track: subtitles.SubtitleTrack) -> bool:
+        """Add the subtitles of chunk name and return whether the covered prefix grew."""
+        self.tracks[name] = track
+        ready = self.ready
+        while self.ready < len(self.names) and self.names[self.ready] in self.tracks:
+            self.ready += 1
+        return self.ready > ready
+
+    @property
+    def complete(self) -> bool:
+        return self.ready == len(self.names)
+
+    @property
+    def covered_from_ms(self) -> int:
+        return self.offsets[self.names[0]] if self.names else 0
+
+    @property
+    def covered_until_ms(self) -> int:
+        if not self.ready:
+            return self.covered_from_ms
+        last = self.names[self.ready - 1]
+        return self.offsets[last] + self.durations[last]
+
+    def track(self) -> subtitles.SubtitleTrack:
+        names = self.names[:self.ready]
+        return subtitles.concat([self.tracks[name] for name in names], [self.offsets[name] for name in names])
+
+def get_partial_file_name(stream_id: str) -> str:
+    return f"{stream_id}.partial.srt"
+
+def send_subtitles_progress(stream_id: str, merge: ProgressiveMerge):
+    """Upload the covered prefix as the partial srt and report its time range. Progress is best effort: a failed
+    upload is logged and the task carries on."""
+    partial_file_name = get_partial_file_name(stream_id)
+    partial_path = f"/tmp/{partial_file_name}"
+    subtitles.write_srt(merge.track(), partial_path)
+
+    uploaded = s3_client.upload_file(partial_path, f"{stream_id}/{partial_file_name}")
+    file_client.delete_file(partial_path)
+    if not uploaded:
+        print(f"Skipping generate subtitles progress for {stream_id}, partial subtitles upload failed")
+        return
+
+    callback_client.send("/processor/generate-subtitles-progress", GenerateSubtitlesProgressResponse(
+        subtitle_srt_file=partial_file_name,
+        covered_from_ms=merge.covered_from_ms,
+        covered_until_ms=merge.covered_until_ms,
+        chunks_done=merge.ready,
+        chunks_total=len(merge.names),
+        stream_id=stream_id,
+    ))
+
+def get_chunk_subtitle_name(audio_file: str) -> str:
+    return os.path.splitext(audio_file)[0] + '.srt'
+
 def extract_chunk_number(item):
-    match = re.search(r"_(\d+)\.srt$", item[0])
+    match = re.search(r"_(\d+)\.\w+$", item)
     return int(match.group(1)) if match else float("inf")
 
-def ms_to_srt_time(ms):
-    td = timedelta(milliseconds=ms)
-    return f"{td.seconds // 3600:02}:{(td.seconds % 3600) // 60:02}:{td.seconds % 60:02},{td.microseconds // 1000:03}"
-
-def generate_subtitle_assemblyAI(output_path: str, srt_output_path: str) -> bool:
-    print("Uploading file for transcription...")
-
-    aai.settings.api_key = Config.ASSEMBLY_AI_API_KEY
-    config = aai.TranscriptionConfig(language_detection=True)
-    transcriber = aai.Transcriber(config=config)
-
-    transcript = transcriber.transcribe(output_path)
-    words = transcript.words
-
-    srtContent = ""
-    subIndex = 1
-    currentLine = []
-    startTime = words[0].start
-
-    for i, word in enumerate(words):
-        currentLine.append(word.text)
-
-        if len(currentLine) >= 6 or i == len(words) - 1:
-            endTime = words[i].end
-
-            mid_index = len(currentLine) // 2
-            first_line = " ".join(currentLine[:mid_index])
-            second_line = " ".join(currentLine[mid_index:])
-
-            srtContent += f"{subIndex}\n"
-            srtContent += f"{ms_to_srt_time(startTime)} --> {ms_to_srt_time(endTime)}\n"
-            srtContent += f"{first_line}\n{second_line}\n\n"
-
-            subIndex += 1
-            currentLine = []
-            if i < len(words) - 1:
-                startTime = words[i + 1].start
-
-    print("File successfully transcribed")
-
-    with open(srt_output_path, "w", encoding="utf-8") as file:
-        file.write(srtContent)
-
-    print("SRT file successfully generated")
-    return True
-
-def parse_srt(srt_file_path):
-    subtitles = []
-    with open(srt_file_path, "r", encoding="utf-8") as file:
-        content = file.read().strip()
-
-    entries = re.split(r"\n\n+", content)
-    for entry in entries:
-        lines = entry.split("\n")
-        if len(lines) >= 3:
-            num = int(lines[0])
-            timestamps = lines[1]
-            text = "\n".join(lines[2:])
-            subtitles.append((num, timestamps, text))
-
-    return subtitles
-
-def shift_timestamps(timestamps, offset_seconds):
-    def convertToMs(timestamp):
-        match = re.match(r"(\d+):(\d+):(\d+),(\d+)", timestamp)
-        if not match:
-            raise ValueError(f"Format de timestamp invalide : {timestamp}")
-        h, m, s, ms = map(int, match.groups())
-        return (h * 3600 + m * 60 + s) * 1000 + ms
-
-    def convertFromMs(ms):
-        h, ms = divmod(ms, 3600000)
-        m, ms = divmod(ms, 60000)
-        s, ms = divmod(ms, 1000)
-        return f"{h:02}:{m:02}:{s:02},{ms:03}"
-
-    start, end = timestamps.split(" --> ")
-    start_ms = convertToMs(start) + offset_seconds * 1000
-    end_ms = convertToMs(end) + offset_seconds * 1000
-    return f"{convertFromMs(start_ms)} --> {convertFromMs(end_ms)}"
\ No newline at end of file
+def get_chunk_offsets(manifest: Optional[dict], audio_files: list[str]) -> dict[str, int]:
+    if manifest is None:
+        return {
+            get_chunk_subtitle_name(audio_file): (extract_chunk_number(audio_file) - 1) * Config.AUDIO_CHUNK_DURATION * 1000
+            for audio_file in audio_files
+        }
+
+    manifest = AudioChunkManifest(**manifest)
+    return {get_chunk_subtitle_name(chunk.file_name): chunk.start_ms for chunk in manifest.chunks}
+
+def get_chunk_durations(manifest: Optional[dict], audio_files: list[str]) -> dict[str, int]:
+    if manifest is None:
+        return {get_chunk_subtitle_name(audio_file): Config.AUDIO_CHUNK_DURATION * 1000 for audio_file in audio_files}
+
+    manifest = AudioChunkManifest(**manifest)
+    return {get_chunk_subtitle_name(chunk.file_name): chunk.duration_ms for chunk in manifest.chunks}
+
+
+def get_chunk_offset_maps(manifest: Optional[dict]) -> dict[str, list[tuple[int, int]]]:
+    """Offset maps of the chunks trimmed by voice activity detection, by audio file name."""
+    if manifest is None:
+        return {}
+
+    manifest = AudioChunkManifest(**manifest)
+    return {chunk.file_name: chunk.offset_map for chunk in manifest.chunks if chunk.offset_map}
\ No newline at end of file
@@ -7,28 +7,41 @@ from pydantic import BaseModel
 from config import Config
 from s3_client import S3Client
 from file_client import FileClient
-from get_video_task import get_video_task
-from models import GetVideoRequest
+from scheduling import StageJob, send_stage_batch, send_stage_task
+from models import GetVideoBatchRequest, GetVideoRequest
 from auth import verify_token
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
 import requests
-import yt_dlp
 import os
 import uuid
 import subprocess
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
 file_client = FileClient()
 
 router = APIRouter(prefix="/api", tags=["video"])
 
+def get_video_job(request: GetVideoRequest) -> StageJob:
+    return StageJob("get_video_task", request.stream_id, [request.url, request.stream_id])
+
 @router.post("/download/video/url")
 def get_video_from_url(request: GetVideoRequest, authenticated: bool = Depends(verify_token)):
     print(f"Starting download for stream_id: {request.stream_id}")
 
-    get_video_task.delay(request.url, request.stream_id)
+    send_stage_task(get_video_job(request))
 
     return {
         "stream_id": request.stream_id,
+    }
+
+@router.post("/download/video/url/batch")
+async def get_video_from_url_batch(batch: GetVideoBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting download for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, get_video_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
     }
\ No newline at end of file
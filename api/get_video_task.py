@@ -1,62 +1,57 @@
-from celery import Celery
 from config import Config
-from kombu import Queue
+from worker import celery, task_options
 from s3_client import S3Client
+from callback_client import CallbackClient
 from file_client import FileClient
-from pydub import AudioSegment
+from video_metadata import build_video_metadata, get_metadata_file_name
+from lazy_import import lazy_import
+from metrics import phase
+from tracing import span
 from models import GetVideoResponse, GetVideoFailureResponse, ExtractSoundResponse, ExtractSoundFailureResponse
 
-import re
-import requests
-import yt_dlp
+import copy
 import os
-import uuid
-import ffmpeg
-
-celery = Celery(
-    "tasks",
-    broker=Config.RABBITMQ_URL,
-)
-
-celery.conf.update(
-    {
-        "task_serializer": "json",
-        "accept_content": ["json"],
-        "broker_connection_retry_on_startup": True,
-        "task_routes": {
-            "tasks.get_video_task": {"queue": "get_video_task"},
-        },
-        "task_queues": [
-            Queue(
-                "get_video_task", routing_key="get_video_task"
-            )
-        ],
-    }
-)
 
-s3_client = S3Client(Config)
+ffmpeg = lazy_import("ffmpeg")
+yt_dlp = lazy_import("yt_dlp")
+
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
 file_client = FileClient()
 
+VIDEO_FORMAT = "bestvideo[height<=720]+bestaudio/best[height<=720]"
+STREAMABLE_PROTOCOLS = ("http", "https", "m3u8", "m3u8_native")
+
 # Get video task
 
-@celery.task(name="tasks.get_video_task", queue='get_video_task')
-def get_video_task(url: str, stream_id: str):
+@celery.task(name="tasks.get_video_task", bind=True, max_retries=Config.GET_VIDEO_MAX_RETRIES, **task_options("get_video_task"))
+def get_video_task(self, url: str, stream_id: str):
     print(f"Processing download for {stream_id}")
 
     try:
-        format = "bestvideo[height<=720]+bestaudio/best[height<=720]"
         video_id = stream_id
         output_path = f"/tmp/{video_id}.mp4"
-
-        ydl_opts = {
-            "format": format,
-            "outtmpl": output_path,
-            "merge_output_format": "mp4",
-        }
-
-        video_info = get_video_info(format, url)
-        download_video(ydl_opts, url)
-        file_size = get_file_size(output_path)
+        object_name = f"{stream_id}/{video_id}.mp4"
+
+        with phase("download"):
+            raw_info = extract_video_info(url)
+            video_info = select_formats(raw_info) if Config.GET_VIDEO_STREAMING else None
+
+        if video_info is not None and is_streamable(video_info):
+            with phase("download"):
+                file_size = stream_video(video_info, object_name)
+            metadata_source = s3_client.get_presigned_url(object_name)
+            streamed = True
+        else:
+            with phase("download"):
+                video_info = fetch_video(url, output_path, raw_info, video_info)
+            file_size = get_file_size(output_path)
+
+            with phase("upload"):
+                if not s3_client.upload_file(output_path, object_name):
+                    raise Exception("Failed to upload video to S3")
+            metadata_source = output_path
+            streamed = False
 
         response = GetVideoResponse(
             file_name=f"{video_id}.mp4",
@@ -66,53 +61,160 @@ def get_video_task(url: str, stream_id: str):
             stream_id=stream_id,
         )
 
-        if not s3_client.upload_file(output_path, f"{stream_id}/{video_id}.mp4"):
-            raise Exception("Failed to upload video to S3")
+        metadata = build_video_metadata(video_info, metadata_source, keyframes=not streamed)
+        if not s3_client.upload_json(metadata.model_dump(), f"{stream_id}/{get_metadata_file_name(f'{video_id}.mp4')}"):
+            raise Exception("Failed to upload video metadata to S3")
 
-        if not file_client.delete_file(output_path):
+        if os.path.exists(output_path) and not file_client.delete_file(output_path):
             raise Exception("Failed to delete video file")
 
         print(f"Sending get video success response to processor for {stream_id}")
         print(response.dict())
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/get-video-url",
-            json=response.dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
+        callback_client.send("/processor/get-video-url", response)
+    except yt_dlp.utils.DownloadError as e:
+        if self.request.retries < self.max_retries:
+            print(f"Download failed for {stream_id}, retrying and resuming from the partial file ({e})")
+            raise self.retry(exc=e, countdown=Config.GET_VIDEO_RETRY_DELAY)
+
+        print(f"Sending get video failure response to processor for {stream_id}")
+
+        callback_client.send("/processor/get-video-url-failure", GetVideoFailureResponse(
+            stream_id=stream_id,
+        ))
     except Exception as e:
         print(f"Sending get video failure response to processor for {stream_id}")
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/get-video-url-failure",
-            json=GetVideoFailureResponse(
-                stream_id=stream_id,
-            ).dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
+        callback_client.send("/processor/get-video-url-failure", GetVideoFailureResponse(
+            stream_id=stream_id,
+        ))
+
+def extract_video_info(url: str) -> dict:
+    """Run the extractor without processing its result, so formats are only selected on the path that uses them."""
+    with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+        return ydl.extract_info(url, download=False, process=False)
+
+# Options that decide which formats are selected and the container they are merged into. They must be the same
+# when selecting formats and when downloading, since fetch_video downloads the selection of select_formats as is.
+FORMAT_OPTIONS = {"quiet": True, "format": VIDEO_FORMAT, "merge_output_format": "mp4"}
+
+def select_formats(raw_info: dict) -> dict:
+    """Return the processed info dict of raw_info with its formats selected, leaving raw_info untouched."""
+    with yt_dlp.YoutubeDL(FORMAT_OPTIONS) as ydl:
+        return ydl.process_ie_result(copy.deepcopy(raw_info), download=False)
+
+def fetch_video(url: str, output_path: str, raw_info: dict = None, video_info: dict = None) -> dict:
+    """Download the video and return its processed info dict. video_info, the result of select_formats, is
+    downloaded as is; otherwise raw_info, an unprocessed info dict from extract_video_info, is processed, and the
+    info is extracted first when neither is given.
+
+    Either way the extractor and format selection run once: process_info only downloads (and merges) the formats
+    already selected, and process_ie_result selects them as part of the download. Fragmented (HLS/DASH) sources are
+    fetched with concurrent fragment downloads, and partial files are kept so a retried task on the same node
+    resumes where the previous attempt stopped.
+    """
+    progress = DownloadProgress()
+    ydl_opts = {
+        **FORMAT_OPTIONS,
+        "outtmpl": output_path,
+        "concurrent_fragment_downloads": Config.GET_VIDEO_FRAGMENT_CONCURRENCY,
+        "continuedl": True,
+        "retries": 10,
+        "fragment_retries": 10,
+        "progress_hooks": [progress.hook],
+    }
+
+    with span("yt_dlp.download") as current, yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if video_info is not None:
+            video_info = copy.deepcopy(video_info)
+            ydl.process_info(video_info)
+        else:
+            if raw_info is None:
+                raw_info = ydl.extract_info(url, download=False, process=False)
+            video_info = ydl.process_ie_result(raw_info, download=True)
+        current.set(**progress.stats())
+
+    print(f"download finished for {url} {progress.stats()}")
+    return video_info
+
+def is_streamable(video_info: dict) -> bool:
+    formats = video_info.get("requested_formats") or [video_info]
+    return all(format.get("protocol") in STREAMABLE_PROTOCOLS for format in formats)
+
+def stream_video(video_info: dict, object_name: str) -> int:
+    """Remux the selected formats into a fragmented mp4 on the ffmpeg stdout and upload it while it is produced.
+
+    Nothing is written to scratch disk; memory is bounded by GET_VIDEO_STREAM_BUFFER_PARTS multipart parts. Returns
+    the uploaded size in bytes.
+    """
+    formats = video_info.get("requested_formats") or [video_info]
+    inputs = []
+    for format in formats:
+        headers = "".join(f"{name}: {value}\r\n" for name, value in (format.get("http_headers") or {}).items())
+        inputs.append(ffmpeg.input(format["url"], headers=headers) if headers else ffmpeg.input(format["url"]))
+
+    with span("ffmpeg.stream_video", inputs=len(inputs)):
+        return remux_to_s3(inputs, object_name)
+
+def remux_to_s3(inputs: list, object_name: str) -> int:
+    process = (
+        ffmpeg
+        .output(
+            inputs[0]["v:0"],
+            inputs[-1]["a:0?"],
+            "pipe:",
+            format="mp4",
+            c="copy",
+            movflags="frag_keyframe+empty_moov+default_base_moof",
         )
+        .global_args("-nostdin", "-loglevel", "error")
+        .run_async(pipe_stdout=True)
+    )
+
+    # The upload is only completed once ffmpeg exited cleanly, so a failed remux never leaves a truncated object.
+    result = s3_client.upload_stream(
+        process.stdout, object_name, Config.GET_VIDEO_STREAM_BUFFER_PARTS, completed=lambda: process.wait() == 0
+    )
+    if not result.success:
+        process.kill()
+    process.stdout.close()
+    return_code = process.wait()
+
+    if not result.success:
+        raise Exception(f"Failed to stream {object_name} to S3 (ffmpeg exited with code {return_code})")
+
+    print(f"stream upload finished for {object_name}", {
+        "bytes": result.size,
+        "seconds": round(result.seconds, 3),
+        "mb_per_second": round(result.size / 1024 / 1024 / result.seconds, 2) if result.seconds else 0.0,
+    })
+    return result.size
+
+class DownloadProgress:
+    """Collects yt-dlp progress hook events into per-download throughput figures."""
+
+    def __init__(self):
+        self.files = {}
+
+    def hook(self, event: dict):
+        if event.get("status") != "finished":
+            return
+
+        self.files[event.get("filename")] = {
+            "bytes": event.get("downloaded_bytes") or event.get("total_bytes") or 0,
+            "seconds": event.get("elapsed") or 0,
+        }
 
-def download_video(ydl_opts, url):
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        result = ydl.download([url])
-        
-    return True
+    def stats(self) -> dict:
+        total_bytes = sum(file["bytes"] for file in self.files.values())
+        total_seconds = sum(file["seconds"] for file in self.files.values())
+        return {
+            "files": len(self.files),
+            "bytes": total_bytes,
+            "seconds": round(total_seconds, 3),
+            "mb_per_second": round(total_bytes / 1024 / 1024 / total_seconds, 2) if total_seconds else 0.0,
+        }
 
 def get_file_size(path) -> int:
     size_bytes = os.path.getsize(path)
     return size_bytes
-
-def get_video_info(format, url) -> dict:
-    ydl_opts = {
-        "quiet": True,
-        "skip_download": True,
-        "format": format,
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        return ydl.extract_info(url, download=False)
@@ -0,0 +1,170 @@
+from celery.signals import task_postrun, task_prerun
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from models import JobStage, JobStatusResponse
+from s3_client import S3Client
+from tracing import HOSTNAME, find_stream_id
+from typing import Optional
+
+import time
+
+# The state of each stage of a stream is a small JSON record in {stream_id}/jobs/{stage}.json. The API writes it
+# as queued when it enqueues the task; the worker marks it running when the task starts, and the callbacks the task
+# sends record its outcome, progress and result. Each record only has one writer at a time, since a stage of a
+# stream runs in one task.
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+STAGES = ["get_video", "extract_sound", "generate_subtitles", "transform_subtitle", "transform_video", "fused_pipeline"]
+CALLBACK_STAGES = {
+    "/processor/get-video-url": "get_video",
+    "/processor/extract-sound": "extract_sound",
+    "/processor/generate-subtitles": "generate_subtitles",
+    "/processor/transform-subtitle": "transform_subtitle",
+    "/processor/transform-video": "transform_video",
+}
+
+# The stage run by the task of this process, and whether a callback already recorded its outcome.
+current_job = None
+
+
+def get_stage_name(task_name: str) -> str:
+    return task_name.removeprefix("tasks.").removesuffix("_task")
+
+
+class JobStore:
+    _shared = None
+
+    def __init__(self, s3_client: S3Client):
+        self.s3_client = s3_client
+
+    @classmethod
+    def shared(cls, config) -> "JobStore":
+        if cls._shared is None:
+            cls._shared = cls(S3Client.shared(config))
+        return cls._shared
+
+    def object_name(self, stream_id: str, stage: str) -> str:
+        return f"{stream_id}/jobs/{stage}.json"
+
+    def get(self, stream_id: str, stage: str) -> Optional[JobStage]:
+        record = self.s3_client.download_json(self.object_name(stream_id, stage))
+        return JobStage(**record) if record else None
+
+    def put(self, record: JobStage) -> bool:
+        if not Config.JOB_STORE_ENABLED:
+            return False
+        return self.s3_client.upload_json(record.model_dump(), self.object_name(record.stream_id, record.stage))
+
+    def update(self, stream_id: str, stage: str, **fields) -> bool:
+        if not Config.JOB_STORE_ENABLED:
+            return False
+        record = self.get(stream_id, stage) or JobStage(stream_id=stream_id, stage=stage, state=RUNNING)
+        return self.put(record.model_copy(update=fields))
+
+    def mark_queued(self, stream_id: str, stage: str, task_id: str, queue: str) -> bool:
+        """Start a new record for the stage, replacing the one of any previous run."""
+        return self.put(JobStage(
+            stream_id=stream_id, stage=stage, state=QUEUED, task_id=task_id, queue=queue, queued_at=time.time()
+        ))
+
+    def status(self, stream_id: str) -> Optional[JobStatusResponse]:
+        """Return the records of every stage of the stream, or None if it has none."""
+        with ThreadPoolExecutor(max_workers=len(STAGES)) as executor:
+            stages = [record for record in executor.map(lambda stage: self.get(stream_id, stage), STAGES) if record]
+        if not stages:
+            return None
+
+        states = {record.state for record in stages}
+        if FAILED in states:
+            state = FAILED
+        elif states & {QUEUED, RUNNING}:
+            state = RUNNING if RUNNING in states else QUEUED
+        else:
+            state = SUCCEEDED
+
+        return JobStatusResponse(
+            stream_id=stream_id,
+            state=state,
+            stages=stages,
+            queue_wait_seconds={
+                record.stage: round(record.started_at - record.queued_at, 3)
+                for record in stages if record.started_at and record.queued_at
+            },
+            run_seconds={
+                record.stage: round(record.finished_at - record.started_at, 3)
+                for record in stages if record.finished_at and record.started_at
+            },
+        )
+
+
+def record_callback(path: str, response):
+    """Record the outcome or progress a callback reports in the record of its stage."""
+    failure = path.endswith("-failure")
+    progress = path.endswith("-progress")
+    stage = CALLBACK_STAGES.get(path.removesuffix("-failure").removesuffix("-progress"))
+    if stage is None:
+        return
+
+    store = JobStore.shared(Config)
+    if progress:
+        if response.chunks_total:
+            store.update(response.stream_id, stage, progress=round(response.chunks_done / response.chunks_total, 3))
+        return
+
+    # The outcome is noted before the record is written, so the task is not closed again even if the write fails.
+    if current_job is not None:
+        current_job["failed"] = current_job["failed"] or failure
+        if current_job["stage"] == stage:
+            current_job["finished"] = True
+
+    if failure:
+        store.update(response.stream_id, stage, state=FAILED, finished_at=time.time())
+    else:
+        result = response.model_dump(exclude={"stream_id"})
+        store.update(response.stream_id, stage, state=SUCCEEDED, finished_at=time.time(), progress=1.0, result=result)
+
+
+@task_prerun.connect
+def mark_job_running(task_id=None, task=None, args=None, kwargs=None, **extra):
+    global current_job
+    stream_id = find_stream_id(task, args, kwargs)
+    if stream_id is None:
+        current_job = None
+        return
+
+    current_job = {"stream_id": stream_id, "stage": get_stage_name(task.name), "finished": False, "failed": False}
+    JobStore.shared(Config).update(
+        stream_id,
+        current_job["stage"],
+        state=RUNNING,
+        task_id=task_id,
+        worker=task.request.hostname or HOSTNAME,
+        attempts=(task.request.retries or 0) + 1,
+        started_at=time.time(),
+        finished_at=None,
+    )
+
+
+@task_postrun.connect
+def mark_job_finished(state=None, **kwargs):
+    """Close the record of a task no callback closed: a retried task, or a deferred one (ignored after publishing
+    itself again), is queued again, and a task that sends the callbacks of other stages (the fused pipeline) takes
+    the outcome of those."""
+    global current_job
+    if current_job is None or current_job["finished"]:
+        current_job = None
+        return
+
+    if state in ("RETRY", "IGNORED"):
+        fields = {"state": QUEUED, "queued_at": time.time()}
+    elif state == "SUCCESS" and not current_job["failed"]:
+        fields = {"state": SUCCEEDED, "finished_at": time.time(), "progress": 1.0}
+    else:
+        fields = {"state": FAILED, "finished_at": time.time()}
+
+    JobStore.shared(Config).update(current_job["stream_id"], current_job["stage"], **fields)
+    current_job = None
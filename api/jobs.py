@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from config import Config
+from job_store import JobStore
+from models import JobStatusResponse
+from auth import verify_token
+from fastapi import Depends
+
+job_store = JobStore.shared(Config)
+
+router = APIRouter(prefix="/api", tags=["jobs"])
+
+@router.get("/jobs/{stream_id}", response_model=JobStatusResponse)
+async def get_job_status(stream_id: str, authenticated: bool = Depends(verify_token)):
+    status = await run_in_threadpool(job_store.status, stream_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No job found for stream_id: {stream_id}")
+
+    return status
@@ -0,0 +1,23 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """Return module name, deferring its execution until an attribute is first accessed.
+
+    Heavy third-party packages (yt_dlp, assemblyai, pydub, ffmpeg) are only needed by some tasks; importing them
+    lazily keeps worker and API start-up from paying for every one of them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
@@ -12,6 +12,9 @@ from extract_sound import router as extract_sound
 from generate_subtitles import router as generate_subtitles
 from transform_subtitle import router as transform_subtitle
 from transform_video import router as transform_video
+from fused_pipeline import router as fused_pipeline
+from jobs import router as jobs
+from metrics import render_latest
 
 app = FastAPI(
     title="Substream Processor API",
@@ -23,6 +26,8 @@ app.include_router(extract_sound)
 app.include_router(generate_subtitles)
 app.include_router(transform_subtitle)
 app.include_router(transform_video)
+app.include_router(fused_pipeline)
+app.include_router(jobs)
 
 @app.get("/status")
 async def root():
@@ -30,5 +35,10 @@ async def root():
         "status": "active",
     }
 
+@app.get("/metrics")
+def metrics():
+    content, content_type = render_latest()
+    return Response(content=content, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=9010)
\ No newline at end of file
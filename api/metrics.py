@@ -0,0 +1,214 @@
+from celery import current_task
+from celery.signals import (
+    after_task_publish,
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_shutdown,
+)
+from config import Config
+from contextlib import contextmanager
+from tracing import span
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+import os
+import shutil
+import time
+
+# Worker processes of a prefork pool each keep their own samples. With PROMETHEUS_MULTIPROC_DIR set, samples are
+# written to files in that directory and merged by the exporter the main worker process serves; without it (the API,
+# solo workers) the default in-process registry is used.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+FPS_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+TASK_DURATION = Histogram(
+    "processor_task_duration_seconds", "Task run time", ["task"], buckets=DURATION_BUCKETS
+)
+PHASE_DURATION = Histogram(
+    "processor_phase_duration_seconds", "Time spent per task phase", ["task", "phase"], buckets=DURATION_BUCKETS
+)
+QUEUE_WAIT = Histogram(
+    "processor_queue_wait_seconds", "Time between enqueue and start of a task", ["task"], buckets=DURATION_BUCKETS
+)
+TASKS_IN_PROGRESS = Gauge(
+    "processor_tasks_in_progress", "Tasks currently running", ["task"], multiprocess_mode="livesum"
+)
+TASKS_PUBLISHED = Counter("processor_tasks_published_total", "Tasks sent to the broker", ["task"])
+STAGE_FAILURES = Counter("processor_stage_failures_total", "Failure callbacks sent, by stage", ["stage"])
+S3_BYTES = Counter("processor_s3_bytes_total", "Bytes transferred to and from S3", ["direction"])
+FFMPEG_SPEED = Histogram(
+    "processor_ffmpeg_speed_ratio", "Seconds of media processed per wall second", ["operation"], buckets=SPEED_BUCKETS
+)
+FFMPEG_FPS = Histogram(
+    "processor_ffmpeg_fps", "Frames encoded per wall second", ["operation"], buckets=FPS_BUCKETS
+)
+ASR_CHUNK_LATENCY = Histogram(
+    "processor_asr_chunk_latency_seconds",
+    "Time from submitting a chunk to its transcription being available",
+    ["backend"],
+    buckets=DURATION_BUCKETS,
+)
+# The limiter state is shared by every worker, so each process reports the cluster-wide values it saw last.
+LIMITER_IN_FLIGHT = Gauge(
+    "processor_limiter_in_flight", "Jobs holding a limiter slot", ["limiter"], multiprocess_mode="livemostrecent"
+)
+LIMITER_UTILIZATION = Gauge(
+    "processor_limiter_utilization_ratio",
+    "Share of the limiter's in-flight slots in use",
+    ["limiter"],
+    multiprocess_mode="livemostrecent",
+)
+LIMITER_TOKENS = Gauge(
+    "processor_limiter_tokens", "Tokens left in the limiter's bucket", ["limiter"], multiprocess_mode="livemostrecent"
+)
+LIMITER_WAIT = Histogram(
+    "processor_limiter_wait_seconds", "Time spent waiting for a limiter slot", ["limiter"], buckets=DURATION_BUCKETS
+)
+LANE_DEFERRALS = Counter("processor_lane_deferrals_total", "Long-lane jobs deferred for lack of a free slot", ["lane"])
+CALLBACKS = Counter("processor_callbacks_total", "Callback delivery attempts, by outcome", ["status"])
+OBJECT_CACHE_EVENTS = Counter(
+    "processor_object_cache_events_total", "Object cache lookups, evictions and stale files removed", ["event"]
+)
+OBJECT_CACHE_BYTES_SAVED = Counter("processor_object_cache_bytes_saved_total", "Bytes served from the object cache")
+
+task_started_at = {}
+
+
+def current_task_name() -> str:
+    task = current_task._get_current_object() if current_task else None
+    return task.name.removeprefix("tasks.") if task is not None and task.name else "none"
+
+
+@contextmanager
+def phase(name: str):
+    """Time the enclosed block as phase name of the task running in this process, and trace it as a span."""
+    started = time.monotonic()
+    try:
+        with span(f"phase {name}"):
+            yield
+    finally:
+        PHASE_DURATION.labels(current_task_name(), name).observe(time.monotonic() - started)
+
+
+def record_s3_bytes(direction: str, size: int):
+    S3_BYTES.labels(direction).inc(size)
+
+
+def record_ffmpeg(operation: str, media_seconds: float, wall_seconds: float, fps: float = None):
+    if not media_seconds or wall_seconds <= 0:
+        return
+
+    FFMPEG_SPEED.labels(operation).observe(media_seconds / wall_seconds)
+    if fps:
+        FFMPEG_FPS.labels(operation).observe(media_seconds * fps / wall_seconds)
+
+
+def record_asr_chunk(backend: str, latency: float):
+    ASR_CHUNK_LATENCY.labels(backend).observe(latency)
+
+
+def record_limiter_state(limiter: str, in_flight: int, max_in_flight: int, tokens: float):
+    LIMITER_IN_FLIGHT.labels(limiter).set(in_flight)
+    LIMITER_UTILIZATION.labels(limiter).set(in_flight / max_in_flight)
+    LIMITER_TOKENS.labels(limiter).set(tokens)
+
+
+def record_limiter_wait(limiter: str, wait: float):
+    LIMITER_WAIT.labels(limiter).observe(wait)
+
+
+def record_lane_deferral(lane: str):
+    LANE_DEFERRALS.labels(lane).inc()
+
+
+def record_callback(status: str):
+    CALLBACKS.labels(status).inc()
+
+
+def record_object_cache(hits: int = 0, misses: int = 0, evictions: int = 0, stale: int = 0, bytes_saved: int = 0):
+    for event, count in (("hit", hits), ("miss", misses), ("eviction", evictions), ("stale", stale)):
+        if count:
+            OBJECT_CACHE_EVENTS.labels(event).inc(count)
+    if bytes_saved:
+        OBJECT_CACHE_BYTES_SAVED.inc(bytes_saved)
+
+
+def record_stage_failure(path: str):
+    STAGE_FAILURES.labels(path.strip("/").removeprefix("processor/").removesuffix("-failure")).inc()
+
+
+def get_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        from prometheus_client import REGISTRY
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_latest() -> tuple[bytes, str]:
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+
+@after_task_publish.connect
+def count_published_task(sender=None, **kwargs):
+    TASKS_PUBLISHED.labels(str(sender).removeprefix("tasks.")).inc()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    name = task.name.removeprefix("tasks.")
+    task_started_at[task_id] = time.monotonic()
+    TASKS_IN_PROGRESS.labels(name).inc()
+
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at:
+        QUEUE_WAIT.labels(name).observe(max(0.0, time.time() - float(enqueued_at)))
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, **kwargs):
+    name = task.name.removeprefix("tasks.")
+    TASKS_IN_PROGRESS.labels(name).dec()
+
+    started = task_started_at.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(name).observe(time.monotonic() - started)
+
+
+@worker_init.connect
+def start_exporter(**kwargs):
+    """Serve the merged samples of every pool process on METRICS_PORT from the main worker process."""
+    if MULTIPROCESS:
+        directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    start_http_server(Config.METRICS_PORT, registry=get_registry())
+    print(f"metrics exporter listening on port {Config.METRICS_PORT}")
+
+
+@worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs):
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid or os.getpid())
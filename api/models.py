@@ -15,9 +15,21 @@ class GetVideoResponse(BaseModel):
 class GetVideoFailureResponse(BaseModel):
     stream_id: str
 
+class VideoMetadata(BaseModel):
+    duration: float
+    width: int
+    height: int
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    fps: Optional[float] = None
+    audio_sample_rate: Optional[int] = None
+    keyframes: list[float] = []
+
 class ExtractSoundRequest(BaseModel):
     stream_id: str
     file_name: str
+    duration: Optional[float] = None
+    size: Optional[int] = None
 
 class ExtractSoundResponse(BaseModel):
     audio_files: list[str]
@@ -26,6 +38,25 @@ class ExtractSoundResponse(BaseModel):
 class ExtractSoundFailureResponse(BaseModel):
     stream_id: str
 
+class AudioChunk(BaseModel):
+    file_name: str
+    start_ms: int
+    duration_ms: int
+    offset_map: list[tuple[int, int]] = []
+
+class AudioChunkManifest(BaseModel):
+    stream_id: str
+    chunks: list[AudioChunk]
+    codec: str = "wav"
+
+class StageProgress(BaseModel):
+    stream_id: str
+    stage: str
+    fingerprint: str
+    outputs: dict[str, dict] = {}
+    completed: bool = False
+    result: dict = {}
+
 class GenerateSubtitlesRequest(BaseModel):
     stream_id: str
     audio_files: list[str]
@@ -38,6 +69,14 @@ class GenerateSubtitlesResponse(BaseModel):
 class GenerateSubtitlesFailureResponse(BaseModel):
     stream_id: str
 
+class GenerateSubtitlesProgressResponse(BaseModel):
+    subtitle_srt_file: str
+    covered_from_ms: int
+    covered_until_ms: int
+    chunks_done: int
+    chunks_total: int
+    stream_id: str
+
 class TransformSubtitleOptionsRequest(BaseModel):
     subtitle_font: str
     subtitle_size: int
@@ -71,10 +110,60 @@ class TransformVideoRequest(BaseModel):
     stream_id: str
     file_name: str
     options: TransformVideoOptionsRequest
+    subtitle_ass_file: Optional[str] = None
+    duration: Optional[float] = None
+    size: Optional[int] = None
 
 class TransformVideoResponse(BaseModel):
     stream_id: str
     file_name_transformed: str
+    file_names_transformed_parts: list[str] = []
 
 class TransformVideoFailureResponse(BaseModel):
-    stream_id: str
\ No newline at end of file
+    stream_id: str
+
+class FusedPipelineRequest(BaseModel):
+    url: str
+    stream_id: str
+    subtitle_options: TransformSubtitleOptionsRequest
+    video_options: TransformVideoOptionsRequest
+    burn_subtitles: bool = False
+
+class JobStage(BaseModel):
+    stream_id: str
+    stage: str
+    state: str
+    task_id: Optional[str] = None
+    queue: Optional[str] = None
+    worker: Optional[str] = None
+    attempts: int = 0
+    progress: Optional[float] = None
+    queued_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+
+class JobStatusResponse(BaseModel):
+    stream_id: str
+    state: str
+    stages: list[JobStage]
+    queue_wait_seconds: dict[str, float]
+    run_seconds: dict[str, float]
+
+class GetVideoBatchRequest(BaseModel):
+    requests: list[GetVideoRequest]
+
+class ExtractSoundBatchRequest(BaseModel):
+    requests: list[ExtractSoundRequest]
+
+class GenerateSubtitlesBatchRequest(BaseModel):
+    requests: list[GenerateSubtitlesRequest]
+
+class TransformSubtitleBatchRequest(BaseModel):
+    requests: list[TransformSubtitleRequest]
+
+class TransformVideoBatchRequest(BaseModel):
+    requests: list[TransformVideoRequest]
+
+class FusedPipelineBatchRequest(BaseModel):
+    requests: list[FusedPipelineRequest]
\ No newline at end of file
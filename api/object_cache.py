@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from metrics import record_object_cache
+from typing import Callable
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Downloads in progress and pins are .tmp files that their process removes when it is done; one left behind by a
+# killed process is removed by eviction once it has not been written to for this long.
+STALE_TMP_SECONDS = 6 * 3600
+
+
+class ObjectCache:
+    """Size-bounded on-disk cache of S3 objects shared by every worker process of a node.
+
+    Entries are keyed by bucket, key and ETag, so an object that changed in the bucket is never served stale.
+    Processes coordinate through flock: a per-entry lock (striped over the first byte of the entry name) makes
+    concurrent misses on the same object download it once, and a cache-wide lock guards lookups, insertions, least
+    recently used eviction and the shared counters. The cache-wide lock is never held while data is copied: the
+    destination is usually on another filesystem, so placing a multi-GB object there is a full copy.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.objects_directory = os.path.join(directory, "objects")
+        self.max_bytes = max_bytes
+        os.makedirs(self.objects_directory, exist_ok=True)
+        os.makedirs(os.path.join(directory, "locks"), exist_ok=True)
+
+    def entry_path(self, bucket: str, key: str, etag: str) -> str:
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.objects_directory, digest)
+
+    @contextmanager
+    def lock(self, name: str = ".lock"):
+        with open(os.path.join(self.directory, name), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, bucket: str, key: str, etag: str, file_path: str, download: Callable[[str], bool]) -> bool:
+        """Place the object at file_path, from the cache when possible, else through download(tmp_path)."""
+        entry = self.entry_path(bucket, key, etag)
+        if self.place(entry, key, file_path):
+            return True
+
+        with self.lock(f"locks/{os.path.basename(entry)[:2]}.lock"):
+            # Another process may have downloaded the object while this one waited for the entry lock.
+            if self.place(entry, key, file_path):
+                return True
+
+            tmp_path = f"{entry}.{uuid.uuid4().hex}.tmp"
+            try:
+                if not download(tmp_path):
+                    return False
+                link_or_copy(tmp_path, file_path)
+
+                with self.lock():
+                    os.replace(tmp_path, entry)
+                    self.record(misses=1)
+                    self.evict()
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        return True
+
+    def place(self, entry: str, key: str, file_path: str) -> bool:
+        """Copy a cached entry to file_path, or return False if it is not cached.
+
+        The entry is pinned by a hard link taken under the cache lock, so eviction cannot remove it while it is
+        copied without the lock.
+        """
+        pin = f"{entry}.{uuid.uuid4().hex}.tmp"
+        with self.lock():
+            if not os.path.exists(entry):
+                return False
+            os.utime(entry)
+            os.link(entry, pin)
+            self.record(hits=1, bytes_saved=os.path.getsize(entry))
+
+        try:
+            link_or_copy(pin, file_path)
+        finally:
+            os.remove(pin)
+        print(f"object cache hit for {key}")
+        return True
+
+    def evict(self):
+        """Remove stale temporary files, then least recently used entries until the cache fits in max_bytes. Caller
+        holds the cache lock."""
+        entries = []
+        stale = 0
+        now = time.time()
+        for entry in os.scandir(self.objects_directory):
+            if not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                continue
+
+            # Temporary files are removed by their process without the cache lock, so one may be gone already.
+            try:
+                if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                    os.remove(entry.path)
+                    stale += 1
+            except FileNotFoundError:
+                pass
+
+        total = sum(size for _, size, _ in entries)
+        evictions = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            evictions += 1
+
+        if evictions or stale:
+            self.record(evictions=evictions, stale=stale)
+
+    def record(self, **increments):
+        """Add increments to the counters of stats.json, shared by the node, and to the metrics of this process."""
+        record_object_cache(**increments)
+        stats = self.stats()
+        for name, value in increments.items():
+            stats[name] = stats.get(name, 0) + value
+
+        stats_path = os.path.join(self.directory, "stats.json")
+        tmp_path = f"{stats_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(stats, file)
+        os.replace(tmp_path, stats_path)
+
+    def stats(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, "stats.json"), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0, "stale": 0}
+
+
+def link_or_copy(source: str, destination: str):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,251 @@
+from config import Config
+from contextlib import contextmanager
+from metrics import record_limiter_state, record_limiter_wait
+from typing import Optional
+
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+# The limiter state is a small dict: the token bucket (tokens, updated_at) and the leases of the jobs in flight,
+# each with an expiry time. Every operation reads, updates and writes the state under a lock provided by a store,
+# so the same limits hold for every process that shares the store. Leases are renewed while their job runs and
+# expire otherwise, which returns the slots of a crashed worker after lease_ttl seconds.
+
+MAX_WAIT = 1.0
+
+
+def initial_state(burst: int) -> dict:
+    return {"tokens": float(burst), "updated_at": time.time(), "leases": {}}
+
+
+class MemoryLimiterStore:
+    """State shared by the threads of one process."""
+
+    def __init__(self, burst: int):
+        self.state = initial_state(burst)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            yield self.state
+
+
+class FileLimiterStore:
+    """State in a JSON file shared by every process of a node, updated under an flock.
+
+    Unlike the broker store, the limits only hold per node: containers share the file through a local volume, so
+    every node running ASR workers gets its own budget. Use the broker store when the provider limit is global.
+    """
+
+    def __init__(self, path: str, burst: int):
+        self.path = path
+        self.burst = burst
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        with open(self.path, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                content = file.read()
+                state = json.loads(content) if content else initial_state(self.burst)
+                yield state
+
+                file.seek(0)
+                file.truncate()
+                json.dump(state, file)
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class BrokerLimiterStore:
+    """State shared by every node through the Celery broker.
+
+    The state is the only message of a RabbitMQ queue. A process holds the lock while it has fetched that message
+    without acknowledging it; it publishes the updated state before acknowledging the old one. If a process dies
+    while holding the lock, the broker requeues the unacknowledged message, so the lock is never lost. A missing
+    state is recreated after lock_timeout, and duplicates a stall could leave behind are dropped on the next update.
+    """
+
+    def __init__(self, url: str, queue: str, burst: int, lock_timeout: float = 10.0):
+        self.url = url
+        self.queue_name = queue
+        self.burst = burst
+        self.lock_timeout = lock_timeout
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        from kombu import Connection, Queue
+
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = Connection(self.url)
+            self.connection_pid = os.getpid()
+        self.connection.ensure_connection(max_retries=3)
+        queue = Queue(self.queue_name, durable=True, routing_key=self.queue_name)(self.connection.default_channel)
+        queue.declare()
+        return queue
+
+    @contextmanager
+    def locked(self):
+        from kombu import Producer
+
+        with self.lock:
+            queue = self.connect()
+            message = self.fetch(queue)
+            state = message.payload if message is not None else initial_state(self.burst)
+            try:
+                yield state
+            except BaseException:
+                if message is not None:
+                    message.requeue()
+                raise
+
+            Producer(queue.channel).publish(
+                state, exchange="", routing_key=self.queue_name, serializer="json", delivery_mode=2
+            )
+            if message is not None:
+                message.ack()
+
+    def fetch(self, queue):
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            message = queue.get(no_ack=False)
+            if message is not None:
+                # Only one state should exist; any other ready message is a duplicate left by a lock timeout.
+                while message.delivery_info.get("message_count"):
+                    duplicate = queue.get(no_ack=False)
+                    if duplicate is None:
+                        break
+                    duplicate.ack()
+                return message
+
+            if time.monotonic() >= deadline:
+                print(f"no limiter state in {self.queue_name} after {self.lock_timeout}s, starting a new one")
+                return None
+            time.sleep(0.05)
+
+
+class RateLimiter:
+    """Token bucket plus a cap on jobs in flight, shared by every process using the same store.
+
+    acquire() takes one token and one in-flight slot, waiting until both are available, and returns a lease to
+    renew() while the job runs and release() once it is done.
+    """
+
+    def __init__(self, name: str, store, rate: float, burst: int, max_in_flight: int, lease_ttl: float):
+        self.name = name
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.lease_ttl = lease_ttl
+
+    def acquire(self, cancelled: Optional[threading.Event] = None) -> Optional[str]:
+        """Wait for a token and a slot and return the lease, or None if cancelled is set first."""
+        started = time.monotonic()
+        while cancelled is None or not cancelled.is_set():
+            lease, wait = self.try_acquire()
+            if lease is not None:
+                record_limiter_wait(self.name, time.monotonic() - started)
+                return lease
+            if cancelled is not None:
+                cancelled.wait(wait)
+            else:
+                time.sleep(wait)
+        return None
+
+    def try_acquire(self) -> tuple[Optional[str], float]:
+        """Take a token and a slot if both are free. Otherwise return the seconds to wait before trying again."""
+        now = time.time()
+        with self.store.locked() as state:
+            self.refresh(state, now)
+            if len(state["leases"]) >= self.max_in_flight:
+                lease, wait = None, MAX_WAIT
+            elif state["tokens"] < 1:
+                lease, wait = None, min(MAX_WAIT, (1 - state["tokens"]) / self.rate)
+            else:
+                lease, wait = uuid.uuid4().hex, 0.0
+                state["tokens"] -= 1
+                state["leases"][lease] = now + self.lease_ttl
+            self.report(state)
+        return lease, wait
+
+    def renew(self, leases: list[str]):
+        if not leases:
+            return
+
+        now = time.time()
+        with self.store.locked() as state:
+            self.refresh(state, now)
+            for lease in leases:
+                state["leases"][lease] = now + self.lease_ttl
+            self.report(state)
+
+    def release(self, leases: list[str]):
+        if not leases:
+            return
+
+        with self.store.locked() as state:
+            self.refresh(state, time.time())
+            for lease in leases:
+                state["leases"].pop(lease, None)
+            self.report(state)
+
+    def refresh(self, state: dict, now: float):
+        """Refill the bucket for the time elapsed since the last update and drop expired leases."""
+        state["tokens"] = min(float(self.burst), state["tokens"] + max(0.0, now - state["updated_at"]) * self.rate)
+        state["updated_at"] = now
+        state["leases"] = {lease: expires for lease, expires in state["leases"].items() if expires > now}
+
+    def report(self, state: dict):
+        record_limiter_state(self.name, len(state["leases"]), self.max_in_flight, state["tokens"])
+
+    def stats(self) -> dict:
+        with self.store.locked() as state:
+            self.refresh(state, time.time())
+            self.report(state)
+            return {
+                "in_flight": len(state["leases"]),
+                "max_in_flight": self.max_in_flight,
+                "utilization": len(state["leases"]) / self.max_in_flight,
+                "tokens": round(state["tokens"], 3),
+                "rate": self.rate,
+                "burst": self.burst,
+            }
+
+
+def create_limiter_store(config, burst: int):
+    if config.ASR_LIMITER == "file":
+        return FileLimiterStore(config.ASR_LIMITER_FILE, burst)
+    if config.ASR_LIMITER == "broker":
+        return BrokerLimiterStore(config.RABBITMQ_URL, config.ASR_LIMITER_QUEUE, burst)
+    if config.ASR_LIMITER == "memory":
+        return MemoryLimiterStore(burst)
+    raise ValueError(f"Unknown ASR limiter: {config.ASR_LIMITER}")
+
+
+asr_limiter = None
+
+
+def get_asr_limiter() -> RateLimiter:
+    """Return the limiter of transcription jobs of this process."""
+    global asr_limiter
+    if asr_limiter is None:
+        asr_limiter = RateLimiter(
+            "asr",
+            create_limiter_store(Config, Config.ASR_BURST),
+            rate=Config.ASR_RATE,
+            burst=Config.ASR_BURST,
+            max_in_flight=Config.ASR_MAX_IN_FLIGHT,
+            lease_ttl=Config.ASR_LEASE_TTL,
+        )
+    return asr_limiter
@@ -1,10 +1,75 @@
 import boto3
+import json
+import os
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+from metrics import record_s3_bytes
+from object_cache import ObjectCache
+from tracing import in_current_span, span
+
+MB = 1024 * 1024
+
+
+@dataclass
+class TransferResult:
+    object_name: str
+    file_path: str
+    success: bool
+    size: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class TransferBatch:
+    results: list[TransferResult] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def success(self) -> bool:
+        return all(result.success for result in self.results)
+
+    @property
+    def failed(self) -> list[TransferResult]:
+        return [result for result in self.results if not result.success]
+
+    @property
+    def size(self) -> int:
+        return sum(result.size for result in self.results if result.success)
+
+    @property
+    def throughput(self) -> float:
+        return self.size / MB / self.seconds if self.seconds else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "objects": len(self.results),
+            "failed": len(self.failed),
+            "bytes": self.size,
+            "seconds": round(self.seconds, 3),
+            "mb_per_second": round(self.throughput, 2),
+        }
 
 
 class S3Client:
+    _shared = None
+
     def __init__(self, config):
-        custom_config = Config(retries={"max_attempts": 5, "mode": "standard"})
+        self.max_concurrency = config.S3_MAX_CONCURRENCY
+        self.transfer_config = TransferConfig(
+            multipart_threshold=config.S3_MULTIPART_THRESHOLD_MB * MB,
+            multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE_MB * MB,
+            max_concurrency=config.S3_MULTIPART_CONCURRENCY,
+        )
+        custom_config = Config(
+            retries={"max_attempts": 5, "mode": "standard"},
+            max_pool_connections=config.S3_MAX_CONCURRENCY * config.S3_MULTIPART_CONCURRENCY,
+        )
         self.client = boto3.client(
             "s3",
             aws_access_key_id=config.S3_ACCESS_KEY,
@@ -14,25 +79,207 @@ class S3Client:
             config=custom_config,
         )
         self.bucket_name = config.S3_BUCKET_NAME
+        self.object_cache = (
+            ObjectCache(config.OBJECT_CACHE_DIR, config.OBJECT_CACHE_MAX_BYTES) if config.OBJECT_CACHE_ENABLED else None
+        )
+
+    @classmethod
+    def shared(cls, config) -> "S3Client":
+        """Return the process-wide client, so every module reuses the same connection pool."""
+        if cls._shared is None:
+            cls._shared = cls(config)
+        return cls._shared
 
     def upload_file(self, file_path, object_name):
         print(f"uploading s3 file {file_path}")
+        with span("s3.upload", object_name=object_name) as current:
+            try:
+                self.client.upload_file(file_path, self.bucket_name, object_name, Config=self.transfer_config)
+                size = os.path.getsize(file_path)
+                record_s3_bytes("upload", size)
+                current.set(bytes=size)
+                return True
+            except Exception as e:
+                print(f"error uploading s3 file {file_path} ({e})")
+                current.fail(e)
+        return False
+
+    def download_file(self, object_name, file_path, cached: bool = False) -> bool:
+        """Download object_name to file_path. With cached, the object goes through the node's object cache, which
+        costs a HEAD request and a copy; only objects read by several stages (the source video) are worth it."""
+        if self.object_cache is None or not cached:
+            return self._download(object_name, file_path)
+
         try:
-            self.client.upload_file(file_path, self.bucket_name, object_name)
-            return True
+            etag = self.head_file(object_name)["etag"]
         except Exception as e:
-            print(f"error uploading s3 file {file_path} ({e})")
-        return False
+            print(f"error reading s3 file metadata {object_name} ({e})")
+            return False
+
+        return self.object_cache.fetch(
+            self.bucket_name, object_name, etag, file_path, lambda tmp_path: self._download(object_name, tmp_path)
+        )
+
+    def head_file(self, object_name) -> dict:
+        """Return the ETag and size of object_name; unlike the transfers, errors are raised."""
+        response = self.client.head_object(Bucket=self.bucket_name, Key=object_name)
+        return {"etag": response["ETag"], "size": response["ContentLength"]}
 
-    def download_file(self, object_name, file_path) -> bool:
+    def _download(self, object_name, file_path) -> bool:
         print(f"downloading s3 file {file_path}")
+        with span("s3.download", object_name=object_name) as current:
+            try:
+                self.client.download_file(self.bucket_name, object_name, file_path, Config=self.transfer_config)
+                size = os.path.getsize(file_path)
+                record_s3_bytes("download", size)
+                current.set(bytes=size)
+                return True
+            except Exception as e:
+                print(f"error downloading s3 file {file_path} ({e})")
+                current.fail(e)
+        return False
+
+    def upload_many(self, files: list[tuple[str, str]]) -> TransferBatch:
+        """Upload (file_path, object_name) pairs concurrently and return per-object results."""
+        return self._transfer_many(self._upload_one, files)
+
+    def download_many(self, objects: list[tuple[str, str]]) -> TransferBatch:
+        """Download (object_name, file_path) pairs concurrently and return per-object results."""
+        return self._transfer_many(self._download_one, [(file_path, object_name) for object_name, file_path in objects])
+
+    def _transfer_many(self, transfer, files: list[tuple[str, str]]) -> TransferBatch:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(in_current_span(lambda item: transfer(*item)), files))
+        batch = TransferBatch(results=results, seconds=time.monotonic() - started)
+        print(f"s3 batch transfer finished {batch.stats()}")
+        return batch
+
+    def _upload_one(self, file_path: str, object_name: str) -> TransferResult:
+        started = time.monotonic()
+        success = self.upload_file(file_path, object_name)
+        size = os.path.getsize(file_path) if success else 0
+        return TransferResult(object_name, file_path, success, size, time.monotonic() - started)
+
+    def _download_one(self, file_path: str, object_name: str) -> TransferResult:
+        started = time.monotonic()
+        success = self.download_file(object_name, file_path)
+        size = os.path.getsize(file_path) if success else 0
+        return TransferResult(object_name, file_path, success, size, time.monotonic() - started)
+
+    def upload_stream(
+        self, stream, object_name: str, max_inflight_parts: int = None, completed: Callable[[], bool] = None
+    ) -> TransferResult:
+        """Upload a binary stream of unknown length as a multipart upload while it is still being produced.
+
+        Parts of multipart_chunksize bytes are read from stream and uploaded from a thread pool. At most
+        max_inflight_parts parts wait in memory, so reading blocks (and back-pressures the producer) when the
+        bucket is slower than the stream. Once the stream ends, completed is called (if given) to check that the
+        producer succeeded; if it returns False the upload is aborted, so a truncated object is never stored.
+        """
+        print(f"uploading s3 stream {object_name}")
+        with span("s3.upload_stream", object_name=object_name) as current:
+            result = self._upload_stream(stream, object_name, max_inflight_parts, completed)
+            current.set(bytes=result.size)
+            if not result.success:
+                current.fail("upload failed")
+        return result
+
+    def _upload_stream(
+        self, stream, object_name: str, max_inflight_parts: int = None, completed: Callable[[], bool] = None
+    ) -> TransferResult:
+        part_size = self.transfer_config.multipart_chunksize
+        max_inflight_parts = max_inflight_parts or self.transfer_config.max_concurrency
+        started = time.monotonic()
+        size = 0
+        upload_id = None
+
         try:
-            self.client.download_file(self.bucket_name, object_name, file_path)
-            return True
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=object_name)["UploadId"]
+            slots = threading.BoundedSemaphore(max_inflight_parts)
+            futures = []
+
+            with ThreadPoolExecutor(max_workers=max_inflight_parts) as executor:
+                for number, body in enumerate(iter(lambda: stream.read(part_size), b""), start=1):
+                    slots.acquire()
+                    failed = next((future for future in futures if future.done() and future.exception()), None)
+                    if failed is not None:
+                        raise failed.exception()
+
+                    future = executor.submit(self._upload_part, object_name, upload_id, number, body)
+                    future.add_done_callback(lambda _: slots.release())
+                    futures.append(future)
+                    size += len(body)
+                    record_s3_bytes("upload", len(body))
+
+            # An empty stream means the producer failed; completing the upload would store an empty object.
+            if not futures:
+                raise Exception("stream is empty")
+            if completed is not None and not completed():
+                raise Exception("stream producer failed")
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=object_name,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [future.result() for future in futures]},
+            )
         except Exception as e:
-            print(f"error downloading s3 file {file_path} ({e})")
+            print(f"error uploading s3 stream {object_name} ({e})")
+            if upload_id is not None:
+                self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=object_name, UploadId=upload_id)
+            return TransferResult(object_name, "", False, 0, time.monotonic() - started)
+
+        return TransferResult(object_name, "", True, size, time.monotonic() - started)
+
+    def _upload_part(self, object_name: str, upload_id: str, number: int, body: bytes) -> dict:
+        response = self.client.upload_part(
+            Bucket=self.bucket_name, Key=object_name, UploadId=upload_id, PartNumber=number, Body=body
+        )
+        return {"ETag": response["ETag"], "PartNumber": number}
+
+    def get_presigned_url(self, object_name: str, expires_in: int = 3600) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket_name, "Key": object_name}, ExpiresIn=expires_in
+        )
+
+    def upload_json(self, data, object_name) -> bool:
+        print(f"uploading s3 json {object_name}")
+        with span("s3.upload", object_name=object_name) as current:
+            try:
+                body = json.dumps(data).encode("utf-8")
+                self.client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    Body=body,
+                    ContentType="application/json",
+                )
+                record_s3_bytes("upload", len(body))
+                current.set(bytes=len(body))
+                return True
+            except Exception as e:
+                print(f"error uploading s3 json {object_name} ({e})")
+                current.fail(e)
         return False
 
+    def download_json(self, object_name, strict: bool = False):
+        """Return the decoded object, or None if it cannot be read. With strict, None only means the object does not
+        exist: any other error is raised, so callers never mistake a failed read for a missing object."""
+        print(f"downloading s3 json {object_name}")
+        with span("s3.download", object_name=object_name) as current:
+            try:
+                response = self.client.get_object(Bucket=self.bucket_name, Key=object_name)
+                body = response["Body"].read()
+                record_s3_bytes("download", len(body))
+                current.set(bytes=len(body))
+                return json.loads(body)
+            except Exception as e:
+                print(f"error downloading s3 json {object_name} ({e})")
+                current.fail(e)
+                if strict and not is_missing_object(e):
+                    raise
+        return None
+
     def delete_file(self, object_name) -> bool:
         print(f"deleting s3 file {object_name}")
         try:
@@ -40,4 +287,8 @@ class S3Client:
             return True
         except Exception as e:
             print(f"error deleting s3 file {object_name} ({e})")
-            return False
\ No newline at end of file
+            return False
+
+
+def is_missing_object(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
\ No newline at end of file
@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from fastapi import HTTPException
+from job_store import JobStore
+from s3_client import S3Client
+from video_metadata import get_metadata_file_name
+from worker import LONG_LANE_SUFFIX, celery, lane_queues, lane_time_limits
+from typing import Callable, NamedTuple, Optional
+
+import uuid
+
+# Jobs are routed by their estimated cost, the seconds of media they process: jobs at or above
+# SCHEDULING_LONG_JOB_SECONDS go to the long lane of their queue, everything else (including jobs whose cost is
+# unknown) to the queue itself. See QUEUES in worker.py for how workers serve the two lanes.
+
+
+def estimate_media_seconds(duration: Optional[float] = None, size: Optional[int] = None) -> Optional[float]:
+    """Media duration in seconds, from the duration when known, otherwise from the file size."""
+    if duration:
+        return duration
+    if size:
+        return size / Config.SCHEDULING_BYTES_PER_SECOND
+    return None
+
+
+def get_stream_duration(s3_client: S3Client, stream_id: str, file_name: str) -> Optional[float]:
+    """Duration from the metadata sidecar get_video_task stored next to the video, if there is one."""
+    metadata = s3_client.download_json(f"{stream_id}/{get_metadata_file_name(file_name)}")
+    return metadata.get("duration") if metadata else None
+
+
+def estimate_stream_seconds(
+    s3_client: S3Client, stream_id: str, file_name: str, duration: Optional[float] = None, size: Optional[int] = None
+) -> Optional[float]:
+    """Media seconds of a stored video, looking its duration up in the metadata sidecar unless the caller gave it."""
+    if not Config.SCHEDULING_LANES:
+        return None
+    return estimate_media_seconds(duration or get_stream_duration(s3_client, stream_id, file_name), size)
+
+
+def choose_queue(queue: str, media_seconds: Optional[float]) -> str:
+    lanes = lane_queues(queue)
+    if len(lanes) > 1 and media_seconds is not None and media_seconds >= Config.SCHEDULING_LONG_JOB_SECONDS:
+        return f"{queue}{LONG_LANE_SUFFIX}"
+    return queue
+
+
+class StageJob(NamedTuple):
+    queue: str
+    stream_id: str
+    args: list
+    media_seconds: Optional[float] = None
+
+
+def queue_stage_job(job: StageJob) -> tuple[str, str]:
+    """Pick the lane of job and record it as queued in the job store, before its task is sent so the worker never
+    finds the record of a task it already started missing or stale. Return the task id and the lane."""
+    lane = choose_queue(job.queue, job.media_seconds)
+    if job.media_seconds is not None:
+        print(f"routing {job.queue} to {lane} for an estimated {job.media_seconds:.0f}s of media")
+
+    task_id = str(uuid.uuid4())
+    JobStore.shared(Config).mark_queued(job.stream_id, job.queue.removesuffix("_task"), task_id, lane)
+    return task_id, lane
+
+
+def publish_stage_task(job: StageJob, task_id: str, lane: str, producer=None):
+    soft_time_limit, time_limit = lane_time_limits(job.queue, lane, job.media_seconds)
+    return celery.send_task(
+        f"tasks.{job.queue}",
+        args=job.args,
+        queue=lane,
+        routing_key=lane,
+        task_id=task_id,
+        producer=producer,
+        soft_time_limit=soft_time_limit,
+        time_limit=time_limit,
+    )
+
+
+def send_stage_task(job: StageJob):
+    """Send the task of job to the lane that fits its estimated cost."""
+    return publish_stage_task(job, *queue_stage_job(job))
+
+
+def send_stage_batch(make_job: Callable[[object], StageJob], requests: list) -> list[str]:
+    """Enqueue one task per request and return their stream ids.
+
+    The jobs are built (which may look durations up in S3) and recorded in the job store BATCH_CONCURRENCY requests
+    at a time, then published in order over a single broker connection.
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(requests) > Config.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch is larger than {Config.BATCH_MAX_SIZE} requests")
+
+    with ThreadPoolExecutor(max_workers=Config.BATCH_CONCURRENCY) as executor:
+        jobs = list(executor.map(make_job, requests))
+        queued = list(executor.map(queue_stage_job, jobs))
+
+    with celery.producer_or_acquire() as producer:
+        for job, (task_id, lane) in zip(jobs, queued):
+            publish_stage_task(job, task_id, lane, producer)
+
+    print(f"queued a batch of {len(jobs)} {jobs[0].queue} jobs")
+    return [job.stream_id for job in jobs]
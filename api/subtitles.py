@@ -0,0 +1,227 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, TextIO
+
+import numpy as np
+import re
+
+# Cues are kept as two int64 arrays of start and end times in milliseconds plus a list of texts, so a multi-hour
+# track with tens of thousands of cues is a few hundred kilobytes and shifting or merging tracks is a numpy operation
+# instead of a per-cue timestamp rewrite. Timestamps are parsed and formatted for a whole block of cues at once.
+
+# One cue: its timestamp line and the non-blank lines after it. Index lines are not matched, so a missing or wrong
+# index does not matter.
+CUE = re.compile(
+    r"^[ \t]*(\d+:\d{1,2}:\d{1,2}[,.]\d{1,3}[ \t]*-->[ \t]*\d+:\d{1,2}:\d{1,2}[,.]\d{1,3})[^\n]*((?:\n[ \t]*\S[^\n]*)*)",
+    re.M | re.A,
+)
+TIMESTAMPS = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)", re.A)
+SRT_TIMESTAMPS = np.frombuffer(b"00:00:00,000 --> 00:00:00,000", dtype=np.uint8)
+SRT_DIGITS = SRT_TIMESTAMPS == ord("0")
+
+READ_BLOCK_SIZE = 1 << 20
+WRITE_BATCH_SIZE = 4096
+SRT_WORDS_PER_CUE = 6
+ASS_WORDS_PER_LINE = 4
+
+
+@dataclass
+class SubtitleTrack:
+    starts: np.ndarray
+    ends: np.ndarray
+    texts: list[str]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def empty(cls) -> "SubtitleTrack":
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), [])
+
+    def shifted(self, offset_ms: int) -> "SubtitleTrack":
+        return SubtitleTrack(self.starts + offset_ms, self.ends + offset_ms, self.texts)
+
+    @property
+    def end_ms(self) -> int:
+        return int(self.ends.max()) if len(self) else 0
+
+
+def from_words(words, words_per_cue: int = SRT_WORDS_PER_CUE) -> SubtitleTrack:
+    """Group words (anything with text, start and end in ms) into cues of words_per_cue words, each shown on two
+    lines split at the middle word."""
+    if not words:
+        return SubtitleTrack.empty()
+
+    starts = np.fromiter((word.start for word in words), dtype=np.int64, count=len(words))
+    ends = np.fromiter((word.end for word in words), dtype=np.int64, count=len(words))
+    first = np.arange(0, len(words), words_per_cue)
+    last = np.minimum(first + words_per_cue, len(words)) - 1
+
+    texts = []
+    for begin, end in zip(first.tolist(), (last + 1).tolist()):
+        cue = [word.text for word in words[begin:end]]
+        middle = len(cue) // 2
+        texts.append("\n".join(line for line in (" ".join(cue[:middle]), " ".join(cue[middle:])) if line))
+
+    return SubtitleTrack(starts[first], ends[last], texts)
+
+
+def concat(tracks: Iterable[SubtitleTrack], offsets: Optional[Iterable[int]] = None) -> SubtitleTrack:
+    """Merge tracks into one, shifting each by its offset in milliseconds."""
+    tracks = list(tracks)
+    if not tracks:
+        return SubtitleTrack.empty()
+
+    starts = np.concatenate([track.starts for track in tracks])
+    ends = np.concatenate([track.ends for track in tracks])
+    if offsets is not None:
+        shifts = np.repeat(np.fromiter(offsets, dtype=np.int64, count=len(tracks)), [len(track) for track in tracks])
+        starts += shifts
+        ends += shifts
+    return SubtitleTrack(starts, ends, [text for track in tracks for text in track.texts])
+
+
+def remap(track: SubtitleTrack, offset_map: list[tuple[int, int]]) -> SubtitleTrack:
+    """Map the times of a track transcribed from trimmed audio back to the audio it was cut from.
+
+    offset_map holds one (trimmed_ms, source_ms) pair per kept span, in order. A start is placed in the span it
+    falls in; an end that falls exactly on a span boundary stays with the span before it.
+    """
+    if not offset_map or not len(track):
+        return track
+
+    trimmed, source = np.asarray(offset_map, dtype=np.int64).T
+    shift = source - trimmed
+    start_spans = np.maximum(np.searchsorted(trimmed, track.starts, side="right") - 1, 0)
+    end_spans = np.maximum(np.searchsorted(trimmed, track.ends, side="left") - 1, 0)
+    return SubtitleTrack(track.starts + shift[start_spans], track.ends + shift[end_spans], track.texts)
+
+
+def parse_timestamps(timestamps: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the start and end milliseconds of "start --> end" timestamp lines.
+
+    Lines in the canonical 00:00:00,000 --> 00:00:00,000 layout are converted from their digit columns in one numpy
+    pass; any other layout is parsed field by field.
+    """
+    if all(len(timestamp) == len(SRT_TIMESTAMPS) for timestamp in timestamps):
+        chars = np.frombuffer("".join(timestamps).encode("ascii"), dtype=np.uint8).reshape(-1, len(SRT_TIMESTAMPS))
+        if (chars[:, ~SRT_DIGITS] == SRT_TIMESTAMPS[~SRT_DIGITS]).all():
+            digits = chars.astype(np.int64) - ord("0")
+            return columns_to_ms(digits, 0), columns_to_ms(digits, 17)
+
+    fields = np.array([TIMESTAMPS.match(timestamp).groups() for timestamp in timestamps], dtype="U12")
+    fields[:, 3] = np.char.ljust(fields[:, 3], 3, "0")
+    fields[:, 7] = np.char.ljust(fields[:, 7], 3, "0")
+    values = fields.astype(np.int64)
+    starts = ((values[:, 0] * 60 + values[:, 1]) * 60 + values[:, 2]) * 1000 + values[:, 3]
+    ends = ((values[:, 4] * 60 + values[:, 5]) * 60 + values[:, 6]) * 1000 + values[:, 7]
+    return starts, ends
+
+
+def columns_to_ms(digits: np.ndarray, offset: int) -> np.ndarray:
+    column = lambda index: digits[:, offset + index]
+    hours = column(0) * 10 + column(1)
+    minutes = column(3) * 10 + column(4)
+    seconds = column(6) * 10 + column(7)
+    millis = column(9) * 100 + column(10) * 10 + column(11)
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis
+
+
+def parse_srt(text: str) -> SubtitleTrack:
+    matches = CUE.findall(text)
+    if not matches:
+        return SubtitleTrack.empty()
+
+    starts, ends = parse_timestamps([timestamps for timestamps, _ in matches])
+    return SubtitleTrack(starts, ends, [lines[1:] for _, lines in matches])
+
+
+def iter_srt(file: TextIO) -> Iterator[SubtitleTrack]:
+    """Parse an SRT stream READ_BLOCK_SIZE characters at a time, yielding the cues of each block as a track.
+
+    Blocks are cut at the last blank line they contain, so a cue never straddles two of them.
+    """
+    carry = ""
+    for block in iter(lambda: file.read(READ_BLOCK_SIZE), ""):
+        block = carry + block
+        boundary = block.rfind("\n\n")
+        if boundary < 0:
+            carry = block
+            continue
+
+        carry = block[boundary:]
+        yield parse_srt(block[:boundary])
+
+    yield parse_srt(carry)
+
+
+def read_srt(path: str) -> SubtitleTrack:
+    with open(path, "r", encoding="utf-8-sig") as file:
+        return concat(iter_srt(file))
+
+
+def format_times(ms: np.ndarray, hour_digits: int, fraction_digits: int, separator: str) -> list[str]:
+    """Format ms as h:mm:ss<separator>fraction strings with hour_digits hour digits, building the characters of all
+    times at once. The few times whose hours do not fit in hour_digits are formatted one by one."""
+    hours, rest = np.divmod(np.maximum(ms, 0), 3_600_000)
+    minutes, rest = np.divmod(rest, 60_000)
+    seconds, millis = np.divmod(rest, 1000)
+    fraction = millis // 10 ** (3 - fraction_digits)
+
+    digit = lambda values, power: values // 10 ** power % 10
+    columns = (
+        [digit(hours, power) for power in reversed(range(hour_digits))]
+        + [":", minutes // 10, minutes % 10, ":", seconds // 10, seconds % 10, separator]
+        + [digit(fraction, power) for power in reversed(range(fraction_digits))]
+    )
+    chars = np.empty((len(ms), len(columns)), dtype=np.uint8)
+    for index, column in enumerate(columns):
+        chars[:, index] = ord(column) if isinstance(column, str) else column + ord("0")
+
+    text = chars.tobytes().decode("ascii")
+    times = [text[begin : begin + len(columns)] for begin in range(0, len(text), len(columns))]
+    for index in np.flatnonzero(hours >= 10 ** hour_digits).tolist():
+        times[index] = f"{hours[index]}{times[index][hour_digits:]}"
+    return times
+
+
+def write_srt(track: SubtitleTrack, path: str):
+    """Write track as SRT, formatting and writing WRITE_BATCH_SIZE cues at a time."""
+    with open(path, "w", encoding="utf-8") as file:
+        for begin in range(0, len(track), WRITE_BATCH_SIZE):
+            end = begin + WRITE_BATCH_SIZE
+            file.write("".join(
+                f"{index}\n{start} --> {stop}\n{text}\n\n"
+                for index, start, stop, text in zip(
+                    range(begin + 1, end + 1),
+                    format_times(track.starts[begin:end], 2, 3, ","),
+                    format_times(track.ends[begin:end], 2, 3, ","),
+                    track.texts[begin:end],
+                )
+            ))
+
+
+def ass_text(text: str, words_per_line: int = ASS_WORDS_PER_LINE) -> str:
+    """Reflow the text of a cue on one line, or on two lines split at the middle word when it is longer than
+    words_per_line."""
+    words = text.split()
+    if len(words) <= words_per_line:
+        return " ".join(words)
+
+    middle = len(words) // 2
+    return " ".join(words[:middle]) + r"\N" + " ".join(words[middle:])
+
+
+def write_ass(track: SubtitleTrack, path: str, header: str, style: str = "Default"):
+    """Write track as ASS Dialogue events after header, which holds the script info, styles and events format."""
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(header)
+        for begin in range(0, len(track), WRITE_BATCH_SIZE):
+            end = begin + WRITE_BATCH_SIZE
+            file.write("".join(
+                f"Dialogue: 0,{start},{stop},{style},,0,0,0,,{ass_text(text)}\n"
+                for start, stop, text in zip(
+                    format_times(track.starts[begin:end], 1, 2, "."),
+                    format_times(track.ends[begin:end], 1, 2, "."),
+                    track.texts[begin:end],
+                )
+            ))
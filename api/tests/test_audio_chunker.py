@@ -0,0 +1,91 @@
+from audio_chunker import SAMPLE_RATE, VoiceActivity, find_silence_cut, trim_silence
+
+import numpy as np
+
+VAD = VoiceActivity(threshold_db=-45, min_silence=2, padding=0.3)
+
+
+def tone(seconds: float, dbfs: float, frequency: float = 440) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    amplitude = 32767 * 10 ** (dbfs / 20) * np.sqrt(2)
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def pcm(signal: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(signal), -32768, 32767).astype(np.int16)
+
+
+def test_digital_silence_is_dropped():
+    trimmed, offset_map = trim_silence(np.zeros(10 * SAMPLE_RATE, dtype=np.int16), VAD)
+    assert len(trimmed) == 0
+    assert offset_map == []
+
+
+def test_quiet_noise_is_dropped():
+    noise = np.random.default_rng(0).normal(0, 32767 * 10 ** (-60 / 20), 10 * SAMPLE_RATE)
+    trimmed, offset_map = trim_silence(pcm(noise), VAD)
+    assert len(trimmed) == 0
+
+
+def test_steady_loud_audio_is_kept_whole():
+    samples = pcm(tone(60, -12))
+    trimmed, offset_map = trim_silence(samples, VAD)
+    assert len(trimmed) == len(samples)
+    assert offset_map == []
+
+
+def test_speech_over_music_bed_is_kept():
+    samples = tone(60, -20, 220)
+    for start in range(5, 60, 10):
+        samples[start * SAMPLE_RATE : (start + 3) * SAMPLE_RATE] += tone(3, -14, 880)
+    trimmed, offset_map = trim_silence(pcm(samples), VAD)
+    assert len(trimmed) == len(samples)
+
+
+def test_long_silence_between_speech_is_cut():
+    samples = np.concatenate([tone(5, -20), np.zeros(10 * SAMPLE_RATE), tone(5, -20)])
+    trimmed, offset_map = trim_silence(pcm(samples), VAD)
+
+    assert len(offset_map) == 2
+    assert offset_map[0] == (0, 0)
+    trimmed_ms, source_ms = offset_map[1]
+    assert 14_500 <= source_ms <= 15_000
+    assert source_ms - trimmed_ms >= 9_000
+    assert len(trimmed) == trimmed_ms * SAMPLE_RATE // 1000 + len(samples) - source_ms * SAMPLE_RATE // 1000
+
+
+def test_short_pause_is_kept():
+    samples = np.concatenate([tone(5, -20), np.zeros(SAMPLE_RATE), tone(5, -20)])
+    trimmed, offset_map = trim_silence(pcm(samples), VAD)
+    assert len(trimmed) == len(samples)
+    assert offset_map == []
+
+
+def test_shorter_than_a_frame():
+    samples = pcm(tone(0.01, -20))
+    trimmed, offset_map = trim_silence(samples, VAD)
+    assert len(trimmed) == len(samples)
+
+
+def test_cut_falls_in_the_pause_near_target():
+    samples = pcm(np.concatenate([tone(10, -20), np.zeros(SAMPLE_RATE), tone(10, -20)]))
+    cut = find_silence_cut(samples, 9 * SAMPLE_RATE, 3 * SAMPLE_RATE)
+    assert 10 * SAMPLE_RATE <= cut <= 11 * SAMPLE_RATE
+
+
+def test_cut_prefers_a_pause_over_a_gap_inside_a_word():
+    samples = np.concatenate([tone(10, -20), np.zeros(SAMPLE_RATE), tone(10, -20)])
+    samples[int(9.5 * SAMPLE_RATE) : int(9.53 * SAMPLE_RATE)] = 0
+    cut = find_silence_cut(pcm(samples), int(9.5 * SAMPLE_RATE), 3 * SAMPLE_RATE)
+    assert 10 * SAMPLE_RATE <= cut <= 11 * SAMPLE_RATE
+
+
+def test_cut_in_silence_stays_at_target():
+    samples = np.zeros(20 * SAMPLE_RATE, dtype=np.int16)
+    cut = find_silence_cut(samples, 10 * SAMPLE_RATE, 3 * SAMPLE_RATE)
+    assert abs(cut - 10 * SAMPLE_RATE) <= SAMPLE_RATE // 50
+
+
+def test_cut_without_a_full_frame_is_target():
+    samples = pcm(tone(0.01, -20))
+    assert find_silence_cut(samples, 80, 40) == 80
@@ -0,0 +1,105 @@
+from callback_client import DELIVERED, REJECTED, RETRY, CallbackClient
+from models import ExtractSoundFailureResponse, GetVideoFailureResponse
+from types import SimpleNamespace
+
+import callback_client
+import os
+import pytest
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(callback_client, "record_callback_job", lambda path, response: None)
+    monkeypatch.setattr(CallbackClient, "start", lambda self: None)
+    config = SimpleNamespace(
+        SUBSTREAM_API_URL="http://api",
+        PROCESSOR_TOKEN="token",
+        CALLBACK_TIMEOUT=1,
+        CALLBACK_POOL_SIZE=1,
+        CALLBACK_RETRY_BASE_DELAY=10,
+        CALLBACK_RETRY_MAX_DELAY=100,
+        CALLBACK_FLUSH_INTERVAL=5,
+        CALLBACK_OUTBOX_DIR=str(tmp_path / "outbox"),
+    )
+    return CallbackClient(config)
+
+
+def answer(client, monkeypatch, statuses: dict) -> list:
+    """Make client.post return statuses[(path, stream_id)] (DELIVERED by default) and record the posts."""
+    posted = []
+
+    def post(path, payload):
+        posted.append((path, payload["stream_id"]))
+        return statuses.get((path, payload["stream_id"]), DELIVERED)
+
+    monkeypatch.setattr(client, "post", post)
+    return posted
+
+
+def test_send_queues_without_posting(client, monkeypatch):
+    posted = answer(client, monkeypatch, {})
+    client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    assert client.pending() == 1
+    assert posted == []
+
+
+def test_entries_are_delivered_oldest_first(client, monkeypatch):
+    posted = answer(client, monkeypatch, {})
+    client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(stream_id="s2"))
+    client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(stream_id="s1"))
+
+    client.flush()
+    assert posted == [
+        ("/processor/get-video-url-failure", "s1"),
+        ("/processor/extract-sound-failure", "s2"),
+        ("/processor/extract-sound-failure", "s1"),
+    ]
+    assert client.pending() == 0
+
+
+def test_retry_holds_back_later_entries_of_the_stream(client, monkeypatch):
+    posted = answer(client, monkeypatch, {("/processor/get-video-url-failure", "s1"): RETRY})
+    client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(stream_id="s1"))
+
+    delay = client.flush()
+    assert posted == [("/processor/get-video-url-failure", "s1")]
+    assert 5 <= delay <= 10
+    assert client.pending() == 2
+
+    # The next pass still finds the first entry waiting on its backoff, so the second is not sent ahead of it.
+    client.flush()
+    assert posted == [("/processor/get-video-url-failure", "s1")]
+
+
+def test_backoff_of_one_stream_does_not_hold_others(client, monkeypatch):
+    answer(client, monkeypatch, {("/processor/get-video-url-failure", "s1"): RETRY})
+    client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    client.flush()
+
+    posted = answer(client, monkeypatch, {})
+    client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(stream_id="s2"))
+    client.flush()
+    assert posted == [("/processor/extract-sound-failure", "s2")]
+    assert client.pending() == 1
+
+
+def test_rejected_entries_move_to_the_rejected_directory(client, monkeypatch):
+    posted = answer(client, monkeypatch, {("/processor/get-video-url-failure", "s1"): REJECTED})
+    name = client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    client.send("/processor/extract-sound-failure", ExtractSoundFailureResponse(stream_id="s1"))
+
+    client.flush()
+    assert len(posted) == 2
+    assert client.pending() == 0
+    assert os.listdir(client.rejected_dir) == [name]
+
+
+def test_job_store_errors_do_not_block_the_callback(client, monkeypatch):
+    def fail(path, response):
+        raise RuntimeError("job store unavailable")
+
+    monkeypatch.setattr(callback_client, "record_callback_job", fail)
+    client.send("/processor/get-video-url-failure", GetVideoFailureResponse(stream_id="s1"))
+    assert client.pending() == 1
@@ -0,0 +1,101 @@
+from checkpoint import Checkpoint, fingerprint
+from config import Config
+
+import pytest
+
+INPUTS = {"stream_file_name": "video.mp4", "duration": 600, "source_etag": '"abc"'}
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_json(self, data, object_name) -> bool:
+        self.objects[object_name] = data
+        return True
+
+    def download_json(self, object_name, strict: bool = False):
+        return self.objects.get(object_name)
+
+    def head_file(self, object_name) -> dict:
+        return {"etag": '"abc"', "size": 1000}
+
+
+@pytest.fixture(autouse=True)
+def checkpoints_enabled(monkeypatch):
+    monkeypatch.setattr(Config, "CHECKPOINTS_ENABLED", True)
+
+
+def test_fingerprint_ignores_key_order_and_tracks_values():
+    assert fingerprint({"a": 1, "b": 2}) == fingerprint({"b": 2, "a": 1})
+    assert fingerprint({"a": 1, "b": 2}) != fingerprint({"a": 1, "b": 3})
+
+
+def test_new_checkpoint_starts_empty():
+    checkpoint = Checkpoint.load(FakeS3Client(), "s1", "extract_sound", INPUTS)
+    assert not checkpoint.completed
+    assert checkpoint.progress.outputs == {}
+
+
+def test_finished_outputs_are_resumed():
+    s3_client = FakeS3Client()
+    checkpoint = Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS)
+    checkpoint.mark_done("s1_1.wav", {"start_ms": 0})
+    assert "s1/checkpoints/extract_sound.json" in s3_client.objects
+
+    resumed = Checkpoint.load(s3_client, "s1", "extract_sound", dict(INPUTS))
+    assert resumed.done("s1_1.wav")
+    assert resumed.output("s1_1.wav") == {"start_ms": 0}
+    assert not resumed.done("s1_2.wav")
+    assert not resumed.completed
+
+
+def test_completed_result_is_resumed():
+    s3_client = FakeS3Client()
+    Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS).complete({"chunks": []})
+
+    resumed = Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS)
+    assert resumed.completed
+    assert resumed.result == {"chunks": []}
+
+
+def test_other_inputs_start_over():
+    s3_client = FakeS3Client()
+    Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS).mark_done("s1_1.wav", {"start_ms": 0})
+
+    restarted = Checkpoint.load(s3_client, "s1", "extract_sound", {**INPUTS, "source_etag": '"def"'})
+    assert restarted.progress.outputs == {}
+
+    # Its first write replaces the manifest of the old inputs.
+    restarted.mark_done("s1_1.wav", {"start_ms": 5})
+    assert Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS).progress.outputs == {}
+
+
+def test_stages_and_streams_are_kept_apart():
+    s3_client = FakeS3Client()
+    Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS).mark_done("s1_1.wav", {})
+    assert Checkpoint.load(s3_client, "s1", "generate_subtitles", INPUTS).progress.outputs == {}
+    assert Checkpoint.load(s3_client, "s2", "extract_sound", INPUTS).progress.outputs == {}
+
+
+def test_disabled_checkpoints_neither_load_nor_save(monkeypatch):
+    s3_client = FakeS3Client()
+    Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS).mark_done("s1_1.wav", {})
+
+    monkeypatch.setattr(Config, "CHECKPOINTS_ENABLED", False)
+    checkpoint = Checkpoint.load(s3_client, "s1", "extract_sound", INPUTS)
+    assert checkpoint.progress.outputs == {}
+    assert not checkpoint.save()
+
+
+def test_extract_sound_inputs_include_the_source_object(monkeypatch):
+    import extract_sound_task
+
+    s3_client = FakeS3Client()
+    monkeypatch.setattr(extract_sound_task, "s3_client", s3_client)
+    inputs = extract_sound_task.get_extract_sound_inputs("s1", "s1.mp4")
+    assert inputs["source_etag"] == '"abc"'
+    assert inputs["source_size"] == 1000
+
+    monkeypatch.setattr(s3_client, "head_file", lambda object_name: {"etag": '"def"', "size": 1000})
+    assert fingerprint(extract_sound_task.get_extract_sound_inputs("s1", "s1.mp4")) != fingerprint(inputs)
@@ -0,0 +1,119 @@
+from config import Config
+from job_store import FAILED, QUEUED, RUNNING, SUCCEEDED, JobStore, mark_job_finished, mark_job_running, record_callback
+from models import GenerateSubtitlesProgressResponse, JobStage
+from types import SimpleNamespace
+
+import job_store
+import pytest
+
+TASK = SimpleNamespace(
+    name="tasks.extract_sound_task",
+    run=lambda stream_id, stream_file_name: None,
+    request=SimpleNamespace(hostname="w1", retries=0),
+)
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_json(self, data, object_name) -> bool:
+        self.objects[object_name] = data
+        return True
+
+    def download_json(self, object_name, strict: bool = False):
+        return self.objects.get(object_name)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = JobStore(FakeS3Client())
+    monkeypatch.setattr(Config, "JOB_STORE_ENABLED", True)
+    monkeypatch.setattr(JobStore, "_shared", store)
+    monkeypatch.setattr(job_store, "current_job", None)
+    return store
+
+
+def put(store: JobStore, stage: str, state: str, **fields):
+    store.put(JobStage(stream_id="s1", stage=stage, state=state, **fields))
+
+
+def progress(chunks_done: int, chunks_total: int) -> GenerateSubtitlesProgressResponse:
+    return GenerateSubtitlesProgressResponse(
+        stream_id="s1",
+        subtitle_srt_file="s1.srt",
+        covered_from_ms=0,
+        covered_until_ms=0,
+        chunks_done=chunks_done,
+        chunks_total=chunks_total,
+    )
+
+
+def test_unknown_stream_has_no_status(store):
+    assert store.status("s1") is None
+
+
+@pytest.mark.parametrize("states, expected", [
+    ([SUCCEEDED, SUCCEEDED], SUCCEEDED),
+    ([SUCCEEDED, QUEUED], QUEUED),
+    ([SUCCEEDED, RUNNING, QUEUED], RUNNING),
+    ([SUCCEEDED, RUNNING, FAILED], FAILED),
+])
+def test_stream_state_aggregates_its_stages(store, states, expected):
+    for stage, state in zip(job_store.STAGES, states):
+        put(store, stage, state)
+
+    status = store.status("s1")
+    assert status.state == expected
+    assert [record.stage for record in status.stages] == job_store.STAGES[: len(states)]
+
+
+def test_status_reports_queue_wait_and_run_time(store):
+    put(store, "get_video", SUCCEEDED, queued_at=100.0, started_at=102.5, finished_at=110.0)
+    put(store, "extract_sound", RUNNING, queued_at=110.0, started_at=111.0)
+    put(store, "generate_subtitles", QUEUED, queued_at=111.0)
+
+    status = store.status("s1")
+    assert status.queue_wait_seconds == {"get_video": 2.5, "extract_sound": 1.0}
+    assert status.run_seconds == {"get_video": 7.5}
+
+
+def test_progress_callback_updates_the_stage(store):
+    put(store, "generate_subtitles", RUNNING)
+    record_callback("/processor/generate-subtitles-progress", progress(1, 3))
+    assert store.get("s1", "generate_subtitles").progress == 0.333
+
+
+def test_progress_without_chunks_is_ignored(store):
+    put(store, "generate_subtitles", RUNNING)
+    record_callback("/processor/generate-subtitles-progress", progress(0, 0))
+    assert store.get("s1", "generate_subtitles").progress is None
+
+
+def test_failure_callback_fails_the_stage(store):
+    put(store, "extract_sound", RUNNING)
+    record_callback("/processor/extract-sound-failure", SimpleNamespace(stream_id="s1"))
+    record = store.get("s1", "extract_sound")
+    assert record.state == FAILED
+    assert record.finished_at is not None
+
+
+def test_task_without_callback_is_closed_by_its_outcome(store):
+    mark_job_running(task_id="t1", task=TASK, args=["s1", "s1.mp4"], kwargs={})
+    assert store.get("s1", "extract_sound").state == RUNNING
+
+    mark_job_finished(state="IGNORED")
+    assert store.get("s1", "extract_sound").state == QUEUED
+
+    mark_job_running(task_id="t1", task=TASK, args=["s1", "s1.mp4"], kwargs={})
+    mark_job_finished(state="SUCCESS")
+    record = store.get("s1", "extract_sound")
+    assert record.state == SUCCEEDED
+    assert record.progress == 1.0
+
+
+def test_callback_outcome_is_kept_when_the_task_finishes(store):
+    mark_job_running(task_id="t1", task=TASK, args=["s1", "s1.mp4"], kwargs={})
+    record_callback("/processor/extract-sound-failure", SimpleNamespace(stream_id="s1"))
+    mark_job_finished(state="SUCCESS")
+    assert store.get("s1", "extract_sound").state == FAILED
@@ -0,0 +1,104 @@
+from rate_limiter import BrokerLimiterStore, FileLimiterStore, MemoryLimiterStore, RateLimiter
+
+import pytest
+import rate_limiter
+import threading
+import uuid
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "file", "broker"])
+def make_store(request, tmp_path):
+    path = tmp_path / "limiter" / "asr.json"
+    queue = f"limiter-{uuid.uuid4().hex}"
+    stores = {
+        "memory": lambda burst: MemoryLimiterStore(burst),
+        "file": lambda burst: FileLimiterStore(str(path), burst),
+        "broker": lambda burst: BrokerLimiterStore("memory://", queue, burst, lock_timeout=0.05),
+    }
+    return stores[request.param]
+
+
+def limiter(store, rate: float = 1.0, burst: int = 2, max_in_flight: int = 2, lease_ttl: float = 60) -> RateLimiter:
+    return RateLimiter("test", store, rate=rate, burst=burst, max_in_flight=max_in_flight, lease_ttl=lease_ttl)
+
+
+def test_in_flight_slots_are_capped_until_released(make_store, clock):
+    asr = limiter(make_store(10), rate=100, burst=10, max_in_flight=2)
+    first, _ = asr.try_acquire()
+    second, _ = asr.try_acquire()
+    third, wait = asr.try_acquire()
+    assert first and second and third is None
+    assert wait == rate_limiter.MAX_WAIT
+
+    asr.release([first])
+    lease, _ = asr.try_acquire()
+    assert lease is not None
+
+
+def test_tokens_refill_at_rate(make_store, clock):
+    asr = limiter(make_store(2), rate=2, burst=2, max_in_flight=10)
+    leases = [asr.try_acquire()[0] for _ in range(2)]
+    lease, wait = asr.try_acquire()
+    assert all(leases) and lease is None
+    assert wait == pytest.approx(0.5)
+
+    clock.now += 0.5
+    lease, _ = asr.try_acquire()
+    assert lease is not None
+
+
+def test_expired_leases_free_their_slot(make_store, clock):
+    asr = limiter(make_store(10), rate=100, burst=10, max_in_flight=1, lease_ttl=30)
+    lease, _ = asr.try_acquire()
+    assert asr.try_acquire()[0] is None
+
+    clock.now += 20
+    asr.renew([lease])
+    clock.now += 20
+    assert asr.try_acquire()[0] is None
+
+    clock.now += 20
+    assert asr.try_acquire()[0] is not None
+
+
+def test_limiters_on_one_store_share_limits(make_store, clock):
+    store = make_store(10)
+    first = limiter(store, rate=100, burst=10, max_in_flight=1)
+    second = limiter(store, rate=100, burst=10, max_in_flight=1)
+    assert first.try_acquire()[0] is not None
+    assert second.try_acquire()[0] is None
+
+
+def test_file_stores_on_one_path_share_state(tmp_path, clock):
+    path = str(tmp_path / "asr.json")
+    first = limiter(FileLimiterStore(path, 10), rate=100, burst=10, max_in_flight=1)
+    second = limiter(FileLimiterStore(path, 10), rate=100, burst=10, max_in_flight=1)
+    lease, _ = first.try_acquire()
+    assert second.try_acquire()[0] is None
+
+    first.release([lease])
+    assert second.try_acquire()[0] is not None
+
+
+def test_acquire_returns_none_when_cancelled():
+    asr = limiter(MemoryLimiterStore(1), rate=100, burst=1, max_in_flight=1)
+    assert asr.acquire() is not None
+
+    cancelled = threading.Event()
+    cancelled.set()
+    assert asr.acquire(cancelled) is None
@@ -0,0 +1,127 @@
+from config import Config
+from contextlib import contextmanager
+from fastapi import HTTPException
+from job_store import JobStore
+from scheduling import StageJob, choose_queue, estimate_media_seconds, send_stage_batch
+
+import pytest
+import scheduling
+
+
+@pytest.fixture(autouse=True)
+def lanes(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEDULING_LANES", True)
+    monkeypatch.setattr(Config, "SCHEDULING_LONG_JOB_SECONDS", 1800)
+    monkeypatch.setattr(Config, "SCHEDULING_BYTES_PER_SECOND", 1000)
+
+
+def test_long_jobs_go_to_the_long_lane():
+    assert choose_queue("extract_sound_task", 1800) == "extract_sound_task_long"
+    assert choose_queue("extract_sound_task", 7200) == "extract_sound_task_long"
+
+
+def test_short_and_unknown_jobs_stay_on_the_queue():
+    assert choose_queue("extract_sound_task", 1799) == "extract_sound_task"
+    assert choose_queue("extract_sound_task", None) == "extract_sound_task"
+
+
+def test_queues_without_lanes_take_every_job():
+    assert choose_queue("transform_subtitle_task", 7200) == "transform_subtitle_task"
+
+
+def test_lanes_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEDULING_LANES", False)
+    assert choose_queue("extract_sound_task", 7200) == "extract_sound_task"
+
+
+def test_media_seconds_fall_back_on_size():
+    assert estimate_media_seconds(duration=120) == 120
+    assert estimate_media_seconds(duration=120, size=10_000_000) == 120
+    assert estimate_media_seconds(size=10_000_000) == 10_000
+    assert estimate_media_seconds() is None
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_json(self, data, object_name) -> bool:
+        self.objects[object_name] = data
+        return True
+
+    def download_json(self, object_name, strict: bool = False):
+        return self.objects.get(object_name)
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Record the tasks sent to the broker, and the producers they were sent with, instead of sending them."""
+    sent = []
+    producers = []
+
+    @contextmanager
+    def producer_or_acquire(producer=None):
+        producers.append(object())
+        yield producers[-1]
+
+    monkeypatch.setattr(scheduling.celery, "producer_or_acquire", producer_or_acquire)
+    monkeypatch.setattr(scheduling.celery, "send_task", lambda name, **options: sent.append((name, options)))
+    monkeypatch.setattr(Config, "JOB_STORE_ENABLED", True)
+    monkeypatch.setattr(JobStore, "_shared", JobStore(FakeS3Client()))
+    return sent, producers
+
+
+def test_batch_is_published_in_order_over_one_producer(published):
+    sent, producers = published
+    jobs = [
+        StageJob("extract_sound_task", "s1", ["s1", "s1.mp4"], 7200),
+        StageJob("extract_sound_task", "s2", ["s2", "s2.mp4"], 60),
+        StageJob("extract_sound_task", "s3", ["s3", "s3.mp4"]),
+    ]
+    assert send_stage_batch(lambda job: job, jobs) == ["s1", "s2", "s3"]
+
+    assert [options["args"] for _, options in sent] == [job.args for job in jobs]
+    assert [options["queue"] for _, options in sent] == [
+        "extract_sound_task_long", "extract_sound_task", "extract_sound_task"
+    ]
+    assert all(name == "tasks.extract_sound_task" for name, _ in sent)
+    assert len(producers) == 1
+    assert all(options["producer"] is producers[0] for _, options in sent)
+
+
+def test_batch_jobs_are_queued_in_the_job_store_with_their_task(published):
+    sent, _ = published
+    send_stage_batch(lambda job: job, [StageJob("extract_sound_task", "s1", ["s1", "s1.mp4"], 7200)])
+
+    record = JobStore.shared(Config).get("s1", "extract_sound")
+    assert record.state == "queued"
+    assert record.task_id == sent[0][1]["task_id"]
+    assert record.queue == "extract_sound_task_long"
+
+
+def test_long_lane_time_limits_scale_with_media(published):
+    sent, _ = published
+    send_stage_batch(lambda job: job, [
+        StageJob("extract_sound_task", "s1", ["s1", "s1.mp4"], 60),
+        StageJob("extract_sound_task", "s2", ["s2", "s2.mp4"], 3600),
+        StageJob("extract_sound_task", "s3", ["s3", "s3.mp4"], 100 * 3600),
+    ])
+    assert [options["soft_time_limit"] for _, options in sent] == [1200, 2400, 3 * 3600]
+    assert all(options["time_limit"] > options["soft_time_limit"] for _, options in sent)
+
+
+def test_empty_batch_is_rejected(published):
+    with pytest.raises(HTTPException) as error:
+        send_stage_batch(lambda job: job, [])
+    assert error.value.status_code == 400
+
+
+def test_oversized_batch_is_rejected_before_anything_is_queued(published, monkeypatch):
+    sent, _ = published
+    monkeypatch.setattr(Config, "BATCH_MAX_SIZE", 2)
+    jobs = [StageJob("extract_sound_task", f"s{index}", [f"s{index}", "video.mp4"]) for index in range(3)]
+    with pytest.raises(HTTPException) as error:
+        send_stage_batch(lambda job: job, jobs)
+    assert error.value.status_code == 413
+    assert sent == []
+    assert JobStore.shared(Config).get("s0", "extract_sound") is None
@@ -0,0 +1,134 @@
+from subtitles import (
+    SubtitleTrack, format_times, iter_srt, parse_srt, parse_timestamps, read_srt, remap, write_ass, write_srt
+)
+
+import io
+import subtitles
+
+import numpy as np
+
+# Two kept spans: trimmed 0-10 s is source 0-10 s, trimmed 10 s onwards is source 30 s onwards.
+OFFSET_MAP = [(0, 0), (10_000, 30_000)]
+
+
+def track(*cues: tuple[int, int]) -> SubtitleTrack:
+    return SubtitleTrack(
+        np.array([start for start, _ in cues], dtype=np.int64),
+        np.array([end for _, end in cues], dtype=np.int64),
+        [f"cue {index}" for index in range(len(cues))],
+    )
+
+
+def test_empty_map_leaves_track_unchanged():
+    cues = track((1_000, 2_000))
+    assert remap(cues, []) is cues
+
+
+def test_empty_track():
+    assert len(remap(SubtitleTrack.empty(), OFFSET_MAP)) == 0
+
+
+def test_cues_inside_spans_are_shifted():
+    remapped = remap(track((1_000, 2_000), (12_000, 13_000)), OFFSET_MAP)
+    assert remapped.starts.tolist() == [1_000, 32_000]
+    assert remapped.ends.tolist() == [2_000, 33_000]
+    assert remapped.texts == ["cue 0", "cue 1"]
+
+
+def test_start_on_boundary_goes_to_next_span():
+    remapped = remap(track((10_000, 11_000)), OFFSET_MAP)
+    assert remapped.starts.tolist() == [30_000]
+    assert remapped.ends.tolist() == [31_000]
+
+
+def test_end_on_boundary_stays_in_previous_span():
+    remapped = remap(track((9_000, 10_000)), OFFSET_MAP)
+    assert remapped.starts.tolist() == [9_000]
+    assert remapped.ends.tolist() == [10_000]
+
+
+def test_cue_spanning_a_cut():
+    remapped = remap(track((9_000, 11_000)), OFFSET_MAP)
+    assert remapped.starts.tolist() == [9_000]
+    assert remapped.ends.tolist() == [31_000]
+
+
+def test_map_not_starting_at_zero():
+    remapped = remap(track((0, 500)), [(0, 4_000)])
+    assert remapped.starts.tolist() == [4_000]
+    assert remapped.ends.tolist() == [4_500]
+
+
+SRT = """1
+00:00:01,000 --> 00:00:02,500
+first cue
+
+2
+00:01:02,050 --> 01:00:00,000
+second cue
+on two lines
+"""
+
+
+def test_parse_srt():
+    parsed = parse_srt(SRT)
+    assert parsed.starts.tolist() == [1_000, 62_050]
+    assert parsed.ends.tolist() == [2_500, 3_600_000]
+    assert parsed.texts == ["first cue", "second cue\non two lines"]
+
+
+def test_parse_srt_ignores_indexes_and_accepts_loose_timestamps():
+    parsed = parse_srt("\n\n7\n0:0:1.5 --> 0:00:02.25 X1:10\ncue\n\nnot a cue\n")
+    assert parsed.starts.tolist() == [1_500]
+    assert parsed.ends.tolist() == [2_250]
+    assert parsed.texts == ["cue"]
+
+
+def test_parse_srt_without_cues():
+    assert len(parse_srt("")) == 0
+    assert len(parse_srt("1\nno timestamps\n")) == 0
+
+
+def test_parse_timestamps_canonical_and_loose_layouts_agree():
+    canonical = parse_timestamps(["12:34:56,789 --> 12:34:57,001"])
+    loose = parse_timestamps(["12:34:56.789 --> 12:34:57.001", "100:00:00,5 --> 100:00:01,05"])
+    assert [values.tolist() for values in canonical] == [[45_296_789], [45_297_001]]
+    assert [values.tolist() for values in loose] == [[45_296_789, 360_000_500], [45_297_001, 360_001_050]]
+
+
+def test_iter_srt_never_splits_a_cue(monkeypatch):
+    monkeypatch.setattr(subtitles, "READ_BLOCK_SIZE", 7)
+    blocks = list(iter_srt(io.StringIO(SRT)))
+    assert sum(len(block) for block in blocks) == 2
+    assert [text for block in blocks for text in block.texts] == ["first cue", "second cue\non two lines"]
+
+
+def test_format_times():
+    ms = np.array([0, 62_050, 3_600_000, 36_000_000 + 1], dtype=np.int64)
+    assert format_times(ms, 2, 3, ",") == ["00:00:00,000", "00:01:02,050", "01:00:00,000", "10:00:00,001"]
+    assert format_times(ms, 1, 2, ".") == ["0:00:00.00", "0:01:02.05", "1:00:00.00", "10:00:00.00"]
+
+
+def test_srt_round_trip(tmp_path):
+    original = parse_srt(SRT)
+    write_srt(original, tmp_path / "track.srt")
+    assert (tmp_path / "track.srt").read_text(encoding="utf-8").startswith(SRT.split("\n\n")[0] + "\n\n")
+
+    parsed = read_srt(tmp_path / "track.srt")
+    assert parsed.starts.tolist() == original.starts.tolist()
+    assert parsed.ends.tolist() == original.ends.tolist()
+    assert parsed.texts == original.texts
+
+
+def test_write_ass(tmp_path):
+    cues = SubtitleTrack(
+        np.array([1_000, 62_050], dtype=np.int64),
+        np.array([2_500, 3_600_000], dtype=np.int64),
+        ["short cue", "a cue with\nmore than four words"],
+    )
+    write_ass(cues, tmp_path / "track.ass", "[Events]\n", style="Burned")
+    assert (tmp_path / "track.ass").read_text(encoding="utf-8").splitlines() == [
+        "[Events]",
+        "Dialogue: 0,0:00:01.00,0:00:02.50,Burned,,0,0,0,,short cue",
+        r"Dialogue: 0,0:01:02.05,1:00:00.00,Burned,,0,0,0,,a cue with\Nmore than four words",
+    ]
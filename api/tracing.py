@@ -0,0 +1,392 @@
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_shutdown
+from config import Config
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+import argparse
+import atexit
+import contextvars
+import hashlib
+import inspect
+import json
+import os
+import requests
+import socket
+import threading
+import time
+
+# Spans of one stream share a trace id derived from the stream id, so the stages the Substream API starts with
+# separate requests end up in the same trace. Within a process the current span is held in a context variable; a
+# task published from inside a span carries it in a W3C traceparent message header, and the task span on the worker
+# that runs it becomes its child.
+
+HOSTNAME = socket.gethostname()
+CURRENT = object()
+
+current_span = contextvars.ContextVar("current_span", default=None)
+# Span of the task running in this pool process. Threads do not inherit context variables, so spans opened on
+# a worker thread without an explicit parent fall back to it.
+task_span = None
+
+
+def stream_trace_id(stream_id: str) -> str:
+    return hashlib.sha256(stream_id.encode("utf-8")).hexdigest()[:32]
+
+
+def parse_traceparent(value: str) -> tuple[Optional[str], Optional[str]]:
+    parts = value.split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    return parts[1], parts[2]
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    stream_id: Optional[str]
+    start_ns: int
+    attributes: dict = field(default_factory=dict)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def end(self, error=None):
+        """Close the span and hand it to the exporter. Only the first call has an effect."""
+        if self.end_ns is not None:
+            return
+
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.fail(error)
+        exporter.export(self)
+
+    def to_record(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "stream_id": self.stream_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+            "service": Config.TRACING_SERVICE_NAME,
+            "host": HOSTNAME,
+            "pid": os.getpid(),
+        }
+
+    def to_otlp(self) -> dict:
+        attributes = dict(self.attributes, stream_id=self.stream_id) if self.stream_id else self.attributes
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [otlp_attribute(key, value) for key, value in attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def start_span(name: str, parent=CURRENT, stream_id: str = None, **attributes) -> Span:
+    """Open a span under parent: a Span, a traceparent header value, None for a root span, or by default the
+    current span. Spans with a stream_id, given or inherited from their parent, go to the trace of that stream."""
+    if parent is CURRENT:
+        parent = current_span.get() or task_span
+
+    if isinstance(parent, Span):
+        trace_id, parent_span_id = parent.trace_id, parent.span_id
+        stream_id = stream_id or parent.stream_id
+    else:
+        trace_id, parent_span_id = parse_traceparent(parent)
+
+    if stream_id and trace_id != stream_trace_id(stream_id):
+        trace_id, parent_span_id = stream_trace_id(stream_id), None
+
+    return Span(
+        name=name,
+        trace_id=trace_id or os.urandom(16).hex(),
+        span_id=os.urandom(8).hex(),
+        parent_span_id=parent_span_id,
+        stream_id=stream_id,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+
+
+@contextmanager
+def span(name: str, parent=CURRENT, stream_id: str = None, **attributes):
+    """Record the enclosed block as a span and make it the current span while it runs."""
+    current = start_span(name, parent, stream_id, **attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(repr(e))
+        raise
+    finally:
+        current_span.reset(token)
+        current.end()
+
+
+def in_current_span(function):
+    """Wrap function so that spans it opens on another thread are children of the span current here."""
+    parent = current_span.get()
+
+    def run(*args, **kwargs):
+        token = current_span.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current_span.reset(token)
+
+    return run
+
+
+def mark_task_failed(error):
+    if task_span is not None:
+        task_span.fail(error)
+
+
+def otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class NoopSpanExporter:
+    def export(self, span: Span):
+        pass
+
+    def flush(self):
+        pass
+
+
+class FileSpanExporter:
+    """Appends spans as JSON lines to a file that every process of the node can share.
+
+    Each span is written with a single O_APPEND write, so lines of concurrent processes do not interleave.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, span: Span):
+        line = (json.dumps(span.to_record()) + "\n").encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"error writing span {span.name} to {self.path} ({e})")
+
+    def flush(self):
+        pass
+
+
+class OtlpSpanExporter:
+    """Sends spans to an OTLP/HTTP collector (JSON encoding) in batches from a background thread.
+
+    Tracing must never slow a task down: export() only appends to an in-memory batch, and a batch the collector
+    does not accept is dropped instead of retried.
+    """
+
+    def __init__(self, endpoint: str, batch_size: int, interval: float, timeout: float = 5):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.spans = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.session = None
+        self.sender = None
+        self.sender_pid = None
+
+    def export(self, span: Span):
+        self.start()
+        with self.lock:
+            self.spans.append(span.to_otlp())
+            full = len(self.spans) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def start(self):
+        """Start the sender thread of this process, dropping spans a forked child inherited from its parent."""
+        with self.lock:
+            if self.sender_pid == os.getpid() and self.sender.is_alive():
+                return
+
+            if self.sender_pid != os.getpid():
+                self.spans = []
+            self.session = requests.Session()
+            self.wakeup = threading.Event()
+            self.sender = threading.Thread(target=self.run, name="span-exporter", daemon=True)
+            self.sender_pid = os.getpid()
+            self.sender.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans or self.session is None:
+            return
+
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [
+                otlp_attribute("service.name", Config.TRACING_SERVICE_NAME),
+                otlp_attribute("host.name", HOSTNAME),
+                otlp_attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{"scope": {"name": "processor"}, "spans": spans}],
+        }]}
+        try:
+            response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+            if not response.ok:
+                print(f"span collector rejected {len(spans)} spans with status {response.status_code}")
+        except requests.RequestException as e:
+            print(f"error sending {len(spans)} spans to {self.endpoint} ({e})")
+
+
+def create_exporter(config):
+    if config.TRACING_EXPORTER == "file":
+        return FileSpanExporter(config.TRACING_FILE)
+    if config.TRACING_EXPORTER == "otlp":
+        return OtlpSpanExporter(config.TRACING_OTLP_ENDPOINT, config.TRACING_BATCH_SIZE, config.TRACING_EXPORT_INTERVAL)
+    return NoopSpanExporter()
+
+
+exporter = create_exporter(Config)
+atexit.register(exporter.flush)
+
+
+def find_stream_id(task, args, kwargs) -> Optional[str]:
+    try:
+        return inspect.signature(task.run).bind_partial(*(args or ()), **(kwargs or {})).arguments.get("stream_id")
+    except (TypeError, ValueError):
+        return None
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    parent = current_span.get() or task_span
+    if headers is not None and parent is not None:
+        headers["traceparent"] = parent.traceparent
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, args=None, kwargs=None, **extra):
+    global task_span
+    task_span = start_span(
+        f"task {task.name.removeprefix('tasks.')}",
+        parent=getattr(task.request, "traceparent", None),
+        stream_id=find_stream_id(task, args, kwargs),
+        task_id=task_id,
+        retries=task.request.retries or 0,
+        worker=task.request.hostname or HOSTNAME,
+    )
+
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at:
+        task_span.set(queue_wait_ms=round(max(0.0, time.time() - float(enqueued_at)) * 1000, 3))
+
+
+@task_postrun.connect
+def end_task_span(state=None, **kwargs):
+    global task_span
+    if task_span is None:
+        return
+
+    task_span.set(state=state)
+    if state == "FAILURE":
+        task_span.fail(state)
+    task_span.end()
+    task_span = None
+
+
+@worker_process_shutdown.connect
+def flush_spans(**kwargs):
+    exporter.flush()
+
+
+def load_stream_spans(path: str, stream_id: str) -> list[dict]:
+    trace_id = stream_trace_id(stream_id)
+    with open(path, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if trace_id in line]
+    return sorted((record for record in records if record["trace_id"] == trace_id), key=lambda r: r["start_time_unix_nano"])
+
+
+def format_timeline(records: list[dict]) -> list[str]:
+    """Render spans as an indented tree with each span's start offset and duration."""
+    if not records:
+        return []
+
+    ids = {record["span_id"] for record in records}
+    children = {}
+    for record in records:
+        parent = record["parent_span_id"] if record["parent_span_id"] in ids else None
+        children.setdefault(parent, []).append(record)
+
+    origin = records[0]["start_time_unix_nano"]
+    lines = []
+
+    def render(record: dict, depth: int):
+        offset = (record["start_time_unix_nano"] - origin) / 1e9
+        attributes = " ".join(f"{key}={value}" for key, value in record["attributes"].items())
+        status = " ERROR" if record["status"] == "error" else ""
+        lines.append(
+            f"{offset:10.3f}s {record['duration_ms'] / 1000:10.3f}s  {'  ' * depth}{record['name']}{status}  {attributes}"
+        )
+        for child in children.get(record["span_id"], []):
+            render(child, depth + 1)
+
+    for root in children.get(None, []):
+        render(root, 0)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the span timeline of a stream from a span file")
+    parser.add_argument("stream_id")
+    parser.add_argument("--file", default=Config.TRACING_FILE)
+    args = parser.parse_args()
+
+    print(f"{'start':>11} {'duration':>11}  span")
+    for line in format_timeline(load_stream_spans(args.file, args.stream_id)):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
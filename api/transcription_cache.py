@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+from botocore.exceptions import BotoCoreError, ClientError
+from config import Config
+from s3_client import S3Client
+from transcription_client import TranscriptionBackend, Word, get_audio_duration_ms
+from typing import Iterator, Optional
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class TranscriptionCache(ABC):
+    """Content-addressed store of word-level transcriptions.
+
+    Entries are keyed by the SHA-256 of the chunk audio and of the backend configuration, so a chunk that was
+    already transcribed with the same settings is never sent to the provider again, whatever its file name.
+    Subclasses store the entries and keep the total size under max_bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_audio_ms = 0
+
+    def key(self, audio_path: str, backend: TranscriptionBackend) -> str:
+        digest = hashlib.sha256()
+        with open(audio_path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        digest.update(json.dumps(backend.cache_config(), sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[list[Word]]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, words: list[Word]):
+        pass
+
+    @abstractmethod
+    def evict(self):
+        pass
+
+    def iter_transcriptions(
+        self, backend: TranscriptionBackend, audio_paths: list[str]
+    ) -> Iterator[tuple[str, list[Word]]]:
+        """Yield cached transcriptions first, then transcribe the misses with backend and store them."""
+        keys = {audio_path: self.key(audio_path, backend) for audio_path in audio_paths}
+        misses = []
+
+        for audio_path in audio_paths:
+            words = self.get(keys[audio_path])
+            if words is None:
+                self.misses += 1
+                misses.append(audio_path)
+                continue
+
+            self.hits += 1
+            self.saved_audio_ms += get_audio_duration_ms(audio_path)
+            yield audio_path, words
+
+        for audio_path, words in backend.iter_transcriptions(misses):
+            self.put(keys[audio_path], words)
+            yield audio_path, words
+
+        if misses:
+            self.evict()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved_audio_seconds": self.saved_audio_ms / 1000,
+        }
+
+
+class LocalTranscriptionCache(TranscriptionCache):
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__(max_bytes)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[list[Word]]:
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as file:
+                words = json.load(file)
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return None
+        return [Word(*word) for word in words]
+
+    def put(self, key: str, words: list[Word]):
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(words, file)
+        os.replace(tmp_path, self.path(key))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class S3TranscriptionCache(TranscriptionCache):
+    """Cache shared by every worker through the bucket.
+
+    The cache only saves work, so S3 errors degrade a lookup to a miss instead of failing the task. Eviction removes
+    the oldest written entries first; listing the prefix is costly, so each process runs it at most once every
+    TRANSCRIPTION_CACHE_EVICT_INTERVAL seconds.
+    """
+
+    last_eviction = None
+
+    def __init__(self, s3_client: S3Client, prefix: str, max_bytes: int):
+        super().__init__(max_bytes)
+        self.s3_client = s3_client
+        self.prefix = prefix.rstrip("/")
+
+    def object_name(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[list[Word]]:
+        client = self.s3_client.client
+        try:
+            response = client.get_object(Bucket=self.s3_client.bucket_name, Key=self.object_name(key))
+            return [Word(*word) for word in json.loads(response["Body"].read())]
+        except client.exceptions.NoSuchKey:
+            return None
+        except (BotoCoreError, ClientError) as e:
+            print(f"error reading transcription cache entry {key}, treating it as a miss ({e})")
+            return None
+
+    def put(self, key: str, words: list[Word]):
+        self.s3_client.upload_json(words, self.object_name(key))
+
+    def evict(self):
+        now = time.monotonic()
+        last_eviction = S3TranscriptionCache.last_eviction
+        if last_eviction is not None and now - last_eviction < Config.TRANSCRIPTION_CACHE_EVICT_INTERVAL:
+            return
+        S3TranscriptionCache.last_eviction = now
+
+        client = self.s3_client.client
+        entries = []
+        try:
+            for page in client.get_paginator("list_objects_v2").paginate(
+                Bucket=self.s3_client.bucket_name, Prefix=f"{self.prefix}/"
+            ):
+                for item in page.get("Contents", []):
+                    entries.append((item["LastModified"], item["Size"], item["Key"]))
+        except (BotoCoreError, ClientError) as e:
+            print(f"error listing transcription cache, skipping eviction ({e})")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, object_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.s3_client.delete_file(object_name)
+            total -= size
+
+
+def get_transcription_cache(s3_client: S3Client) -> Optional[TranscriptionCache]:
+    if Config.TRANSCRIPTION_CACHE == "local":
+        return LocalTranscriptionCache(Config.TRANSCRIPTION_CACHE_DIR, Config.TRANSCRIPTION_CACHE_MAX_BYTES)
+
+    if Config.TRANSCRIPTION_CACHE == "s3":
+        return S3TranscriptionCache(s3_client, Config.TRANSCRIPTION_CACHE_PREFIX, Config.TRANSCRIPTION_CACHE_MAX_BYTES)
+
+    return None
@@ -0,0 +1,231 @@
+from abc import ABC, abstractmethod
+from config import Config
+from concurrent.futures import ThreadPoolExecutor
+from metrics import record_asr_chunk
+from rate_limiter import RateLimiter, get_asr_limiter
+from tracing import in_current_span, start_span
+from typing import Iterator, NamedTuple, Optional
+
+from lazy_import import lazy_import
+
+import itertools
+import os
+import threading
+import time
+import wave
+
+aai = lazy_import("assemblyai")
+ffmpeg = lazy_import("ffmpeg")
+
+
+class Word(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+
+class TranscriptionBackend(ABC):
+    """Base class for transcription providers.
+
+    Backends only implement submit() and poll(). iter_transcriptions() uploads every chunk up front and then checks
+    all outstanding jobs from the calling thread, so the number of chunks in flight is not bound to a thread count.
+    """
+
+    name = "base"
+
+    def __init__(self, poll_interval: float = 3.0, submit_concurrency: int = 8, limiter: Optional[RateLimiter] = None):
+        self.poll_interval = poll_interval
+        self.submit_concurrency = submit_concurrency
+        self.limiter = limiter
+
+    def cache_config(self) -> dict:
+        """Settings that change the transcription output, used to key cached results."""
+        return {"backend": self.name}
+
+    @abstractmethod
+    def submit(self, audio_path: str) -> str:
+        pass
+
+    @abstractmethod
+    def poll(self, job_id: str) -> Optional[list[Word]]:
+        """Return the words of a finished job, None while it is still running. Raises if the job failed."""
+
+    def iter_transcriptions(self, audio_paths: list[str]) -> Iterator[tuple[str, list[Word]]]:
+        """Yield (audio_path, words) for every chunk, in completion order.
+
+        A chunk that fails does not stop the others: every other chunk is still transcribed and yielded, and an
+        exception naming the failed chunks is raised at the end, so a checkpointed caller only has those left to
+        redo. With a limiter, each job holds one of its leases from submission until its words are available, so
+        the jobs of every worker sharing the limiter stay within its rate and in-flight limits. Each chunk is traced
+        as one span from its submission until its words are available.
+        """
+        backend = type(self).__name__
+        spans = {
+            audio_path: start_span("asr.chunk", backend=backend, audio=os.path.basename(audio_path))
+            for audio_path in audio_paths
+        }
+        leases = {}
+        submitted_at = {}
+        stopped = threading.Event()
+
+        def submit(audio_path: str) -> str:
+            if self.limiter is not None:
+                lease = self.limiter.acquire(stopped)
+                if lease is None:
+                    raise Exception("transcription stopped before submission")
+                leases[audio_path] = lease
+            submitted_at[audio_path] = time.monotonic()
+            return self.submit(audio_path)
+
+        def release(audio_path: str):
+            if audio_path in leases:
+                self.limiter.release([leases.pop(audio_path)])
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.submit_concurrency) as executor:
+                try:
+                    submit = in_current_span(submit)
+                    submissions = {executor.submit(submit, audio_path): audio_path for audio_path in audio_paths}
+                    pending = {}
+                    failed = []
+
+                    while submissions or pending:
+                        for future in [future for future in submissions if future.done()]:
+                            audio_path = submissions.pop(future)
+                            try:
+                                pending[audio_path] = future.result()
+                            except Exception as e:
+                                print(f"error submitting {audio_path} for transcription ({e})")
+                                release(audio_path)
+                                spans.pop(audio_path).end(error=repr(e))
+                                failed.append(audio_path)
+                                continue
+                            spans[audio_path].set(job_id=pending[audio_path])
+                            print(f"submitted {audio_path} for transcription ({pending[audio_path]})")
+
+                        for audio_path, job_id in list(pending.items()):
+                            try:
+                                words = self.poll(job_id)
+                            except Exception as e:
+                                print(f"error transcribing {audio_path} ({e})")
+                                del pending[audio_path]
+                                release(audio_path)
+                                spans.pop(audio_path).end(error=repr(e))
+                                failed.append(audio_path)
+                                continue
+                            if words is not None:
+                                del pending[audio_path]
+                                release(audio_path)
+                                record_asr_chunk(backend, time.monotonic() - submitted_at[audio_path])
+                                spans.pop(audio_path).end()
+                                yield audio_path, words
+
+                        if submissions or pending:
+                            if self.limiter is not None:
+                                self.limiter.renew(list(leases.values()))
+                            time.sleep(self.poll_interval)
+                finally:
+                    stopped.set()
+                    executor.shutdown(cancel_futures=True)
+
+            if failed:
+                raise Exception(f"transcription failed for {len(failed)} of {len(audio_paths)} chunks: {failed}")
+        finally:
+            if self.limiter is not None:
+                self.limiter.release(list(leases.values()))
+            for chunk_span in spans.values():
+                chunk_span.end(error="transcription did not finish")
+
+    def transcribe_many(self, audio_paths: list[str]) -> dict[str, list[Word]]:
+        return dict(self.iter_transcriptions(audio_paths))
+
+
+class AssemblyAITranscriptionBackend(TranscriptionBackend):
+    name = "assemblyai"
+
+    def __init__(self, api_key: str, **kwargs):
+        super().__init__(**kwargs)
+        aai.settings.api_key = api_key
+        self.config = aai.TranscriptionConfig(language_detection=True)
+        self.transcriber = aai.Transcriber(config=self.config)
+
+    def cache_config(self) -> dict:
+        return {"backend": self.name, "config": self.config.raw.json(exclude_none=True)}
+
+    def submit(self, audio_path: str) -> str:
+        transcript = self.transcriber.submit(audio_path)
+        if transcript.status == aai.TranscriptStatus.error:
+            raise Exception(f"failed to submit {audio_path} for transcription ({transcript.error})")
+        return transcript.id
+
+    def poll(self, job_id: str) -> Optional[list[Word]]:
+        transcript = aai.api.get_transcript(aai.Client.get_default().http_client, job_id)
+
+        if transcript.status == aai.TranscriptStatus.error:
+            raise Exception(f"transcription {job_id} failed ({transcript.error})")
+
+        if transcript.status != aai.TranscriptStatus.completed:
+            return None
+
+        return [Word(word.text, word.start, word.end) for word in transcript.words or []]
+
+
+class FakeTranscriptionBackend(TranscriptionBackend):
+    """Offline stand-in that returns one word every 400 ms of audio after a fixed simulated latency."""
+
+    name = "fake"
+    vocabulary = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+    word_interval = 400
+    word_duration = 300
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+
+    def cache_config(self) -> dict:
+        return {"backend": self.name, "word_interval": self.word_interval, "word_duration": self.word_duration}
+
+    def submit(self, audio_path: str) -> str:
+        duration_ms = get_audio_duration_ms(audio_path)
+        words = [
+            Word(self.vocabulary[i % len(self.vocabulary)], start, start + self.word_duration)
+            for i, start in enumerate(range(0, duration_ms - self.word_duration + 1, self.word_interval))
+        ]
+        job_id = f"fake-{next(self.job_ids)}"
+        self.jobs[job_id] = (time.monotonic() + self.latency, words)
+        return job_id
+
+    def poll(self, job_id: str) -> Optional[list[Word]]:
+        ready_at, words = self.jobs[job_id]
+        if time.monotonic() < ready_at:
+            return None
+
+        del self.jobs[job_id]
+        return words
+
+
+def get_audio_duration_ms(audio_path: str) -> int:
+    if audio_path.endswith(".wav"):
+        with wave.open(audio_path, "rb") as reader:
+            return reader.getnframes() * 1000 // reader.getframerate()
+
+    return int(float(ffmpeg.probe(audio_path)["format"]["duration"]) * 1000)
+
+
+def get_transcription_backend(name: Optional[str] = None) -> TranscriptionBackend:
+    name = name or Config.TRANSCRIPTION_BACKEND
+    options = {
+        "poll_interval": Config.TRANSCRIPTION_POLL_INTERVAL,
+        "submit_concurrency": Config.TRANSCRIPTION_SUBMIT_CONCURRENCY,
+        "limiter": get_asr_limiter(),
+    }
+
+    if name == AssemblyAITranscriptionBackend.name:
+        return AssemblyAITranscriptionBackend(Config.ASSEMBLY_AI_API_KEY, **options)
+
+    if name == FakeTranscriptionBackend.name:
+        return FakeTranscriptionBackend(latency=Config.TRANSCRIPTION_FAKE_LATENCY, **options)
+
+    raise ValueError(f"Unknown transcription backend: {name}")
@@ -7,22 +7,38 @@ from pydantic import BaseModel
 from config import Config
 from s3_client import S3Client
 from file_client import FileClient
-from transform_subtitle_task import transform_subtitle_task
-from models import TransformSubtitleRequest
+from scheduling import StageJob, send_stage_batch, send_stage_task
+from models import TransformSubtitleBatchRequest, TransformSubtitleRequest
 from auth import verify_token
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
 file_client = FileClient()
 
 router = APIRouter(prefix="/api", tags=["subtitles"])
 
+def transform_subtitle_job(request: TransformSubtitleRequest) -> StageJob:
+    return StageJob("transform_subtitle_task", request.stream_id, [
+        request.stream_id, request.subtitle_srt_file, request.options.model_dump()
+    ])
+
 @router.post("/transform-subtitle")
 def transform_subtitle(request: TransformSubtitleRequest, authenticated: bool = Depends(verify_token)):
     print(f"Starting transform subtitle for stream_id: {request.stream_id}")
 
-    transform_subtitle_task.delay(request.stream_id, request.subtitle_srt_file, request.options.model_dump())
+    send_stage_task(transform_subtitle_job(request))
 
     return {
         "stream_id": request.stream_id,
+    }
+
+@router.post("/transform-subtitle/batch")
+async def transform_subtitle_batch(batch: TransformSubtitleBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting transform subtitle for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, transform_subtitle_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
     }
\ No newline at end of file
@@ -1,39 +1,19 @@
 from typing import Any, Dict
-from celery import Celery
 from config import Config
-from kombu import Queue
+from worker import celery, task_options
 from s3_client import S3Client
+from callback_client import CallbackClient
 from file_client import FileClient
+from metrics import phase
 from models import TransformSubtitleOptionsRequest, TransformSubtitleResponse, TransformSubtitleFailureResponse
 
-import re
-import requests
+import subtitles
 
-celery = Celery(
-    "tasks",
-    broker=Config.RABBITMQ_URL,
-)
-
-celery.conf.update(
-    {
-        "task_serializer": "json",
-        "accept_content": ["json"],
-        "broker_connection_retry_on_startup": True,
-        "task_routes": {
-            "tasks.transform_subtitle_task": {"queue": "transform_subtitle_task"},
-        },
-        "task_queues": [
-            Queue(
-                "transform_subtitle_task", routing_key="transform_subtitle_task"
-            )
-        ],
-    }
-)
-
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
 file_client = FileClient()
 
-@celery.task(name="tasks.transform_subtitle_task", queue='transform_subtitle_task')
+@celery.task(name="tasks.transform_subtitle_task", **task_options("transform_subtitle_task"))
 def transform_subtitle_task(stream_id: str, subtitle_srt_file: str, options: TransformSubtitleOptionsRequest):
     try:
         print(f"Processing transform subtitle for {stream_id}")
@@ -46,37 +26,17 @@ def transform_subtitle_task(stream_id: str, subtitle_srt_file: str, options: Tra
         ass_file_name = subtitle_srt_file.replace('.srt', '.ass')
         output_ass_path = f"/tmp/{ass_file_name}"
 
-        if not s3_client.download_file(s3_srt_key, output_srt_path):
-            raise Exception("Failed to download subtitles from S3")
+        with phase("download"):
+            if not s3_client.download_file(s3_srt_key, output_srt_path):
+                raise Exception("Failed to download subtitles from S3")
             
-        with open(output_srt_path, "r", encoding="utf-8") as srt_file, open(
-                output_ass_path, "w", encoding="utf-8"
-            ) as ass_file:
-                ass_file.write(get_ass_header(options))
-
-                srt_content = srt_file.read().strip()
-                srt_blocks = re.split(r"\n\s*\n", srt_content)
-
-                for block in srt_blocks:
-                    lines = block.split("\n")
-                    if len(lines) < 3:
-                        continue
-
-                    start_time, end_time = lines[1].split(" --> ")
-                    start_time = srt_time_to_ass(start_time)
-                    end_time = srt_time_to_ass(end_time)
-
-                    text = " ".join(lines[2:])
-                    formatted_text = split_lines(text)
-
-                    ass_file.write(
-                        f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{formatted_text}\n"
-                    )
+        convert_srt_to_ass(output_srt_path, output_ass_path, options)
 
         s3_ass_key = f"{stream_id}/{ass_file_name}"
 
-        if not s3_client.upload_file(output_ass_path, s3_ass_key):
-            raise Exception("Failed to upload subtitles to S3")
+        with phase("upload"):
+            if not s3_client.upload_file(output_ass_path, s3_ass_key):
+                raise Exception("Failed to upload subtitles to S3")
         
         file_client.delete_file(output_ass_path)
         file_client.delete_file(output_srt_path)
@@ -89,40 +49,15 @@ def transform_subtitle_task(stream_id: str, subtitle_srt_file: str, options: Tra
         print(f"Sending transform subtitle success response to processor for {stream_id}")
         print(response.dict())
 
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/transform-subtitle",
-            json=response.dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
+        callback_client.send("/processor/transform-subtitle", response)
     except Exception as e:
         print(f"Sending transform subtitle failure response to processor for {stream_id}")
-        requests.post(
-            Config.SUBSTREAM_API_URL + "/processor/transform-subtitle-failure",
-            json=TransformSubtitleFailureResponse(
-                stream_id=stream_id,
-            ).dict(),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": Config.PROCESSOR_TOKEN
-            }
-        )
-
-def srt_time_to_ass(srt_time):
-    h, m, s = srt_time.split(":")
-    s, ms = s.split(",")
-    return f"{int(h)}:{int(m):02}:{int(s):02}.{ms[:2]}"
+        callback_client.send("/processor/transform-subtitle-failure", TransformSubtitleFailureResponse(
+            stream_id=stream_id,
+        ))
 
-def split_lines(text, max_words=4):
-    words = text.split()
-    mid = len(words) // 2 if len(words) > max_words else len(words)
-    return (
-        " ".join(words[:mid]) + r"\N" + " ".join(words[mid:])
-        if len(words) > max_words
-        else text
-    )
+def convert_srt_to_ass(srt_path: str, ass_path: str, options: TransformSubtitleOptionsRequest):
+    subtitles.write_ass(subtitles.read_srt(srt_path), ass_path, get_ass_header(options))
 
 def get_ass_header(options: TransformSubtitleOptionsRequest):
     return f"""
@@ -7,22 +7,41 @@ from pydantic import BaseModel
 from config import Config
 from s3_client import S3Client
 from file_client import FileClient
-from transform_video_task import transform_video_task
-from models import TransformVideoRequest
+from scheduling import StageJob, estimate_stream_seconds, send_stage_batch, send_stage_task
+from models import TransformVideoBatchRequest, TransformVideoRequest
 from auth import verify_token
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
 file_client = FileClient()
 
 router = APIRouter(prefix="/api", tags=["video"])
 
+def transform_video_job(request: TransformVideoRequest) -> StageJob:
+    media_seconds = estimate_stream_seconds(
+        s3_client, request.stream_id, request.file_name, request.duration, request.size
+    )
+    return StageJob("transform_video_task", request.stream_id, [
+        request.stream_id, request.file_name, request.options.model_dump(), request.subtitle_ass_file
+    ], media_seconds)
+
 @router.post("/transform-video")
 def transform_video(request: TransformVideoRequest, authenticated: bool = Depends(verify_token)):
     print(f"Starting transform video for stream_id: {request.stream_id}")
 
-    transform_video_task.delay(request.stream_id, request.file_name, request.options.model_dump())
+    send_stage_task(transform_video_job(request))
 
     return {
         "stream_id": request.stream_id,
+    }
+
+@router.post("/transform-video/batch")
+async def transform_video_batch(batch: TransformVideoBatchRequest, authenticated: bool = Depends(verify_token)):
+    print(f"Starting transform video for {len(batch.requests)} streams")
+
+    stream_ids = await run_in_threadpool(send_stage_batch, transform_video_job, batch.requests)
+
+    return {
+        "stream_ids": stream_ids,
     }
\ No newline at end of file
@@ -1,188 +1,347 @@
 from typing import Any, Dict
-from celery import Celery
 from config import Config
-from kombu import Queue
+from worker import celery, task_options
 from s3_client import S3Client
+from callback_client import CallbackClient
 from file_client import FileClient
-from models import TransformVideoOptionsRequest, TransformVideoResponse, TransformVideoFailureResponse
+from models import TransformVideoOptionsRequest, TransformVideoResponse, TransformVideoFailureResponse, VideoMetadata
+from video_metadata import get_video_metadata, probe_keyframes, probe_video_metadata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from lazy_import import lazy_import
+from metrics import phase, record_ffmpeg
+from tracing import in_current_span, span
 
 import re
-import requests
-import ffmpeg
+import os
+import shutil
+import tempfile
+import time
 
-celery = Celery(
-    "tasks",
-    broker=Config.RABBITMQ_URL,
-)
-
-celery.conf.update(
-    {
-        "task_serializer": "json",
-        "accept_content": ["json"],
-        "broker_connection_retry_on_startup": True,
-        "task_routes": {
-            "tasks.transform_video_task": {"queue": "transform_video_task"},
-        },
-        "task_queues": [
-            Queue(
-                "transform_video_task", routing_key="transform_video_task"
-            )
-        ],
-    }
-)
+ffmpeg = lazy_import("ffmpeg")
 
-s3_client = S3Client(Config)
+s3_client = S3Client.shared(Config)
+callback_client = CallbackClient.shared(Config)
 file_client = FileClient()
 
-@celery.task(name="tasks.transform_video_task", queue='transform_video_task')
-def transform_video_task(stream_id: str, file_name: str, options: TransformVideoOptionsRequest):
+ENCODE_OPTIONS = dict(
+    vcodec='libx264',
+    acodec='aac',
+    preset='ultrafast',     # Plus rapide
+    crf=28,                # Qualité plus basse
+    maxrate='2M',          # Bitrate plus bas
+    bufsize='4M',
+    pix_fmt='yuv420p',
+    movflags='faststart',
+    threads=0,             # Multi-thread
+    x264opts='threads=0'
+)
+
+@celery.task(name="tasks.transform_video_task", **task_options("transform_video_task"))
+def transform_video_task(
+    stream_id: str, file_name: str, options: TransformVideoOptionsRequest, subtitle_ass_file: Optional[str] = None
+):
     print(f"Processing transform video for {stream_id}")
     options = TransformVideoOptionsRequest(**options)
 
-    s3_key = f"{stream_id}/{file_name}"
-    file_name_transformed = file_name.replace('.mp4', '.transformed.mp4')
-    s3_key_transformed = f"{stream_id}/{file_name_transformed}"
-    output_path = f"/tmp/{file_name}"
-    output_path_transformed = f"/tmp/{file_name_transformed}"
+    try:
+        s3_key = f"{stream_id}/{file_name}"
+        file_name_transformed = file_name.replace('.mp4', '.transformed.mp4')
+        s3_key_transformed = f"{stream_id}/{file_name_transformed}"
+        output_path = f"/tmp/{file_name}"
+        output_path_transformed = f"/tmp/{file_name_transformed}"
+
+        with phase("download"):
+            if not s3_client.download_file(s3_key, output_path, cached=True):
+                raise Exception("Failed to download video from S3")
 
-    if not s3_client.download_file(s3_key, output_path):
-        raise Exception("Failed to download video from S3")
+            subtitle_path = None
+            if subtitle_ass_file:
+                subtitle_path = f"/tmp/{subtitle_ass_file}"
+                if not s3_client.download_file(f"{stream_id}/{subtitle_ass_file}", subtitle_path):
+                    raise Exception("Failed to download subtitles from S3")
 
-    if options.video_format == "original":
-        print("no transformation needed for original format")
+        metadata = get_video_metadata(s3_client, stream_id, file_name, output_path)
 
-    if options.video_format == "zoomed_916":
-        if not transform_video_to_zoomed_916(output_path, output_path_transformed):
-            raise Exception("Failed to transform video to TikTok format")
+        started = time.monotonic()
+        with phase("ffmpeg"):
+            outputs = transform_video(output_path, output_path_transformed, options, subtitle_path, metadata)
+        if not outputs:
+            raise Exception("Failed to transform video")
+        record_ffmpeg(options.video_format, metadata.duration, time.monotonic() - started, metadata.fps)
+
+        with phase("upload"):
+            uploads = s3_client.upload_many([(path, f"{stream_id}/{os.path.basename(path)}") for path in outputs])
+        if not uploads.success:
+            raise Exception("Failed to upload transformed video to S3")
+
+        if not file_client.delete_file(output_path):
+            raise Exception("Failed to delete video file")
+
+        for path in outputs:
+            file_client.delete_file(path)
+
+        if subtitle_path:
+            file_client.delete_file(subtitle_path)
+
+        response = TransformVideoResponse(
+            file_name_transformed=file_name_transformed,
+            file_names_transformed_parts=[os.path.basename(path) for path in outputs[1:]],
+            stream_id=stream_id,
+        )
 
-    if not s3_client.upload_file(output_path_transformed, s3_key_transformed):
-        raise Exception("Failed to upload transformed video to S3")
+        print(f"Sending transform video success response to processor for {stream_id}")
+        print(response.dict())
 
-    if not file_client.delete_file(output_path):
-        raise Exception("Failed to delete video file")
+        callback_client.send("/processor/transform-video", response)
+    except Exception as e:
+        print(f"Sending transform video failure response to processor for {stream_id}")
 
-    response = TransformVideoResponse(
-        file_name_transformed=file_name_transformed,
-        stream_id=stream_id,
-    )
+        callback_client.send("/processor/transform-video-failure", TransformVideoFailureResponse(
+            stream_id=stream_id,
+        ))
 
-    print(f"Sending transform video success response to processor for {stream_id}")
-    print(response.dict())
+def transform_video(
+    input_path: str,
+    output_path: str,
+    options: TransformVideoOptionsRequest,
+    subtitle_path: Optional[str] = None,
+    metadata: Optional[VideoMetadata] = None,
+) -> list[str]:
+    """Write the transformed video to output_path, plus options.video_parts part files when more than one part is
+    requested, with subtitle_path burned in when given. Returns every written path, the full video first, or an
+    empty list on failure."""
+    if options.video_format == "zoomed_916":
+        outputs = transform_video_to_zoomed_916(input_path, output_path, options.video_parts, subtitle_path, metadata)
+        if not outputs:
+            print("Failed to transform video to TikTok format")
+        return outputs
 
-    requests.post(
-        Config.SUBSTREAM_API_URL + "/processor/transform-video",
-        json=response.dict(),
-    )
+    print("no transformation needed for original format")
+    if options.video_parts <= 1 and not subtitle_path:
+        shutil.copyfile(input_path, output_path)
+        return [output_path]
 
-def transform_video_to_zoomed_916(input_path: str, output_path: str) -> bool:
     try:
-        probe = ffmpeg.probe(input_path)
-        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-        original_width = int(video_stream['width'])
-        original_height = int(video_stream['height'])
-        
-        max_width = 1080
-        max_height = 1920
-
-        target_aspect_ratio = max_width / max_height
-        original_aspect_ratio = original_width / original_height
-
-        print(f"Original width: {original_width}, Original height: {original_height}")
-        print(f"Target width: {max_width}, Target height: {max_height}")
-        print(f"Original aspect ratio: {original_aspect_ratio}, Target aspect ratio: {target_aspect_ratio}")
-        
-        if abs(original_aspect_ratio - target_aspect_ratio) < 0.01:
-            if original_width <= max_width and original_height <= max_height:
-                print("Video is already in correct 9:16 format and resolution, copying without re-encoding")
+        metadata = metadata or probe_video_metadata(input_path)
+        return encode_video(input_path, output_path, metadata, None, options.video_parts, subtitle_path)
+    except Exception as e:
+        print(f"Error transforming video: {e}")
+        return []
+
+def transform_video_to_zoomed_916(
+    input_path: str,
+    output_path: str,
+    parts: int = 1,
+    subtitle_path: Optional[str] = None,
+    metadata: Optional[VideoMetadata] = None,
+) -> list[str]:
+    try:
+        metadata = metadata or probe_video_metadata(input_path)
+        filters = get_zoomed_916_filters(metadata)
+        return encode_video(input_path, output_path, metadata, filters, parts, subtitle_path)
+
+    except Exception as e:
+        print(f"Error transforming video to zoomed 9:16: {e}")
+        return []
+
+def get_zoomed_916_filters(metadata: VideoMetadata) -> Optional[list[tuple]]:
+    """Return the (filter, args) chain that turns the video into 9:16, or None when it can be copied as is."""
+    original_width = metadata.width
+    original_height = metadata.height
+
+    max_width = 1080
+    max_height = 1920
+
+    target_aspect_ratio = max_width / max_height
+    original_aspect_ratio = original_width / original_height
+
+    print(f"Original width: {original_width}, Original height: {original_height}")
+    print(f"Target width: {max_width}, Target height: {max_height}")
+    print(f"Original aspect ratio: {original_aspect_ratio}, Target aspect ratio: {target_aspect_ratio}")
+
+    if abs(original_aspect_ratio - target_aspect_ratio) < 0.01:
+        if original_width <= max_width and original_height <= max_height:
+            print("Video is already in correct 9:16 format and resolution, copying without re-encoding")
+            return None
+
+        print("Video is 9:16 but too large, scaling down to max 1080x1920")
+        return [('scale', (max_width, max_height))]
+
+    if original_aspect_ratio > target_aspect_ratio:
+        new_width = int(original_height * target_aspect_ratio)
+        x_offset = (original_width - new_width) // 2
+        crop_width = new_width
+        crop_height = original_height
+        crop_x = x_offset
+        crop_y = 0
+    else:
+        new_height = int(original_width / target_aspect_ratio)
+        y_offset = (original_height - new_height) // 2
+        crop_width = original_width
+        crop_height = new_height
+        crop_x = 0
+        crop_y = y_offset
+
+    if crop_width <= max_width and crop_height <= max_height:
+        print("Video is already in correct 9:16 format and resolution, cropping without re-encoding")
+        return [('crop', (crop_width, crop_height, crop_x, crop_y))]
+
+    print("Video is 9:16 but too large, cropping and scaling down to max 1080x1920")
+    return [('crop', (crop_width, crop_height, crop_x, crop_y)), ('scale', (max_width, max_height))]
+
+def apply_filters(stream, filters: list[tuple]):
+    for name, args in filters:
+        stream = stream.filter(name, *args)
+    return stream
+
+def encode_video(
+    input_path: str,
+    output_path: str,
+    metadata: VideoMetadata,
+    filters: Optional[list[tuple]],
+    parts: int = 1,
+    subtitle_path: Optional[str] = None,
+) -> list[str]:
+    """Encode input_path with filters (None copies the streams), burning subtitle_path in the same filter graph.
+
+    Long videos with video to encode are split at keyframes into segments that are encoded concurrently and
+    concatenated back without re-encoding; the audio track is encoded once from the source. When parts > 1, the
+    video is split into that many segments, and each one is also written as a separate part file.
+    """
+    duration = metadata.duration
+    has_audio = metadata.audio_codec is not None
+
+    if subtitle_path:
+        filters = (filters or []) + [('ass', (subtitle_path,))]
+
+    if parts > 1:
+        segment_count = parts
+    elif filters is None:
+        # Copying is one pass over the file; segments would only add I/O and re-encode the audio.
+        segment_count = 1
+    else:
+        segment_count = min(
+            Config.TRANSFORM_VIDEO_SEGMENTS, max(1, int(duration // Config.TRANSFORM_VIDEO_MIN_SEGMENT_DURATION))
+        )
+
+    if segment_count <= 1:
+        with span("ffmpeg.encode", output=os.path.basename(output_path), copy=filters is None):
+            if filters is None:
                 ffmpeg.input(input_path).output(output_path, vcodec='copy', acodec='copy').overwrite_output().run()
-                return True
             else:
-                print("Video is 9:16 but too large, scaling down to max 1080x1920")
-                (
-                    ffmpeg
-                    .input(input_path)
-                    .filter('scale', max_width, max_height)
-                    .output(
-                        output_path,
-                        vcodec='libx264',
-                        acodec='aac',
-                        preset='ultrafast',     # Plus rapide
-                        crf=28,                # Qualité plus basse
-                        maxrate='2M',          # Bitrate plus bas
-                        bufsize='4M',
-                        pix_fmt='yuv420p',
-                        movflags='faststart',
-                        threads=0,             # Multi-thread
-                        x264opts='threads=0'
-                    )
-                    .overwrite_output()
-                    .run()
-                )
-                return True
-
-        if original_aspect_ratio > target_aspect_ratio:
-            new_width = int(original_height * target_aspect_ratio)
-            x_offset = (original_width - new_width) // 2
-            crop_width = new_width
-            crop_height = original_height
-            crop_x = x_offset
-            crop_y = 0
-        else:
-            new_height = int(original_width / target_aspect_ratio)
-            y_offset = (original_height - new_height) // 2
-            crop_width = original_width
-            crop_height = new_height
-            crop_x = 0
-            crop_y = y_offset
-        
-        if crop_width <= max_width and crop_height <= max_height:
-            print("Video is already in correct 9:16 format and resolution, cropping without re-encoding")
-            (
-                ffmpeg
-                .input(input_path)
-                .filter('crop', crop_width, crop_height, crop_x, crop_y)
-                .output(
-                    output_path,
-                    vcodec='libx264',
-                    acodec='aac',
-                    preset='ultrafast',     # Plus rapide
-                    crf=28,                # Qualité plus basse
-                    maxrate='2M',          # Bitrate plus bas
-                    bufsize='4M',
-                    pix_fmt='yuv420p',
-                    movflags='faststart',
-                    threads=0,             # Multi-thread
-                    x264opts='threads=0'
-                )
-                .overwrite_output()
-                .run()
-            )
-        else:
-            print("Video is 9:16 but too large, cropping and scaling down to max 1080x1920")
-            (
-                ffmpeg
-                .input(input_path)
-                .filter('crop', crop_width, crop_height, crop_x, crop_y)
-                .filter('scale', max_width, max_height)
-                .output(
-                    output_path,
-                    vcodec='libx264',
-                    acodec='aac',
-                    preset='ultrafast',     # Plus rapide
-                    crf=28,                # Qualité plus basse
-                    maxrate='2M',          # Bitrate plus bas
-                    bufsize='4M',
-                    pix_fmt='yuv420p',
-                    movflags='faststart',
-                    threads=0,             # Multi-thread
-                    x264opts='threads=0'
-                )
-                .overwrite_output()
-                .run()
+                source = ffmpeg.input(input_path)
+                streams = [apply_filters(source.video, filters)]
+                if has_audio:
+                    streams.append(source.audio)
+                ffmpeg.output(*streams, output_path, **ENCODE_OPTIONS).overwrite_output().run()
+        return [output_path]
+
+    if not metadata.keyframes:
+        # Streamed downloads leave the keyframe index out of the sidecar; the local copy is cheap to read it from.
+        metadata = metadata.model_copy(update={"keyframes": probe_keyframes(input_path)})
+
+    workdir = tempfile.mkdtemp(dir=os.path.dirname(output_path))
+    try:
+        segments = split_segments(input_path, workdir, plan_segment_times(metadata, segment_count))
+        print(f"Video split in {len(segments)} segments")
+
+        if filters is not None:
+            threads = max(1, (os.cpu_count() or 1) // len(segments))
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                encoded = list(executor.map(
+                    in_current_span(
+                        lambda segment: encode_segment(segment[0], filters, threads, segment[1] if subtitle_path else None)
+                    ),
+                    segments,
+                ))
+            segments = [(path, start, end) for path, (_, start, end) in zip(encoded, segments)]
+
+        concat_segments([path for path, _, _ in segments], input_path if has_audio else None, output_path, workdir)
+
+        outputs = [output_path]
+        if parts > 1:
+            for index, (path, start, end) in enumerate(segments):
+                part_path = output_path.replace('.mp4', f'.part{index + 1}.mp4')
+                mux_part(path, input_path if has_audio else None, start, end, part_path)
+                outputs.append(part_path)
+
+        return outputs
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def plan_segment_times(metadata: VideoMetadata, segment_count: int) -> list[float]:
+    """Return the cut times for segment_count even segments, snapped to the nearest known keyframe."""
+    targets = [metadata.duration * index / segment_count for index in range(1, segment_count)]
+    if not metadata.keyframes:
+        return targets
+
+    times = []
+    for target in targets:
+        keyframe = min(metadata.keyframes, key=lambda time: abs(time - target))
+        if 0 < keyframe < metadata.duration and (not times or keyframe > times[-1]):
+            times.append(keyframe)
+    return times
+
+def split_segments(input_path: str, workdir: str, segment_times: list[float]) -> list[tuple[str, float, float]]:
+    """Split the video stream at the first keyframe at or after each of segment_times, without re-encoding."""
+    segment_list = f"{workdir}/segments.csv"
+    with span("ffmpeg.split", segments=len(segment_times) + 1):
+        (
+            ffmpeg
+            .input(input_path)['v:0']
+            .output(
+                f"{workdir}/segment_%04d.mp4",
+                vcodec='copy',
+                f='segment',
+                segment_times=",".join(f"{max(time - 0.001, 0):.3f}" for time in segment_times),
+                reset_timestamps=1,
+                segment_list=segment_list,
+                segment_list_type='csv',
             )
-        
-        return True
+            .overwrite_output()
+            .run(quiet=True)
+        )
 
-    except Exception as e:
-        print(f"Error transforming video to zoomed 9:16: {e}")
-        return False
\ No newline at end of file
+    segments = []
+    with open(segment_list, "r") as file:
+        for line in file:
+            name, start, end = line.strip().split(",")
+            segments.append((f"{workdir}/{name}", float(start), float(end)))
+    return segments
+
+def encode_segment(segment_path: str, filters: list[tuple], threads: int, start: Optional[float] = None) -> str:
+    """Encode one segment. With a start, timestamps are shifted to stream time around the filters so burned
+    subtitles line up, then reset for the concat."""
+    encoded_path = segment_path.replace('.mp4', '.encoded.mp4')
+    options = dict(ENCODE_OPTIONS, threads=threads, x264opts=f'threads={threads}')
+    if start is not None:
+        filters = [('setpts', (f'PTS+{start}/TB',))] + filters + [('setpts', ('PTS-STARTPTS',))]
+    with span("ffmpeg.encode_segment", segment=os.path.basename(segment_path), threads=threads):
+        (
+            apply_filters(ffmpeg.input(segment_path), filters)
+            .output(encoded_path, **options)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+    return encoded_path
+
+def concat_segments(segment_paths: list[str], audio_path: Optional[str], output_path: str, workdir: str):
+    concat_list = f"{workdir}/concat.txt"
+    with open(concat_list, "w") as file:
+        file.writelines(f"file '{path}'\n" for path in segment_paths)
+
+    streams = [ffmpeg.input(concat_list, f='concat', safe=0).video]
+    if audio_path:
+        streams.append(ffmpeg.input(audio_path).audio)
+
+    with span("ffmpeg.concat", segments=len(segment_paths)):
+        ffmpeg.output(*streams, output_path, vcodec='copy', acodec='aac', movflags='faststart').overwrite_output().run(quiet=True)
+
+def mux_part(video_path: str, audio_path: Optional[str], start: float, end: float, part_path: str):
+    streams = [ffmpeg.input(video_path).video]
+    if audio_path:
+        streams.append(ffmpeg.input(audio_path, ss=start, t=end - start).audio)
+
+    with span("ffmpeg.mux_part", part=os.path.basename(part_path)):
+        ffmpeg.output(*streams, part_path, vcodec='copy', acodec='aac', movflags='faststart').overwrite_output().run(quiet=True)
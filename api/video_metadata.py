@@ -0,0 +1,103 @@
+from models import VideoMetadata
+from s3_client import S3Client
+from lazy_import import lazy_import
+from tracing import span
+
+import subprocess
+
+ffmpeg = lazy_import("ffmpeg")
+
+
+def get_metadata_file_name(file_name: str) -> str:
+    return file_name.replace('.mp4', '.metadata.json')
+
+
+def build_video_metadata(info: dict, video_path: str, keyframes: bool = True) -> VideoMetadata:
+    """Build the sidecar from the yt-dlp info dict, filling what it lacks from the container header.
+
+    With keyframes, the keyframe index is read from video_path as well. It is left empty when video_path is remote,
+    since reading it would fetch the whole video again; transform_video then reads it from its local copy.
+    """
+    metadata = VideoMetadata(
+        duration=float(info.get("duration") or 0),
+        width=int(info.get("width") or 0),
+        height=int(info.get("height") or 0),
+        video_codec=info.get("vcodec") if info.get("vcodec") not in (None, "none") else None,
+        audio_codec=info.get("acodec") if info.get("acodec") not in (None, "none") else None,
+        fps=info.get("fps"),
+        audio_sample_rate=info.get("asr"),
+    )
+
+    if not (metadata.duration and metadata.width and metadata.height and metadata.video_codec):
+        probed = probe_video_metadata(video_path)
+        metadata = metadata.model_copy(update={
+            name: value for name, value in probed.model_dump().items() if not getattr(metadata, name)
+        })
+
+    if keyframes:
+        metadata.keyframes = probe_keyframes(video_path)
+    return metadata
+
+
+def probe_video_metadata(video_path: str) -> VideoMetadata:
+    with span("ffprobe.metadata"):
+        probe = ffmpeg.probe(video_path)
+    video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+    audio_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'audio'), None)
+
+    fps = None
+    if video_stream and video_stream.get('avg_frame_rate', '0/0') != '0/0':
+        numerator, denominator = video_stream['avg_frame_rate'].split('/')
+        fps = int(numerator) / int(denominator)
+
+    return VideoMetadata(
+        duration=float(probe['format']['duration']),
+        width=int(video_stream['width']) if video_stream else 0,
+        height=int(video_stream['height']) if video_stream else 0,
+        video_codec=video_stream['codec_name'] if video_stream else None,
+        audio_codec=audio_stream['codec_name'] if audio_stream else None,
+        fps=fps,
+        audio_sample_rate=int(audio_stream['sample_rate']) if audio_stream else None,
+    )
+
+
+def probe_keyframes(video_path: str) -> list[float]:
+    """Return the keyframe times of the first video stream.
+
+    ffprobe only decodes keyframes (-skip_frame nokey) and prints one CSV line per keyframe, which is read line by
+    line from the pipe, so memory holds the keyframe times only and not a dict per packet.
+    """
+    keyframes = []
+    try:
+        with span("ffprobe.keyframes"):
+            process = subprocess.Popen(
+                [
+                    "ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+                    "-show_entries", "frame=pts_time", "-of", "csv=print_section=0", video_path,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for line in process.stdout:
+                time = line.strip().rstrip(",")
+                if time and time != "N/A":
+                    keyframes.append(round(float(time), 3))
+            _, error = process.communicate()
+            if process.returncode != 0:
+                raise Exception(error.strip() or f"ffprobe exited with code {process.returncode}")
+    except Exception as e:
+        print(f"error reading keyframes of {video_path} ({e})")
+        return []
+
+    return keyframes
+
+
+def get_video_metadata(s3_client: S3Client, stream_id: str, file_name: str, video_path: str) -> VideoMetadata:
+    """Read the sidecar written by get_video_task, probing the local file for videos that predate it."""
+    data = s3_client.download_json(f"{stream_id}/{get_metadata_file_name(file_name)}")
+    if data is not None:
+        return VideoMetadata(**data)
+
+    print(f"no metadata sidecar for {file_name}, probing {video_path}")
+    return probe_video_metadata(video_path)
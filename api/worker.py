@@ -0,0 +1,223 @@
+from celery import Celery, Task
+from celery.exceptions import Ignore
+from celery.signals import celeryd_init
+from config import Config
+from kombu import Queue
+from metrics import record_lane_deferral
+from rate_limiter import FileLimiterStore, RateLimiter
+from typing import Optional
+
+import job_store
+import metrics
+import tracing
+
+TASK_MODULES = [
+    "get_video_task",
+    "extract_sound_task",
+    "generate_subtitles_task",
+    "transform_subtitle_task",
+    "transform_video_task",
+    "fused_pipeline_task",
+]
+
+# Per-queue settings. Every queue runs in its own worker service, so the concurrency and prefetch hints are applied
+# to the worker that consumes it (command line options win). acks_late is only enabled for queues whose tasks finish
+# well within the broker consumer timeout (30 minutes by default on RabbitMQ); longer tasks ack on receipt and rely
+# on a prefetch multiplier of 1 so an idle process never holds more than one waiting message.
+#
+# Queues with long_slots have a second lane, {queue}_long, for jobs on long media (see scheduling.py). Their worker
+# consumes both lanes but runs at most long_slots long jobs at a time, so short jobs never wait behind a backlog of
+# long ones and always find a free process, while long jobs keep a guaranteed share of the worker. That only holds
+# while long_slots is below concurrency, which is checked below.
+#
+# soft_time_limit is sized for jobs below SCHEDULING_LONG_JOB_SECONDS of media. A job sent to a long lane gets it
+# scaled by its length instead, up to long_time_limit (see lane_time_limits). With acks_late, the long lane is
+# declared with a consumer timeout covering that limit (RabbitMQ 3.12 or later), so the broker does not close the
+# channel of a long job that has not acked yet.
+QUEUES = {
+    "get_video_task": {
+        "concurrency": 4,
+        "prefetch_multiplier": 1,
+        "acks_late": False,
+        "soft_time_limit": 3 * 3600,
+    },
+    "extract_sound_task": {
+        "concurrency": 2,
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+        "soft_time_limit": 1200,
+        "long_slots": 1,
+        "long_time_limit": 3 * 3600,
+    },
+    "generate_subtitles_task": {
+        "concurrency": 8,
+        "prefetch_multiplier": 1,
+        "acks_late": False,
+        "soft_time_limit": 2 * 3600,
+        "long_slots": 4,
+        "long_time_limit": 8 * 3600,
+    },
+    "transform_subtitle_task": {
+        "concurrency": 4,
+        "prefetch_multiplier": 4,
+        "acks_late": True,
+        "soft_time_limit": 300,
+    },
+    "transform_video_task": {
+        "concurrency": 2,
+        "prefetch_multiplier": 1,
+        "acks_late": False,
+        "soft_time_limit": 4 * 3600,
+        "long_slots": 1,
+        "long_time_limit": 8 * 3600,
+    },
+    "fused_pipeline_task": {
+        "concurrency": 1,
+        "prefetch_multiplier": 1,
+        "acks_late": False,
+        "soft_time_limit": 8 * 3600,
+    },
+}
+
+HARD_TIME_LIMIT_GRACE = 300
+LONG_LANE_SUFFIX = "_long"
+
+for queue, settings in QUEUES.items():
+    if settings.get("long_slots", 0) >= settings["concurrency"]:
+        raise ValueError(f"long_slots of {queue} must be below its concurrency, or short jobs wait behind long ones")
+
+
+def lane_queues(queue: str) -> list[str]:
+    """The queues a task of queue can be routed to: the queue itself and, with lanes, its long lane."""
+    if Config.SCHEDULING_LANES and "long_slots" in QUEUES[queue]:
+        return [queue, f"{queue}{LONG_LANE_SUFFIX}"]
+    return [queue]
+
+
+def longest_time_limit(queue: str) -> int:
+    """The longest soft time limit a task of queue runs with, on any of its lanes."""
+    settings = QUEUES[queue]
+    return max(settings["soft_time_limit"], settings.get("long_time_limit", 0))
+
+
+def lane_time_limits(queue: str, lane: str, media_seconds: Optional[float]) -> tuple[int, int]:
+    """Soft and hard time limits of a job of media_seconds sent to lane."""
+    settings = QUEUES[queue]
+    soft_time_limit = settings["soft_time_limit"]
+    if lane.endswith(LONG_LANE_SUFFIX) and media_seconds:
+        scaled = soft_time_limit * media_seconds / Config.SCHEDULING_LONG_JOB_SECONDS
+        soft_time_limit = int(min(max(soft_time_limit, scaled), longest_time_limit(queue)))
+    return soft_time_limit, soft_time_limit + HARD_TIME_LIMIT_GRACE
+
+
+def declare_lane(queue: str, lane: str) -> Queue:
+    if not lane.endswith(LONG_LANE_SUFFIX) or not QUEUES[queue]["acks_late"]:
+        return Queue(lane, routing_key=lane)
+    consumer_timeout = (longest_time_limit(queue) + 2 * HARD_TIME_LIMIT_GRACE) * 1000
+    return Queue(lane, routing_key=lane, queue_arguments={"x-consumer-timeout": consumer_timeout})
+
+
+celery = Celery(
+    "tasks",
+    broker=Config.RABBITMQ_URL,
+    include=TASK_MODULES,
+)
+
+celery.conf.update(
+    {
+        "task_serializer": "json",
+        "accept_content": ["json"],
+        "broker_connection_retry_on_startup": True,
+        "task_routes": {f"tasks.{queue}": {"queue": queue} for queue in QUEUES},
+        "task_queues": [declare_lane(queue, lane) for queue in QUEUES for lane in lane_queues(queue)],
+        "task_reject_on_worker_lost": True,
+        "worker_prefetch_multiplier": 1,
+    }
+)
+
+
+class LaneTask(Task):
+    """Task that runs a delivery from a long lane only while the worker has a free long slot.
+
+    Slots are leases of a limiter in a file shared by the worker's processes. A long job that finds them all taken
+    is published again on the same lane, due in SCHEDULING_DEFER_DELAY seconds, instead of occupying a process.
+    Unlike a retry, a deferral keeps the retry count and the time limits of the task, so it does not use up the
+    retries the task makes on errors.
+    """
+
+    long_lane_limiters = {}
+
+    def __call__(self, *args, **kwargs):
+        lane = (self.request.delivery_info or {}).get("routing_key") or ""
+        if not lane.endswith(LONG_LANE_SUFFIX):
+            return super().__call__(*args, **kwargs)
+
+        limiter = get_long_lane_limiter(lane)
+        lease, _ = limiter.try_acquire()
+        if lease is None:
+            print(f"all {limiter.max_in_flight} long slots of {lane} are busy, deferring {self.request.id}")
+            record_lane_deferral(lane)
+            self.apply_async(
+                args,
+                kwargs,
+                task_id=self.request.id,
+                queue=lane,
+                routing_key=lane,
+                countdown=Config.SCHEDULING_DEFER_DELAY,
+                retries=self.request.retries,
+                time_limit=(self.request.timelimit or (None, None))[0],
+                soft_time_limit=(self.request.timelimit or (None, None))[1],
+            )
+            raise Ignore()
+
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            limiter.release([lease])
+
+
+def get_long_lane_limiter(lane: str) -> RateLimiter:
+    if lane not in LaneTask.long_lane_limiters:
+        settings = QUEUES[lane.removesuffix(LONG_LANE_SUFFIX)]
+        LaneTask.long_lane_limiters[lane] = RateLimiter(
+            lane,
+            FileLimiterStore(f"{Config.SCHEDULING_SLOTS_DIR}/{lane}.json", settings["long_slots"]),
+            rate=1e9,
+            burst=settings["long_slots"],
+            max_in_flight=settings["long_slots"],
+            lease_ttl=longest_time_limit(lane.removesuffix(LONG_LANE_SUFFIX)) + HARD_TIME_LIMIT_GRACE,
+        )
+    return LaneTask.long_lane_limiters[lane]
+
+
+def task_options(queue: str) -> dict:
+    """Options for the celery.task decorator of the task consuming queue."""
+    settings = QUEUES[queue]
+    return {
+        "base": LaneTask,
+        "queue": queue,
+        "acks_late": settings["acks_late"],
+        "soft_time_limit": settings["soft_time_limit"],
+        "time_limit": settings["soft_time_limit"] + HARD_TIME_LIMIT_GRACE,
+    }
+
+
+@celeryd_init.connect
+def configure_worker(conf=None, options=None, **kwargs):
+    queues = options.get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+
+    # The lanes of a queue are served by the same worker.
+    queues = {queue.removesuffix(LONG_LANE_SUFFIX) for queue in queues}
+    if len(queues) != 1:
+        return
+
+    queue = queues.pop()
+    if queue not in QUEUES:
+        return
+
+    settings = QUEUES[queue]
+    conf.worker_prefetch_multiplier = settings["prefetch_multiplier"]
+    conf.worker_concurrency = settings["concurrency"]
+    print(f"worker for {queue}: concurrency {settings['concurrency']}, prefetch {settings['prefetch_multiplier']}")